@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Benchmarks hors prod des traitements du script PROD-28230
+Usage : python3 scripts/snowflake_bench.py [nombre de lignes]
+        python3 scripts/snowflake_bench.py --warehouse 10k,1M [--latency 0.05] [--only search_logs]
+"""
+
+import argparse
+import contextlib
+import multiprocessing
+import os
+import queue as queues
+import random
+import resource
+import time
+from datetime import date, datetime, timedelta
+
+import snowflake_fake as fake
+import snowflake_prod28230 as prod
+
+STATUSES = ["ONGOING_REMINDER", "CLOSED", "LITIGATION", "PAUSED"]
+# Durée max d'une fonction mesurée avant abandon de son processus
+BENCH_TIMEOUT = 30 * 60
+AGENCIES = ["TERRE OCCITANE", "MARSEILLE", "NICE", "TOULOUSE", "NARBONNE"]
+
+
+def synthetic_recovery_rows(n, seed=42):
+    """Lignes RECOVERY_CO synthétiques au format RECOVERY_COLUMNS (montants en centimes)"""
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1)
+    return [
+        (
+            date(2025, 1 + i % 11, 1),
+            rng.choice(AGENCIES),
+            f"COPRO {i}",
+            str(100_000_000 + i),
+            float(rng.randint(1, 3)),
+            rng.choice(STATUSES),
+            rng.random() < 0.8,
+            rng.randint(0, 500_000),
+            rng.randint(0, 500_000),
+            f"{i:024x}",
+            start + timedelta(minutes=i),
+        )
+        for i in range(n)
+    ]
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def bench_recovery_classification(n):
+    """Filtre ONGOING_REMINDER + niveau + centimes → euros : boucle de tuples vs lots Arrow"""
+    rows = synthetic_recovery_rows(n)
+    loop_time, loop_result = _timed(lambda: list(prod.classify_recovery_rows(rows)))
+    print(f"  boucle tuples    : {loop_time:8.3f}s ({n / loop_time:,.0f} lignes/s)")
+
+    try:
+        pa, _ = prod._require_arrow()
+    except RuntimeError as e:
+        print(f"  lots Arrow       : ignoré ({e})")
+        return
+
+    # Lots tels que fournis par fetch_arrow_batches (construction hors chrono)
+    columns = list(zip(*rows))
+    table = pa.table({name: list(values) for name, values in zip(prod.RECOVERY_COLUMNS, columns)})
+    batches = table.to_batches(max_chunksize=prod.FETCH_BATCH_SIZE * 10)
+
+    # Chemin de production : classification vectorisée puis retour aux tuples affichés
+    arrow_time, arrow_result = _timed(lambda: list(prod.classify_recovery_arrow(batches)))
+    print(f"  lots Arrow       : {arrow_time:8.3f}s ({n / arrow_time:,.0f} lignes/s)"
+          f" → x{loop_time / arrow_time:.1f}")
+    kernel_time, _ = _timed(lambda: [prod.classify_recovery_batch(b) for b in batches])
+    print(f"    dont calcul    : {kernel_time:8.3f}s (reste : conversion to_pylist / tuples)")
+
+    assert len(arrow_result) == len(loop_result), (len(arrow_result), len(loop_result))
+
+
+WAREHOUSE_SCALES = {"10k": 10_000, "1M": 1_000_000, "10M": 10_000_000}
+
+# Fonctions d'investigation mesurées sur le faux warehouse (limit=None : extraction complète)
+WAREHOUSE_BENCHMARKS = {
+    "search_logs": lambda conn: prod.search_logs(conn, limit=None),
+    "search_logs[hour]": lambda conn: prod.search_logs(conn, limit=None, time_slice="hour"),
+    "search_reminder_errors": lambda conn: prod.search_reminder_errors(conn, limit=None),
+    "search_reminder_errors[hour]": lambda conn: prod.search_reminder_errors(conn, limit=None, time_slice="hour"),
+    "find_and_query_recovery": lambda conn: prod.find_and_query_recovery(conn, limit=None),
+    "check_events_history": lambda conn: prod.check_events_history(conn),
+    # Copie locale de RECOVERY_CO (téléchargement complet), puis recherches servies par elle
+    "recovery_snapshot": lambda conn: _bench_snapshot().refresh(conn, full=True),
+    "check_events_history[snapshot]": lambda conn: prod.check_events_history(conn, snapshot=_bench_snapshot()),
+    "find_and_query_recovery[snapshot]": lambda conn: prod.find_and_query_recovery(
+        conn, limit=None, snapshot=_bench_snapshot()),
+    "investigate_overlapped": lambda conn: prod.investigate_overlapped(conn),
+    "explore_plato_recoveryfiles": lambda conn: prod.explore_plato_recoveryfiles(conn),
+    "explore_datadog_archive": lambda conn: prod.explore_datadog_archive(conn),
+    "explore_recovery_co": lambda conn: prod.explore_recovery_co(conn),
+    "explore_all_databases": lambda conn: prod.explore_all_databases(conn),
+    "query_recovery_data": lambda conn: prod.query_recovery_data(conn),
+}
+
+
+def _bench_snapshot():
+    """Copie locale de RECOVERY_CO propre aux benchmarks (remplie par « recovery_snapshot »)"""
+    return prod.RecoverySnapshot(os.path.join(prod.CACHE_DIR, "bench", "recovery_co.sqlite"))
+
+
+def warehouse_path(rows):
+    """Base SQLite synthétique de `rows` lignes, générée une fois puis réutilisée"""
+    path = os.path.join(prod.CACHE_DIR, "bench", f"warehouse-{rows}.sqlite")
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        print(f"  génération de {path}...")
+        seeded, _ = _timed(lambda: fake.seed_warehouse(path + ".tmp", rows))
+        os.replace(path + ".tmp", path)
+        print(f"  généré en {seeded:.1f}s")
+    return path
+
+
+def _bench_child(fn, data, latency, fetch_latency, queue):
+    """Exécute une fonction dans un processus dédié : le pic RSS lui est propre"""
+    conn = fake.connect(latency=latency, data=data, fetch_latency=fetch_latency)
+    rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            wall, _ = _timed(lambda: fn(conn))
+    except Exception as e:
+        queue.put({"error": f"{type(e).__name__}: {e}"})
+        return
+    queue.put({
+        "wall": wall,
+        "rows": conn.rows_fetched,
+        "queries": len(conn.queries),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "rss_delta_mb": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_start) / 1024,
+    })
+
+
+def bench_function(fn, data, latency=0.05, fetch_latency=0.0, timeout=BENCH_TIMEOUT):
+    """Temps, lignes lues, requêtes et pic RSS d'une fonction d'investigation ({"error": ...} en cas d'échec)"""
+    ctx = multiprocessing.get_context("fork")
+    queue = ctx.Queue()
+    child = ctx.Process(target=_bench_child, args=(fn, data, latency, fetch_latency, queue))
+    child.start()
+    deadline = time.monotonic() + timeout
+    result = None
+    while result is None:
+        try:
+            result = queue.get(timeout=1)
+        except queues.Empty:
+            if not child.is_alive():
+                # Processus mort sans résultat (crash, signal)
+                result = {"error": f"processus terminé sans résultat (code {child.exitcode})"}
+            elif time.monotonic() > deadline:
+                child.terminate()
+                result = {"error": f"abandon après {timeout}s"}
+    child.join()
+    return result
+
+
+def bench_warehouse(scales, latency=0.05, fetch_latency=0.0, only=None):
+    """Mesure les fonctions d'investigation sur le faux warehouse à chaque échelle"""
+    names = only or list(WAREHOUSE_BENCHMARKS)
+    for scale in scales:
+        rows = WAREHOUSE_SCALES.get(scale) or int(scale)
+        print(f"\n=== Faux warehouse : {rows:,} lignes (latence {latency * 1000:.0f} ms) ===")
+        data = warehouse_path(rows)
+        print(f"  {'fonction':<34} {'temps':>8} {'requêtes':>9} {'lignes':>10} {'lignes/s':>12} {'pic RSS':>9}")
+        for name in names:
+            r = bench_function(WAREHOUSE_BENCHMARKS[name], data, latency, fetch_latency)
+            if "error" in r:
+                print(f"  {name:<34} ❌ {r['error']}")
+                continue
+            print(f"  {name:<34} {r['wall']:7.2f}s {r['queries']:>9} {r['rows']:>10,}"
+                  f" {r['rows'] / r['wall']:>12,.0f} {r['peak_rss_mb']:>7.0f}Mo")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks hors prod PROD-28230")
+    parser.add_argument("rows", nargs="?", type=int, default=1_000_000,
+                        help="lignes pour la classification RECOVERY_CO")
+    parser.add_argument("--warehouse", metavar="ÉCHELLES",
+                        help="fonctions d'investigation sur le faux warehouse, ex. 10k,1M,10M")
+    parser.add_argument("--latency", type=float, default=0.05, help="latence simulée par requête (s)")
+    parser.add_argument("--fetch-latency", type=float, default=0.0, help="latence simulée par fetch (s)")
+    parser.add_argument("--only", action="append", choices=list(WAREHOUSE_BENCHMARKS),
+                        help="limite aux fonctions indiquées (répétable)")
+    args = parser.parse_args()
+
+    if args.warehouse:
+        bench_warehouse(args.warehouse.split(","), args.latency, args.fetch_latency, args.only)
+        return
+
+    print(f"=== Classification RECOVERY_CO ({args.rows:,} lignes) ===")
+    bench_recovery_classification(args.rows)
+
+
+if __name__ == "__main__":
+    main()
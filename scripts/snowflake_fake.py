@@ -0,0 +1,765 @@
+#!/usr/bin/env python3
+"""
+Faux connecteur Snowflake (DB-API) pour tester les scripts d'investigation hors prod
+Répond aux requêtes de métadonnées (SHOW, DESCRIBE, INFORMATION_SCHEMA) avec une latence réseau simulée ;
+avec `data=<fichier SQLite>` (voir seed_warehouse), les SELECT sont traduits en SQLite et exécutés
+sur RECOVERY_CO, RECOVERYFILES et LOGS_ML synthétiques
+"""
+
+import itertools
+import json
+import random
+import re
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+# Catalogue par défaut : {database: {schema: [tables]}}
+DEFAULT_CATALOG = {
+    "DATALAKE_ML_PROD": {
+        "PUBLIC": ["LOGS_ML"],
+        "PLATO": ["RECOVERYFILES", "RECOVERYFILES_HISTORY", "CUSTOMERS", "REMINDERS"],
+        "DATADOG_ARCHIVE": ["LOGS", "LOGS_LITIGATION"],
+    },
+    "DATAMART_ML_PROD": {
+        "ACCOUNTING": ["RECOVERY_CO", "LITIGATION_CO", "REMINDER_LOG"],
+        "RECOVERY_CO": ["RECOVERY_CO"],
+    },
+    "DATAPREP_ML_PROD": {
+        "ACCOUNTING": ["RECOVERY_PREP", "ACCOUNTS"],
+    },
+    "EXPORT_ML_PROD": {
+        "PUBLIC": ["EXPORT_RECOVERY"],
+    },
+    "WORKSPACE_ML_PROD": {
+        "PUBLIC": [],
+    },
+}
+
+# Colonnes connues : {table: [(nom, type)]}, les autres tables ont des colonnes génériques
+DEFAULT_COLUMNS = {
+    "LOGS_ML": [
+        ("TIMESTAMP", "TIMESTAMP_NTZ(9)"),
+        ("SERVICE", "VARCHAR(16777216)"),
+        ("LOG_LEVEL", "VARCHAR(16777216)"),
+        ("MESSAGE", "VARCHAR(16777216)"),
+        ("ATTRIBUTES", "VARIANT"),
+    ],
+    "RECOVERY_CO": [
+        ("DATE_PERIOD", "DATE"),
+        ("AGENCY_NAME", "VARCHAR(16777216)"),
+        ("CO_OWNER_FULL_NAME", "VARCHAR(16777216)"),
+        ("CO_OWNER_ACCOUNT_NUMBER", "VARCHAR(16777216)"),
+        ("LEVEL", "FLOAT"),
+        ("RECOVERY_STATUS", "VARCHAR(16777216)"),
+        ("AUTOMATIC_REMINDER", "BOOLEAN"),
+        ("AMOUNT", "NUMBER(38,0)"),
+        ("CALCULATED_AMOUNT", "NUMBER(38,0)"),
+        ("IS_EXCLUDED", "BOOLEAN"),
+        ("EXCLUSION_REASON", "VARCHAR(16777216)"),
+        ("RECOVERY_FILE_ID", "VARCHAR(16777216)"),
+        ("FILE_CREATION_DATE", "TIMESTAMP_NTZ(9)"),
+        ("LAST_REMINDER_DATE", "TIMESTAMP_NTZ(9)"),
+        ("NEXT_REMINDER_DATE", "TIMESTAMP_NTZ(9)"),
+        ("REMINDER_ID", "VARCHAR(16777216)"),
+        ("REMINDER_NAME", "VARCHAR(16777216)"),
+        ("EVENEMENTS", "VARIANT"),
+    ],
+    "RECOVERYFILES": [
+        ("_ID", "VARCHAR(16777216)"),
+        ("CUSTOMER", "VARIANT"),
+        ("LEVEL", "FLOAT"),
+        ("KIND", "VARCHAR(16777216)"),
+        ("AMOUNT", "NUMBER(38,0)"),
+        ("AUTOMATICREMINDER", "BOOLEAN"),
+        ("UPDATEDAT", "TIMESTAMP_NTZ(9)"),
+    ],
+}
+GENERIC_COLUMNS = [("ID", "VARCHAR(16777216)"), ("CREATED_AT", "TIMESTAMP_NTZ(9)")]
+
+_CREATED_ON = datetime(2024, 1, 1)
+
+# Types Snowflake → types déclarés SQLite (TIMESTAMP_NTZ / DATE reconvertis en datetime / date)
+_SQLITE_TYPES = {
+    "TIMESTAMP_NTZ": "TIMESTAMP_NTZ",
+    "DATE": "DATE",
+    "VARIANT": "TEXT",
+    "FLOAT": "REAL",
+    "NUMBER": "INTEGER",
+    "BOOLEAN": "INTEGER",
+    "VARCHAR": "TEXT",
+}
+# Colonnes de clustering : indexées pour imiter le pruning des micro-partitions
+_CLUSTERING_KEYS = {"LOGS_ML": "TIMESTAMP", "RECOVERY_CO": "DATE_PERIOD"}
+
+SERVICES = ["service-litigation", "service-litigation", "service-billing", "service-accounting"]
+LOG_LEVELS = ["INFO", "INFO", "INFO", "WARN", "ERROR"]
+LOG_MESSAGES = [
+    "reminder sent to co-owner",
+    "recovery file updated",
+    "dunning letter generated",
+    "cannotSendReminderReason=NOTHING_SENT",
+    "reminder skipped: LEVEL_MISMATCHED",
+    "reminder skipped: AMOUNT_BELOW threshold",
+    "CALCULATED_AMOUNT differs from FORECASTED_DEBT",
+    "invoice exported",
+    "healthcheck ok",
+]
+RECOVERY_STATUSES = ["ONGOING_REMINDER", "CLOSED", "LITIGATION", "PAUSED"]
+AGENCIES = ["TERRE OCCITANE", "MARSEILLE", "NICE", "TOULOUSE", "NARBONNE"]
+EVENT_TYPES = ["FILE_CREATED", "REMINDER_SENT", "LEVEL_CHANGED", "NOTHING_SENT"]
+
+
+class ProgrammingError(Exception):
+    """Erreur SQL (équivalent de snowflake.connector.errors.ProgrammingError)"""
+
+
+def generate_catalog(databases=5, schemas=6, tables=15):
+    """Génère un catalogue synthétique de taille arbitraire"""
+    return {
+        f"DB_{d:02d}": {
+            f"SCHEMA_{s:02d}": [f"TABLE_{t:03d}" for t in range(tables)]
+            for s in range(schemas)
+        }
+        for d in range(databases)
+    }
+
+
+def columns_of(table):
+    """Colonnes [(nom, type)] d'une table du faux catalogue"""
+    return DEFAULT_COLUMNS.get(table, GENERIC_COLUMNS)
+
+
+def _like(pattern, value):
+    """Équivalent (insensible à la casse) du LIKE SQL"""
+    regex = "".join(".*" if c == "%" else "." if c == "_" else re.escape(c) for c in pattern)
+    return re.fullmatch(regex, value, re.IGNORECASE) is not None
+
+
+def _sqlite_type(snowflake_type):
+    return _SQLITE_TYPES[snowflake_type.split("(")[0]]
+
+
+def _timestamp(value):
+    return datetime.fromisoformat(value.decode())
+
+
+def _date(value):
+    return date.fromisoformat(value.decode())
+
+
+sqlite3.register_converter("TIMESTAMP_NTZ", _timestamp)
+sqlite3.register_converter("DATE", _date)
+
+
+def _insert_batches(db, table, rows, batch_size):
+    columns = columns_of(table)
+    sql = f"INSERT INTO {table} VALUES ({', '.join('?' * len(columns))})"
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            db.executemany(sql, batch)
+            batch = []
+    if batch:
+        db.executemany(sql, batch)
+
+
+def _object_id(rng):
+    return "%024x" % rng.getrandbits(96)
+
+
+def _recovery_co_rows(n, rng):
+    """Photos mensuelles de dossiers : les premiers dossiers portent les comptes / IDs de l'incident"""
+    import snowflake_prod28230 as prod
+
+    periods = 12
+    files = max(1, n // periods)
+    for i in range(n):
+        file, month = i % files, (i // files) % periods
+        if file < len(prod.EXTERNAL_CODES):
+            account = prod.EXTERNAL_CODES[file]
+        else:
+            account = str(100_000_000 + file)
+        if file < len(prod.RECOVERY_IDS):
+            file_id = prod.RECOVERY_IDS[file]
+        else:
+            file_id = "%024x" % file
+        created = datetime(2024, 1, 1) + timedelta(minutes=file)
+        last_reminder = datetime(2025, 1 + month, 1) + timedelta(hours=rng.randint(0, 600))
+        level = float(rng.randint(1, 3))
+        events = [
+            {"type": "FILE_CREATED", "date": {"$date": created.isoformat()}, "level": 1},
+            {"type": rng.choice(EVENT_TYPES[1:]), "date": {"$date": last_reminder.isoformat()}, "level": level},
+        ]
+        yield (
+            date(2025, 1 + month, 1).isoformat(),
+            AGENCIES[file % len(AGENCIES)],
+            f"COPRO {file}",
+            account,
+            level,
+            rng.choice(RECOVERY_STATUSES),
+            int(rng.random() < 0.8),
+            rng.randint(0, 500_000),
+            rng.randint(0, 500_000),
+            int(rng.random() < 0.1),
+            None,
+            file_id,
+            created.isoformat(sep=" "),
+            last_reminder.isoformat(sep=" "),
+            (last_reminder + timedelta(days=15)).isoformat(sep=" "),
+            _object_id(rng),
+            f"Relance N{int(level)}",
+            json.dumps(events),
+        )
+
+
+def _recoveryfiles_rows(n, rng):
+    import snowflake_prod28230 as prod
+
+    for i in range(n):
+        customer = prod.CUSTOMER_IDS[i] if i < len(prod.CUSTOMER_IDS) else _object_id(rng)
+        yield (
+            prod.RECOVERY_IDS[i] if i < len(prod.RECOVERY_IDS) else _object_id(rng),
+            json.dumps({"$oid": customer}),
+            float(rng.randint(1, 3)),
+            "CO_OWNER",
+            rng.randint(0, 500_000),
+            int(rng.random() < 0.8),
+            (datetime(2025, 1, 1) + timedelta(minutes=i)).isoformat(sep=" "),
+        )
+
+
+def _logs_rows(n, rng, start=datetime(2025, 11, 3), days=3):
+    """Logs répartis sur `days` jours ; ~1 log sur 100 référence un client / compte de l'incident"""
+    import snowflake_prod28230 as prod
+
+    step = days * 86400 / max(n, 1)
+    for i in range(n):
+        attributes = {"requestId": _object_id(rng), "customer": {"$oid": _object_id(rng)}}
+        if rng.random() < 0.01:
+            attributes["customer"]["$oid"] = rng.choice(prod.CUSTOMER_IDS)
+            attributes["accountNumber"] = rng.choice(prod.EXTERNAL_CODES)
+        yield (
+            (start + timedelta(seconds=int(i * step))).isoformat(sep=" "),
+            rng.choice(SERVICES),
+            rng.choice(LOG_LEVELS),
+            rng.choice(LOG_MESSAGES),
+            json.dumps(attributes),
+        )
+
+
+def seed_warehouse(path, rows, seed=42, batch_size=50_000):
+    """Crée une base SQLite avec RECOVERY_CO et LOGS_ML (`rows` lignes) et RECOVERYFILES (`rows` / 10)"""
+    rng = random.Random(seed)
+    db = sqlite3.connect(path)
+    with db:
+        for table, generate in (
+            ("RECOVERY_CO", lambda: _recovery_co_rows(rows, rng)),
+            ("RECOVERYFILES", lambda: _recoveryfiles_rows(max(1, rows // 10), rng)),
+            ("LOGS_ML", lambda: _logs_rows(rows, rng)),
+        ):
+            columns = ", ".join(f"{name} {_sqlite_type(type_)}" for name, type_ in columns_of(table))
+            db.execute(f"DROP TABLE IF EXISTS {table}")
+            db.execute(f"CREATE TABLE {table} ({columns})")
+            _insert_batches(db, table, generate(), batch_size)
+            if table in _CLUSTERING_KEYS:
+                db.execute(f"CREATE INDEX idx_{table.lower()}_cluster ON {table} ({_CLUSTERING_KEYS[table]})")
+        db.execute("ANALYZE")
+    db.close()
+    return path
+
+
+_FQN = re.compile(r"\b\w+_ML_PROD\.\w+\.(\w+)\b")
+_FLATTEN = re.compile(
+    r"(, )?LATERAL FLATTEN\(input => TRY_PARSE_JSON\(TO_VARCHAR\((\w+)\.(\w+)\)\)"
+    r"(, recursive => TRUE)?(, outer => TRUE)?\) (\w+)",
+    re.IGNORECASE,
+)
+_VARIANT_PATH = re.compile(r"\b([A-Za-z_]\w*(?:\.[A-Za-z_]\w*)?)((?::(?:\"[^\"]*\"|\$?[A-Za-z_]\w*))+)")
+_QUALIFY = re.compile(
+    r"SELECT (.*?) (FROM .*?) QUALIFY (.+?) (=|<=|<) (\d+)(?: (ORDER BY .*?))?(?: (LIMIT \d+))?",
+    re.IGNORECASE | re.DOTALL,
+)
+QUALIFY_COLUMN = "_QUALIFY"
+# SAMPLE SYSTEM (p) : échantillonnage par blocs de lignes consécutives (≈ micro-partitions)
+_SAMPLE = re.compile(r"FROM (\w+) SAMPLE (?:SYSTEM|BLOCK) \(([\d.]+)\)(?: (?:SEED|REPEATABLE) \((\d+)\))?",
+                     re.IGNORECASE)
+SAMPLE_BLOCK_ROWS = 100
+# EXPLAIN : micro-partitions simulées, part lue quand le plan SQLite passe par un index (clé de clustering)
+PARTITION_ROWS = 1_000
+PARTITION_BYTES = 16 * 1024**2
+PRUNED_FRACTION = 0.05
+# MIN / MAX / COUNT(*) sans filtre : servis par les métadonnées des micro-partitions, aucun scan
+_METADATA_ONLY = re.compile(
+    r"SELECT (?:(?:MIN|MAX)\(\w+\)|COUNT\(\*\))(?:, (?:(?:MIN|MAX)\(\w+\)|COUNT\(\*\)))* FROM \w+",
+    re.IGNORECASE,
+)
+_PLAN_TABLE = re.compile(r"\b(SCAN|SEARCH) (\w+)")
+_TABLE_ALIAS = re.compile(
+    r"\b(?:FROM|JOIN) (\w+)(?: (?:AS )?(?!WHERE\b|JOIN\b|LEFT\b|INNER\b|ON\b|GROUP\b|ORDER\b|LIMIT\b)(\w+))?",
+    re.IGNORECASE,
+)
+
+
+def _json_path(match):
+    segments = re.findall(r":(\"[^\"]*\"|\$?\w+)", match.group(2))
+    path = "$" + "".join('."%s"' % seg.strip('"') for seg in segments)
+    return f"json_extract({match.group(1)}, '{path}')"
+
+
+def _sample(match):
+    table, percent, seed = match.group(1), float(match.group(2)), int(match.group(3) or 0)
+    block = f"((rowid / {SAMPLE_BLOCK_ROWS}) * 2654435761 + {seed}) % 1000000"
+    return f"FROM (SELECT * FROM {table} WHERE {block} < {percent * 10000:.0f}) {table}"
+
+
+class _ApproxCountDistinct:
+    """APPROX_COUNT_DISTINCT(x) : ici exact"""
+
+    def __init__(self):
+        self.values = set()
+
+    def step(self, value):
+        if value is not None:
+            self.values.add(value)
+
+    def finalize(self):
+        return len(self.values)
+
+
+class _ApproxTopK:
+    """APPROX_TOP_K(x, k) : tableau JSON [[valeur, occurrences], ...] (exact ici)"""
+
+    def __init__(self):
+        self.counts = {}
+        self.k = 1
+
+    def step(self, value, k):
+        self.k = k
+        if value is not None:
+            self.counts[value] = self.counts.get(value, 0) + 1
+
+    def finalize(self):
+        top = sorted(self.counts.items(), key=lambda item: -item[1])[:self.k]
+        return json.dumps([[value, count] for value, count in top])
+
+
+def _as_varchar(value):
+    """AS_VARCHAR(variant) : la chaîne si le VARIANT est une chaîne, sinon NULL"""
+    try:
+        value = json.loads(value)
+    except (TypeError, ValueError):
+        pass
+    return value if isinstance(value, str) else None
+
+
+def _contains(haystack, needle):
+    """CONTAINS(a, b) : NULL si l'un des deux est NULL"""
+    if haystack is None or needle is None:
+        return None
+    return str(needle) in str(haystack)
+
+
+def translate_sql(query):
+    """Traduit une requête Snowflake (mono-ligne) du script en SQLite
+
+    Noms qualifiés DB.SCHEMA.TABLE, casts ::, chemins VARIANT a:b, ILIKE,
+    LATERAL FLATTEN (→ json_each / json_tree), TRY_TO_DOUBLE, QUALIFY
+    (→ sous-requête filtrée sur une colonne _QUALIFY, retirée des résultats)
+    et SAMPLE SYSTEM (→ sous-requête sur un bloc de lignes sur `p` %).
+    """
+    sql = _FQN.sub(r"\1", query)
+    sql = _SAMPLE.sub(_sample, sql)
+    sql = re.sub(r"\bILIKE\b", "LIKE", sql, flags=re.IGNORECASE)
+    # f.SEQ (ligne source) → rowid de la table aplatie (+ : n'impose pas un parcours par rowid),
+    # f.INDEX → id de l'élément JSON
+    for _, table, _, _, _, alias in _FLATTEN.findall(sql):
+        sql = re.sub(rf"\b{alias}\.SEQ\b", f"+{table}.rowid", sql)
+        sql = re.sub(rf"\b{alias}\.INDEX\b", f"{alias}.id", sql)
+    sql = _FLATTEN.sub(_flatten, sql)
+    # Une date nue comparée à un TIMESTAMP vaut minuit (comparaison texte en SQLite)
+    sql = re.sub(r"'(\d{4}-\d{2}-\d{2})'(?!::)", r"'\1 00:00:00'", sql)
+    sql = re.sub(r"::\w+", "", sql)
+    sql = re.sub(r"TRY_TO_DOUBLE\(([^()]*)\)", r"CAST(\1 AS REAL)", sql, flags=re.IGNORECASE)
+    sql = _VARIANT_PATH.sub(_json_path, sql)
+
+    return _qualify(sql)
+
+
+def _flatten(match):
+    """LATERAL FLATTEN → json_each / json_tree ; OUTER => TRUE → LEFT JOIN (une ligne NULL si vide)"""
+    comma, table, column, recursive, outer, alias = match.groups()
+    source = f"{'json_tree' if recursive else 'json_each'}({table}.{column}) {alias}"
+    if outer:
+        return f" LEFT JOIN {source} ON 1"
+    return f"{comma or ''}{source}"
+
+
+def _qualify(sql):
+    """QUALIFY de la requête ou d'une sous-requête (SELECT ... QUALIFY ...) → filtre sur _QUALIFY"""
+    at = sql.rfind(" QUALIFY ")
+    if at < 0:
+        return sql
+    depth, start = 0, -1
+    for i in range(at, -1, -1):
+        if sql[i] == ")":
+            depth += 1
+        elif sql[i] == "(":
+            if depth == 0:
+                start = i
+                break
+            depth -= 1
+    end = len(sql)
+    if start >= 0:
+        depth = 0
+        for i in range(start, len(sql)):
+            depth += {"(": 1, ")": -1}.get(sql[i], 0)
+            if depth == 0:
+                end = i
+                break
+    m = _QUALIFY.fullmatch(sql[start + 1:end].strip())
+    if not m:
+        return sql
+    columns, source, window, op, value, order_by, limit = m.groups()
+    scope = f"SELECT {columns}, {window} AS {QUALIFY_COLUMN} {source}"
+    if order_by:
+        scope += f" {order_by}"
+    scope = f"SELECT * FROM ({scope}) WHERE {QUALIFY_COLUMN} {op} {value}"
+    if limit:
+        scope += f" {limit}"
+    return _qualify(sql[:start + 1] + scope + sql[end:])
+
+
+class FakeConnection:
+    """Connexion factice : chaque execute() attend `latency` secondes
+
+    data : base SQLite créée par seed_warehouse pour exécuter les SELECT
+    (une connexion SQLite partagée, sérialisée par un verrou : les tables
+    temporaires de session restent visibles de tous les threads).
+    fetch_latency : attente supplémentaire par aller-retour fetchone / fetchmany / fetchall.
+    execute_async() exécute la requête dans un thread ; statut et résultats par sfqid
+    comme le connecteur (get_query_status / get_results_from_sfqid).
+    """
+
+    def __init__(self, catalog=None, latency=0.05, data=None, fetch_latency=0.0):
+        self.catalog = DEFAULT_CATALOG if catalog is None else catalog
+        self.latency = latency
+        self.fetch_latency = fetch_latency
+        self.queries = []
+        self.rows_fetched = 0
+        self.closed = False
+        self.db = None
+        self.lock = threading.Lock()
+        self.async_queries = {}  # sfqid -> (terminée, curseur d'exécution, erreur)
+        self._query_ids = itertools.count(1)
+        if data is not None:
+            self.db = sqlite3.connect(data, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+            self.db.create_aggregate("APPROX_COUNT_DISTINCT", 1, _ApproxCountDistinct)
+            self.db.create_aggregate("APPROX_TOP_K", 2, _ApproxTopK)
+            self.db.create_function("AS_VARCHAR", 1, _as_varchar, deterministic=True)
+            self.db.create_function("CONTAINS", 2, _contains, deterministic=True)
+            self.db.create_function("TO_VARCHAR", 1, lambda v: None if v is None else str(v), deterministic=True)
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def get_query_status(self, sfqid):
+        done, _, error = self.async_queries[sfqid]
+        if not done.is_set():
+            return "RUNNING"
+        return "FAILED_WITH_ERROR" if error else "SUCCESS"
+
+    def get_query_status_throw_if_error(self, sfqid):
+        status = self.get_query_status(sfqid)
+        if status == "FAILED_WITH_ERROR":
+            raise self.async_queries[sfqid][2][0]
+        return status
+
+    def is_still_running(self, status):
+        return status == "RUNNING"
+
+    def is_an_error(self, status):
+        return status == "FAILED_WITH_ERROR"
+
+    def close(self):
+        self.closed = True
+        if self.db is not None:
+            self.db.close()
+
+
+class FakeCursor:
+    """Curseur factice compatible DB-API (execute / fetch* / description)"""
+
+    def __init__(self, conn):
+        self.connection = conn
+        self.description = None
+        self.rowcount = -1
+        self.sfqid = None
+        self._rows = []
+        self._pos = 0
+        self._sqlite = None
+        self._hidden = 0
+
+    def execute(self, query, params=None):
+        self.sfqid = self._submit(query)
+        return self._run(query, params)
+
+    def execute_async(self, query, params=None):
+        """Soumission sans attente : la requête tourne dans un thread, à suivre par sfqid"""
+        conn = self.connection
+        self.sfqid = self._submit(query)
+        done, worker, error = threading.Event(), FakeCursor(conn), []
+        worker.sfqid = self.sfqid
+        conn.async_queries[self.sfqid] = (done, worker, error)
+
+        def run():
+            try:
+                worker._run(query, params)
+            except ProgrammingError as e:
+                error.append(e)
+            finally:
+                done.set()
+
+        threading.Thread(target=run, daemon=True).start()
+        return {"queryId": self.sfqid}
+
+    def get_results_from_sfqid(self, sfqid):
+        done, worker, error = self.connection.async_queries[sfqid]
+        done.wait()
+        if error:
+            raise error[0]
+        self.sfqid = sfqid
+        self.description, self.rowcount = worker.description, worker.rowcount
+        self._rows, self._pos, self._sqlite, self._hidden = worker._rows, worker._pos, worker._sqlite, worker._hidden
+
+    def _submit(self, query):
+        conn = self.connection
+        conn.queries.append(query)
+        return f"fake-{next(conn._query_ids):06d}"
+
+    def _run(self, query, params):
+        conn = self.connection
+        if conn.latency:
+            time.sleep(conn.latency)
+        query = " ".join(re.sub(r"--[^\n]*", "", query).split())
+        self._sqlite = None
+        m = re.fullmatch(r"EXPLAIN USING JSON (.*)", query, re.IGNORECASE)
+        result = self._explain(m.group(1), params) if m else self._dispatch(query)
+        if result is None:
+            self._execute_sql(query, params)
+            return self
+        columns, rows = result
+        self.description = [(c, 2, None, None, None, None, True) for c in columns]
+        self._rows = rows
+        self._pos = 0
+        self.rowcount = len(rows)
+        return self
+
+    def executemany(self, query, seq_of_params):
+        conn = self.connection
+        conn.queries.append(query)
+        if conn.db is None:
+            raise ProgrammingError("executemany nécessite une base de données (data=...)")
+        if conn.latency:
+            time.sleep(conn.latency)
+        with conn.lock:
+            try:
+                conn.db.executemany(translate_sql(" ".join(query.split())).replace("%s", "?"), seq_of_params)
+            except sqlite3.Error as e:
+                raise ProgrammingError(f"SQL compilation error: {e}") from e
+        return self
+
+    def _execute_sql(self, query, params):
+        conn = self.connection
+        if conn.db is None:
+            raise ProgrammingError(f"SQL compilation error: requête non supportée par le faux connecteur: {query[:80]}")
+        m = re.fullmatch(r"CREATE OR REPLACE TEMPORARY TABLE (\w+) (.*)", query, re.IGNORECASE)
+        with conn.lock:
+            try:
+                if m:
+                    conn.db.execute(f"DROP TABLE IF EXISTS temp.{m.group(1)}")
+                    cursor = conn.db.execute(f"CREATE TEMPORARY TABLE {m.group(1)} {m.group(2)}")
+                else:
+                    sql = translate_sql(query)
+                    if params:
+                        sql = sql.replace("%s", "?")
+                    cursor = conn.db.execute(sql, params or ())
+            except sqlite3.Error as e:
+                raise ProgrammingError(f"SQL compilation error: {e}") from e
+        description = cursor.description or []
+        self._hidden = int(bool(description) and description[-1][0] == QUALIFY_COLUMN)
+        if self._hidden:
+            description = description[:-1]
+        self.description = [(d[0].upper(), 2, None, None, None, None, True) for d in description] or None
+        self._sqlite = cursor
+        self.rowcount = -1
+
+    def _dispatch(self, query):
+        catalog = self.connection.catalog
+
+        if re.fullmatch(r"SELECT 1", query, re.IGNORECASE):
+            return ["1"], [(1,)]
+
+        if re.fullmatch(r"SHOW DATABASES", query, re.IGNORECASE):
+            return ["created_on", "name"], [(_CREATED_ON, db) for db in catalog]
+
+        m = re.fullmatch(r"SHOW SCHEMAS IN DATABASE (\w+)", query, re.IGNORECASE)
+        if m:
+            db = self._database(m.group(1))
+            names = ["INFORMATION_SCHEMA"] + list(catalog[db])
+            return ["created_on", "name", "database_name"], [(_CREATED_ON, s, db) for s in names]
+
+        m = re.fullmatch(
+            r"SHOW TABLES(?: LIKE '([^']*)')? IN (DATABASE|SCHEMA) (\w+)(?:\.(\w+))?",
+            query, re.IGNORECASE,
+        )
+        if m:
+            pattern, scope, db, schema = m.groups()
+            db = self._database(db)
+            if scope.upper() == "SCHEMA":
+                if schema not in catalog[db]:
+                    raise ProgrammingError(f"Schema '{db}.{schema}' does not exist or not authorized.")
+                schemas = [schema]
+            else:
+                schemas = list(catalog[db])
+            rows = [
+                (_CREATED_ON, table, db, s, "TABLE")
+                for s in schemas
+                for table in catalog[db][s]
+                if pattern is None or _like(pattern, table)
+            ]
+            return ["created_on", "name", "database_name", "schema_name", "kind"], rows
+
+        m = re.fullmatch(r"DESCRIBE TABLE (\w+)\.(\w+)\.(\w+)", query, re.IGNORECASE)
+        if m:
+            db, schema, table = m.groups()
+            if table not in catalog.get(db, {}).get(schema, []):
+                raise ProgrammingError(f"Table '{db}.{schema}.{table}' does not exist or not authorized.")
+            rows = [(name, type_, "COLUMN", "Y") for name, type_ in columns_of(table)]
+            return ["name", "type", "kind", "null?"], rows
+
+        m = re.search(r"FROM (\w+)\.INFORMATION_SCHEMA\.SCHEMATA", query, re.IGNORECASE)
+        if m:
+            db = self._database(m.group(1))
+            rows = []
+            for schema in sorted(catalog[db]):
+                tables = sorted(catalog[db][schema])
+                if not tables:
+                    rows.append((schema, None, None, None))
+                for table in tables:
+                    rows += [(schema, table, name, type_) for name, type_ in columns_of(table)]
+            return ["SCHEMA_NAME", "TABLE_NAME", "COLUMN_NAME", "DATA_TYPE"], rows
+
+        return None
+
+    def _explain(self, query, params):
+        """EXPLAIN USING JSON : GlobalStats estimées depuis le plan SQLite
+
+        SCAN d'une table = toutes ses partitions, SEARCH (index de clustering) = PRUNED_FRACTION,
+        agrégats MIN / MAX / COUNT(*) sans filtre = aucune partition lue.
+        """
+        conn = self.connection
+        if conn.db is None:
+            raise ProgrammingError("EXPLAIN nécessite une base de données (data=...)")
+        sql = translate_sql(query)
+        if params:
+            sql = sql.replace("%s", "?")
+        with conn.lock:
+            try:
+                plan = [row[3] for row in conn.db.execute(f"EXPLAIN QUERY PLAN {sql}", params or ())]
+            except sqlite3.Error as e:
+                raise ProgrammingError(f"SQL compilation error: {e}") from e
+            rows = dict(conn.db.execute(
+                "SELECT tbl, MAX(CAST(stat AS INTEGER)) FROM sqlite_stat1 GROUP BY tbl"
+            ).fetchall())
+        aliases = {alias or table: table for table, alias in _TABLE_ALIAS.findall(sql)}
+        total, assigned = {}, {}
+        for access, name in (m.groups() for m in map(_PLAN_TABLE.search, plan) if m):
+            table = aliases.get(name, name)
+            if table not in rows:
+                continue  # Tables temporaires de session, json_each...
+            total[table] = -(-rows[table] // PARTITION_ROWS)
+            if _METADATA_ONLY.fullmatch(sql):
+                part = 0
+            elif access == "SCAN":
+                part = total[table]
+            else:
+                part = max(1, round(total[table] * PRUNED_FRACTION))
+            assigned[table] = max(assigned.get(table, 0), part)
+        stats = {
+            "partitionsTotal": sum(total.values()),
+            "partitionsAssigned": sum(assigned.values()),
+            "bytesAssigned": sum(assigned.values()) * PARTITION_BYTES,
+        }
+        return ["content"], [(json.dumps({"GlobalStats": stats, "Operations": [plan]}),)]
+
+    def _database(self, name):
+        if name not in self.connection.catalog:
+            raise ProgrammingError(f"Database '{name}' does not exist or not authorized.")
+        return name
+
+    def _fetch_sql(self, fetch, *args):
+        conn = self.connection
+        if conn.fetch_latency:
+            time.sleep(conn.fetch_latency)
+        with conn.lock:
+            rows = fetch(*args)
+        if self._hidden:
+            rows = [row[:-1] for row in rows]
+        conn.rows_fetched += len(rows)
+        return rows
+
+    def fetchone(self):
+        if self._sqlite is not None:
+            rows = self._fetch_sql(self._sqlite.fetchmany, 1)
+            return rows[0] if rows else None
+        if self._pos >= len(self._rows):
+            return None
+        row = self._rows[self._pos]
+        self._pos += 1
+        return row
+
+    def fetchmany(self, size=1):
+        if self._sqlite is not None:
+            return self._fetch_sql(self._sqlite.fetchmany, size)
+        rows = self._rows[self._pos:self._pos + size]
+        self._pos += len(rows)
+        return rows
+
+    def fetchall(self):
+        if self._sqlite is not None:
+            return self._fetch_sql(self._sqlite.fetchall)
+        rows = self._rows[self._pos:]
+        self._pos = len(self._rows)
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def close(self):
+        self._rows = []
+        self._sqlite = None
+
+
+def connect(catalog=None, latency=0.05, data=None, fetch_latency=0.0, **kwargs):
+    """Même signature que snowflake.connector.connect (paramètres ignorés)"""
+    return FakeConnection(catalog=catalog, latency=latency, data=data, fetch_latency=fetch_latency)
+
+
+if __name__ == "__main__":
+    # Démo : crawl séquentiel vs concurrent sur un catalogue synthétique
+    import contextlib
+    import io
+
+    import snowflake_prod28230 as prod
+
+    catalog = generate_catalog()
+    for workers in (1, prod.CRAWLER_MAX_WORKERS):
+        conn = FakeConnection(catalog=catalog, latency=0.05)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            prod.explore_all_databases(conn, databases=list(catalog), max_workers=workers)
+        elapsed = time.perf_counter() - start
+        print(f"workers={workers:2d} : {len(conn.queries)} requêtes en {elapsed:.2f}s")
@@ -2,10 +2,34 @@
 """
 Script pour investiguer PROD-28230 : Mises en demeure non envoyées
 Date de l'incident : 04/11/2025
+Usage : python3 scripts/snowflake_prod28230.py [--offline] [--profile] <commande> [options]
+        python3 scripts/snowflake_prod28230.py search-logs --from 2025-11-03 --to 2025-11-05 --accounts 101785816
+        python3 scripts/snowflake_prod28230.py batch incidents/*.json --workers 4
+        python3 scripts/snowflake_prod28230.py snapshot && python3 scripts/snowflake_prod28230.py recovery --snapshot
+        python3 scripts/snowflake_prod28230.py --help  (liste des commandes ; sans commande : investigate)
 """
 
-import snowflake.connector
-from datetime import datetime
+import argparse
+import contextlib
+import csv
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import os
+import pickle
+import re
+import sqlite3
+import sys
+import threading
+import tempfile
+import time
+import weakref
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+from decimal import Decimal
 
 # IDs des copropriétaires concernés (customer IDs MongoDB)
 CUSTOMER_IDS = [
@@ -19,89 +43,1734 @@ CUSTOMER_IDS = [
     "65765100ff47ee72e6cf5e4b",  # TERRE OCCITANE 102740597
 ]
 
-# Codes copropriétaires externes
+# Codes copropriétaires externes (= CO_OWNER_ACCOUNT_NUMBER dans RECOVERY_CO)
 EXTERNAL_CODES = [
-    "101785816",
-    "103041737",
-    "103046879",
-    "103034606",
-    "101291139",
-    "103144223",
-    "102732743",
-    "102740597",
+    "101785816",  # TOULOUSE
+    "103041737",  # MARSEILLE
+    "103046879",  # MARSEILLE
+    "103034606",  # MARSEILLE
+    "101291139",  # NICE
+    "103144223",  # LUDOVIC SANTOS
+    "102732743",  # CORENTIN DIASCORN
+    "102740597",  # MICKAEL MORIEUX
 ]
 
+# Recovery file IDs des cas bloqués
+RECOVERY_IDS = [
+    "68dc86391b778399d9e3ce46",  # JANINE ACCOT (NICE)
+    "68dca1e11b778399d9f9e42a",  # CORENTIN DIASCORN
+    "66ff32ac610e3077e4ec17fe",  # MORIEUX/HOARAU
+    "66ff4bd0610e3077e4edc7ba",  # MAURICE ALAYRAC (MARSEILLE)
+    "68ddfc5cde50e17d0c77da4d",  # LAURENT BONIER (MARSEILLE)
+    "67ee0e285d2af9484b88f22b",  # BRUNO SEGUIN (MARSEILLE)
+    "68de10ac4242e9fd5dd19f01",  # LUDOVIC SANTOS
+    "68dcbf4d1b778399d912fb75",  # LE PARC DES SEPT DENIERS (OK - passé N2)
+]
+
+# Incident par défaut : fenêtre de l'incident, agences et copropriétaires des cas LEVEL 1 recherchés
+INCIDENT_ID = "PROD-28230"
+INCIDENT_TITLE = "Mises en demeure non envoyées"
+INCIDENT_DATE_START = "2025-11-04"
+INCIDENT_DATE_END = "2025-11-05"
+LEVEL1_AGENCIES = ["TERRE OCCITANE", "NARBONNE"]
+LEVEL1_CO_OWNERS = ["SANTOS", "DIASCORN", "MORIEUX"]
+
+SNOWFLAKE_ACCOUNT = 'EMERIA-FRANCE'
+SNOWFLAKE_ROLE = 'PUBLIC'
+SNOWFLAKE_WAREHOUSE = 'WH_ML_PROD'
+
+# Cache local (catalogue, résultats...)
+CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "snowflake-prod28230"
+)
+
+# Durée de vie par défaut d'une entrée du catalogue (les schémas bougent rarement)
+CATALOG_TTL = 7 * 24 * 3600
+# Databases explorées / rechargées par défaut
+CATALOG_DATABASES = ["DATALAKE_ML_PROD", "DATAMART_ML_PROD", "DATAPREP_ML_PROD", "EXPORT_ML_PROD", "WORKSPACE_ML_PROD"]
+
+# Pool de sessions : connexions chaudes max, fermeture après inactivité, intervalle de keep-alive
+SESSION_POOL_SIZE = 4
+SESSION_IDLE_TIMEOUT = 30 * 60
+SESSION_KEEP_ALIVE = 5 * 60
+
+# Cache de résultats : taille max sur disque, âge max (ignoré en mode --offline)
+RESULT_CACHE_MAX_BYTES = 2 * 1024**3
+RESULT_CACHE_MAX_AGE = 24 * 3600
+# Au-delà, le résultat est servi en flux mais pas mis en cache
+RESULT_CACHE_MAX_ROWS = 1_000_000
+# Marqueur de lecture toujours relancée (sondes de fraîcheur) : résultat mis en cache pour --offline seulement
+FRESH = "/* fresh */"
+# Attente max d'une lecture identique déjà en vol (single-flight) avant de la relancer soi-même
+RESULT_CACHE_FLIGHT_TIMEOUT = 10 * 60
+
+# Filtres par IDs : au-delà de ce seuil, chargement via fichier stagé (PUT + COPY INTO)
+ID_FILTER_STAGE_THRESHOLD = 10_000
+ID_FILTER_INSERT_BATCH = 5_000
+
+# Taille des lots d'écriture des sorties (console, JSONL, CSV, Parquet)
+SINK_BATCH_SIZE = 10_000
+
+# Taille des lots fetchmany / pages keyset (mémoire bornée)
+FETCH_BATCH_SIZE = 10_000
+
+# Marqueur à placer dans le WHERE des requêtes paginables, remplacé par le prédicat keyset
+KEYSET = "/* keyset */ TRUE"
+
+# Scan de logs découpé par tranches de temps : marqueur remplacé par le prédicat de tranche
+TIME_SLICE = "/* time slice */ TRUE"
+TIME_SLICE_STEPS = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+LOG_SCAN_MAX_WORKERS = 8
+# Téléchargement concurrent d'une même fenêtre de logs : le second attend le verrou du premier
+LOG_STORE_LOCK_TIMEOUT = 10 * 60
+
+# Champs d'un événement dans EVENEMENTS (tableau JSON d'objets) : {champ local: clé JSON}
+EVENT_FIELDS = {"type": "type", "date": "date", "level": "level"}
+
+# Codes de raison recherchés dans les messages de logs (search_reminder_errors + search_logs)
+LOG_REASON_CODES = [
+    "NOTHING_SENT",
+    "cannotSendReminderReason",
+    "LEVEL_MISMATCHED",
+    "AMOUNT_BELOW",
+    "CALCULATED_AMOUNT",
+    "FORECASTED_DEBT",
+    "reminder",
+    "recovery",
+    "dunning",
+]
+
+# Surveillance incrémentale : marqueur remplacé par le prédicat de watermark (colonne > dernière valeur vue)
+WATERMARK = "/* watermark */ TRUE"
+MONITOR_LOG_LOOKBACK = timedelta(days=1)
+MONITOR_INTERVAL = 5 * 60
+
+# Détection des dossiers bloqués : requêtes par agence en parallèle
+STUCK_DETECTOR_MAX_WORKERS = 8
+
+# Exécution asynchrone (execute_async) : sondage du statut, intervalle initial doublé jusqu'au max
+ASYNC_POLL_INTERVAL = 0.05
+ASYNC_POLL_MAX_INTERVAL = 2.0
+
+# Garde-fou de coût : EXPLAIN avant chaque SELECT non servi par le cache ('warn', 'block' ou 'off').
+# Désactivé par défaut : un aller-retour de plus par lecture, par page keyset et par tranche de temps
+QUERY_GUARD_MODE = "off"
+QUERY_GUARD_MAX_BYTES = 10 * 10**9
+# Clés de clustering connues : un filtre dessus permet le pruning des micro-partitions
+CLUSTERING_KEYS = {"LOGS_ML": "TIMESTAMP", "RECOVERY_CO": "DATE_PERIOD"}
+
+# Profil de table : lignes visées par l'échantillon SAMPLE SYSTEM, valeurs fréquentes, durée de vie en cache
+PROFILE_SAMPLE_ROWS = 1_000_000
+PROFILE_TOP_K = 5
+PROFILE_TTL = 24 * 3600
+
+# Nombre max de requêtes de métadonnées envoyées en parallèle (1 = séquentiel)
+CRAWLER_MAX_WORKERS = 8
+
+# Copie locale de RECOVERY_CO : colonnes indexées (recherches par valeur / par plage), taille max du mmap SQLite
+SNAPSHOT_TABLE = ("DATAMART_ML_PROD", "ACCOUNTING", "RECOVERY_CO")
+SNAPSHOT_INDEXES = ["DATE_PERIOD", "CO_OWNER_ACCOUNT_NUMBER", "RECOVERY_FILE_ID", "AGENCY_NAME"]
+SNAPSHOT_MMAP_SIZE = 2 * 1024**3
+
+# Batch d'incidents : incidents investigués en parallèle (= sessions du pool partagé), checks par défaut
+INCIDENT_MAX_WORKERS = 4
+INCIDENT_DEFAULT_CHECKS = ["recovery", "events", "reminder-errors"]
+
 def connect():
-    """Connexion Snowflake via SSO"""
+    """Connexion Snowflake via SSO
+
+    Le jeton SSO est mis en cache par le connecteur (client_store_temporary_credential) :
+    seul le premier lancement ouvre le navigateur. Nécessite ALLOW_ID_TOKEN sur le compte.
+    Le connecteur n'est importé qu'ici : les lancements offline / servis par le cache ne le chargent pas.
+    """
+    import snowflake.connector
+
     return snowflake.connector.connect(
-        account='EMERIA-FRANCE',
+        account=SNOWFLAKE_ACCOUNT,
         user='FRX33355',
         authenticator='externalbrowser',
-        role='PUBLIC',
-        warehouse='WH_ML_PROD',
+        role=SNOWFLAKE_ROLE,
+        warehouse=SNOWFLAKE_WAREHOUSE,
         database='DATALAKE_ML_PROD',
-        schema='PUBLIC'
+        schema='PUBLIC',
+        client_store_temporary_credential=True,
+        client_session_keep_alive=True,
     )
 
-def search_logs(conn, date_start="2025-11-04", date_end="2025-11-05"):
-    """Recherche les logs liés aux relances contentieux"""
+class SessionPool:
+    """Pool de connexions authentifiées réutilisées par les fonctions d'investigation
+
+    Au plus `size` sessions ouvertes ; les sessions libres sont gardées chaudes par
+    un SELECT 1 toutes les `keep_alive` secondes et fermées après `idle_timeout`.
+    `connect_fn` permet de brancher un connecteur de test.
+    """
+
+    def __init__(self, connect_fn=None, size=SESSION_POOL_SIZE, idle_timeout=SESSION_IDLE_TIMEOUT,
+                 keep_alive=SESSION_KEEP_ALIVE):
+        self.connect_fn = connect_fn or connect
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.keep_alive = keep_alive
+        self.created = 0
+        self._idle = []  # [(conn, dernier usage)], la plus récente en dernier
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = None
+        if keep_alive:
+            self._thread = threading.Thread(target=self._maintain, name="snowflake-keepalive", daemon=True)
+            self._thread.start()
+
+    def acquire(self, timeout=None):
+        """Prend une session libre (la plus récemment utilisée) ou en ouvre une nouvelle"""
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError(f"Aucune session Snowflake libre après {timeout}s")
+        with self._lock:
+            conn = self._idle.pop()[0] if self._idle else None
+        if conn is None:
+            try:
+                conn = self.connect_fn()
+            except Exception:
+                self._slots.release()
+                raise
+            with self._lock:
+                self.created += 1
+        return conn
+
+    def release(self, conn, discard=False):
+        """Rend une session au pool (ou la ferme si `discard` ou pool fermé)"""
+        if not discard:
+            with self._lock:
+                # Vérifié sous le verrou : close() ne peut pas vider le pool entre les deux
+                if not self._closed.is_set():
+                    self._idle.append((conn, time.monotonic()))
+                    conn = None
+        if conn is not None:
+            _close_quietly(conn)
+        self._slots.release()
+
+    @contextlib.contextmanager
+    def connection(self, timeout=None):
+        conn = self.acquire(timeout=timeout)
+        discard = False
+        try:
+            yield conn
+        except Exception:
+            is_closed = getattr(conn, "is_closed", None)
+            discard = bool(is_closed and is_closed())
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    def prewarm(self, count=None):
+        """Ouvre `count` sessions en parallèle pour les garder prêtes"""
+        count = min(self.size, count or self.size)
+        with ThreadPoolExecutor(max_workers=count) as pool:
+            conns = list(pool.map(lambda _: self.acquire(), range(count)))
+        for conn in conns:
+            self.release(conn)
+
+    def adopt(self, conn):
+        """Confie à un pool neuf une session déjà ouverte (comptée dans `size` comme les autres)"""
+        with self._lock:
+            if self.created:
+                raise RuntimeError("adopt() : le pool a déjà ouvert des sessions")
+            self.created += 1
+        self._slots.acquire()
+        self.release(conn)
+
+    def _maintain(self):
+        """Thread de fond : ferme les sessions inactives, pingue les autres une par une
+
+        Une session en cours de ping occupe un slot : acquire() ne peut pas ouvrir
+        de session supplémentaire pendant ce temps et le total reste <= `size`.
+        """
+        while not self._closed.wait(self.keep_alive):
+            with self._lock:
+                idle = list(self._idle)
+            for entry in idle:
+                if self._closed.is_set() or not self._slots.acquire(blocking=False):
+                    break
+                with self._lock:
+                    try:
+                        self._idle.remove(entry)
+                    except ValueError:  # prise par acquire() entre-temps
+                        self._slots.release()
+                        continue
+                conn, last_used = entry
+                try:
+                    if time.monotonic() - last_used > self.idle_timeout:
+                        _close_quietly(conn)
+                        continue
+                    try:
+                        conn.cursor().execute("SELECT 1")
+                    except Exception:
+                        _close_quietly(conn)
+                        continue
+                    with self._lock:
+                        self._idle.append(entry)
+                        self._idle.sort(key=lambda e: e[1])
+                finally:
+                    self._slots.release()
+
+    def close(self):
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join()  # ping en cours terminé : la session pinguée est revenue (ou fermée)
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            _close_quietly(conn)
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+class CatalogCache:
+    """Cache local (SQLite) des métadonnées SHOW / DESCRIBE avec TTL par entrée
+
+    Une entrée est identifiée par (account, database, schema, table, kind) :
+      - kind = 'schemas' : schémas d'une database
+      - kind = 'tables'  : tables d'un schéma
+      - kind = 'columns' : colonnes [nom, type] d'une table
+      - kind = 'profile' : statistiques de colonnes sur échantillon (profile_table)
+    """
+
+    def __init__(self, path=None, ttl=CATALOG_TTL, account=SNOWFLAKE_ACCOUNT):
+        self.path = path or os.path.join(CACHE_DIR, "catalog.sqlite")
+        self.ttl = ttl
+        self.account = account
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS catalog_entries (
+                account TEXT NOT NULL,
+                database_name TEXT NOT NULL,
+                schema_name TEXT NOT NULL,
+                table_name TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (account, database_name, schema_name, table_name, kind)
+            )
+        """)
+        self._db.commit()
+
+    def get(self, kind, database, schema="", table=""):
+        """Retourne l'entrée si présente et non expirée, sinon None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT payload FROM catalog_entries"
+                " WHERE account = ? AND database_name = ? AND schema_name = ? AND table_name = ?"
+                " AND kind = ? AND expires_at > ?",
+                (self.account, database, schema, table, kind, time.time()),
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put(self, kind, database, schema="", table="", value=None, ttl=None):
+        self.put_many([(kind, database, schema, table, value)], ttl=ttl)
+
+    def put_many(self, entries, ttl=None):
+        """Enregistre des entrées (kind, database, schema, table, value) en une transaction"""
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO catalog_entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (self.account, database, schema, table, kind, json.dumps(value), now, expires_at)
+                    for kind, database, schema, table, value in entries
+                ],
+            )
+
+    def invalidate(self, database=None, schema=None, table=None):
+        """Supprime les entrées du compte (filtrées par database / schéma / table)"""
+        clauses, params = ["account = ?"], [self.account]
+        for column, value in (("database_name", database), ("schema_name", schema), ("table_name", table)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        with self._lock, self._db:
+            cursor = self._db.execute(f"DELETE FROM catalog_entries WHERE {' AND '.join(clauses)}", params)
+        return cursor.rowcount
+
+    def refresh_database(self, conn, database):
+        """Recharge tout le catalogue d'une database en une seule requête INFORMATION_SCHEMA"""
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT s.SCHEMA_NAME, t.TABLE_NAME, c.COLUMN_NAME, c.DATA_TYPE
+            FROM {database}.INFORMATION_SCHEMA.SCHEMATA s
+            LEFT JOIN {database}.INFORMATION_SCHEMA.TABLES t
+              ON t.TABLE_SCHEMA = s.SCHEMA_NAME
+            LEFT JOIN {database}.INFORMATION_SCHEMA.COLUMNS c
+              ON c.TABLE_SCHEMA = t.TABLE_SCHEMA AND c.TABLE_NAME = t.TABLE_NAME
+            WHERE s.SCHEMA_NAME <> 'INFORMATION_SCHEMA'
+            ORDER BY s.SCHEMA_NAME, t.TABLE_NAME, c.ORDINAL_POSITION
+            {FRESH}
+        """)
+
+        tables = {}
+        columns = {}
+        for schema, table, column, data_type in cursor.fetchall():
+            schema_tables = tables.setdefault(schema, [])
+            if table is None:
+                continue
+            if (schema, table) not in columns:
+                schema_tables.append(table)
+                columns[(schema, table)] = []
+            if column is not None:
+                columns[(schema, table)].append([column, data_type])
+
+        self.invalidate(database=database)
+        entries = [("schemas", database, "", "", sorted(tables))]
+        entries += [("tables", database, schema, "", names) for schema, names in tables.items()]
+        entries += [("columns", database, schema, table, cols) for (schema, table), cols in columns.items()]
+        self.put_many(entries)
+        return len(columns)
+
+    def close(self):
+        self._db.close()
+
+def _like(pattern, value):
+    """Équivalent local (insensible à la casse) d'un LIKE SQL"""
+    regex = "".join(".*" if c == "%" else "." if c == "_" else re.escape(c) for c in pattern)
+    return re.fullmatch(regex, value, re.IGNORECASE) is not None
+
+def _cached_metadata(catalog, kind, key, loader):
+    """Lit une entrée du catalogue, ou la charge depuis Snowflake et la met en cache"""
+    if catalog is not None:
+        value = catalog.get(kind, *key)
+        if value is not None:
+            return value
+    value = loader()
+    if catalog is not None:
+        catalog.put(kind, *key, value=value)
+    return value
+
+def show_schemas(conn, database, catalog=None):
+    """Schémas d'une database (SHOW SCHEMAS, ou cache)"""
+    def load():
+        cursor = conn.cursor()
+        cursor.execute(f"SHOW SCHEMAS IN DATABASE {database}")
+        return sorted(row[1] for row in cursor.fetchall() if row[1] != "INFORMATION_SCHEMA")
+    return _cached_metadata(catalog, "schemas", (database,), load)
+
+def show_tables(conn, database, schema, catalog=None, like=None):
+    """Tables d'un schéma (SHOW TABLES, ou cache), filtrées localement par `like`"""
+    def load():
+        cursor = conn.cursor()
+        cursor.execute(f"SHOW TABLES IN SCHEMA {database}.{schema}")
+        return [row[1] for row in cursor.fetchall()]
+    tables = _cached_metadata(catalog, "tables", (database, schema), load)
+    if like is not None:
+        tables = [t for t in tables if _like(like, t)]
+    return tables
+
+def describe_table(conn, database, schema, table, catalog=None):
+    """Colonnes [nom, type] d'une table (DESCRIBE TABLE, ou cache)"""
+    def load():
+        cursor = conn.cursor()
+        cursor.execute(f"DESCRIBE TABLE {database}.{schema}.{table}")
+        return [[row[0], row[1]] for row in cursor.fetchall()]
+    return _cached_metadata(catalog, "columns", (database, schema, table), load)
+
+def database_tables(conn, database, catalog=None):
+    """Tables (schéma, table) d'une database : cache, sinon un seul SHOW TABLES IN DATABASE"""
+    if catalog is not None:
+        schemas = catalog.get("schemas", database)
+        if schemas is not None:
+            listed = [(schema, catalog.get("tables", database, schema)) for schema in schemas]
+            if all(tables is not None for _, tables in listed):
+                return [(schema, table) for schema, tables in listed for table in tables]
+
+    cursor = conn.cursor()
+    cursor.execute(f"SHOW TABLES IN DATABASE {database}")
+    rows = sorted((row[3], row[1]) for row in cursor.fetchall())
+    if catalog is not None:
+        by_schema = {}
+        for schema, table in rows:
+            by_schema.setdefault(schema, []).append(table)
+        catalog.put_many([("tables", database, schema, "", tables) for schema, tables in by_schema.items()])
+    return rows
+
+def refresh_catalog(conn, catalog, databases):
+    """Rafraîchit le cache catalogue (une requête INFORMATION_SCHEMA par database)"""
+    for db in databases:
+        start = time.perf_counter()
+        try:
+            count = catalog.refresh_database(conn, db)
+            print(f"  ✅ {db}: {count} tables en {time.perf_counter() - start:.1f}s")
+        except Exception as e:
+            print(f"  {db} - Erreur: {e}")
+
+class OfflineCacheMiss(Exception):
+    """Requête absente du cache de résultats en mode --offline"""
+
+def normalize_sql(sql):
+    """Normalise une requête pour la clé de cache (commentaires -- et espaces)"""
+    sql = re.sub(r"--[^\n]*", " ", sql)
+    return " ".join(sql.split()).rstrip(";")
+
+def _execute(cursor, query, params=None):
+    """cursor.execute sans passer params=None (refusé par certains pilotes DB-API)"""
+    return cursor.execute(query) if params is None else cursor.execute(query, params)
+
+def _is_read_query(sql):
+    return re.match(r"\s*(SELECT|WITH|SHOW|DESCRIBE|DESC|EXPLAIN)\b", normalize_sql(sql), re.IGNORECASE) is not None
+
+class ResultCache:
+    """Cache disque des résultats de requêtes (Arrow IPC si pyarrow disponible, sinon pickle)
+
+    Clé : SQL normalisé + paramètres + rôle + warehouse. L'âge d'une entrée est
+    son mtime, son dernier accès son atime : éviction LRU dès que la taille
+    totale dépasse `max_bytes`.
+    """
+
+    def __init__(self, path=None, max_bytes=RESULT_CACHE_MAX_BYTES, max_age=RESULT_CACHE_MAX_AGE):
+        self.path = path or os.path.join(CACHE_DIR, "results")
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(self.path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._flights = {}  # clé → Event de la lecture en cours (single-flight)
+
+    def key(self, sql, params=None, role=SNOWFLAKE_ROLE, warehouse=SNOWFLAKE_WAREHOUSE):
+        payload = json.dumps([normalize_sql(sql), params, role, warehouse], default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def join(self, key):
+        """Single-flight : None si l'appelant devient le lecteur de `key`, sinon l'Event à attendre"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                self._flights[key] = (threading.Event(), threading.get_ident())
+                return None
+        event, reader = flight
+        # Lecteur = ce thread (curseur laissé en cours de lecture) : attendre serait un interblocage
+        return None if reader == threading.get_ident() else event
+
+    def land(self, key):
+        """Fin de lecture (résultat en cache ou abandon) : réveille ceux qui attendaient `key`"""
+        with self._lock:
+            flight = self._flights.pop(key, None)
+        if flight is not None:
+            flight[0].set()
+
+    def _files(self, key):
+        return [os.path.join(self.path, f"{key}{ext}") for ext in (".arrow", ".pickle")]
+
+    def load(self, key, max_age=None):
+        """Retourne (description, rows) ou None ; max_age=None applique l'âge max par défaut"""
+        max_age = self.max_age if max_age is None else max_age
+        for path in self._files(key):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if max_age and time.time() - st.st_mtime > max_age:
+                continue  # une entrée .arrow périmée ne masque pas un .pickle plus récent
+            os.utime(path, (time.time(), st.st_mtime))  # LRU : accès récent, âge inchangé
+            if path.endswith(".arrow"):
+                return self._load_arrow(path)
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        return None
+
+    def _load_arrow(self, path):
+        pa, _ = _require_arrow()
+        with pa.memory_map(path) as source:
+            table = pa.ipc.open_file(source).read_all()
+        description = [tuple(d) for d in json.loads(table.schema.metadata[b"description"])]
+        rows = list(zip(*(column.to_pylist() for column in table.columns)))
+        return description, rows
+
+    def store(self, key, description, rows):
+        description = [tuple(d) for d in description]
+        arrow_path, pickle_path = self._files(key)
+        tmp = os.path.join(self.path, f".{key}.{threading.get_ident()}.tmp")
+        try:
+            pa, _ = _require_arrow()
+            arrays = [pa.array(list(column)) for column in zip(*rows)] if rows else \
+                [pa.nulls(0) for _ in description]
+            table = pa.Table.from_arrays(arrays, names=[d[0] for d in description])
+            table = table.replace_schema_metadata({"description": json.dumps(description, default=str)})
+            with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+            os.replace(tmp, arrow_path)
+            stale = pickle_path
+        except (RuntimeError, ValueError, TypeError, OverflowError):
+            # pyarrow absent ou types non convertibles : repli pickle
+            try:
+                with open(tmp, "wb") as f:
+                    pickle.dump((description, rows), f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp, pickle_path)
+            except BaseException:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(tmp)
+                raise
+            stale = arrow_path
+        # L'autre format d'une écriture précédente masquerait (ou survivrait à) celle-ci
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(stale)
+        self.evict()
+
+    def evict(self):
+        """Supprime les entrées les moins récemment utilisées au-delà de max_bytes"""
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.path):
+                if name.startswith("."):
+                    continue
+                path = os.path.join(self.path, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:  # remplacée par un store() concurrent
+                    continue
+                entries.append((st.st_atime, st.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+                total -= size
+
+    def clear(self):
+        for name in os.listdir(self.path):
+            os.remove(os.path.join(self.path, name))
+
+class CachedConnection:
+    """Enveloppe une connexion : les lectures passent par le ResultCache
+
+    En mode offline (conn=None), seules les requêtes en cache sont servies ;
+    les écritures de session (tables temporaires de filtre...) sont ignorées.
+    Avec `connect_fn` et conn=None, la connexion n'est ouverte qu'au premier défaut
+    de cache : les écritures de session sont différées puis rejouées à ce moment-là.
+    `stats` compte les lectures servies par le cache (hits), envoyées (misses) et
+    partagées avec une lecture identique déjà en vol (shared).
+    """
+
+    def __init__(self, conn, cache, offline=False, connect_fn=None):
+        self.conn = conn
+        self.cache = cache
+        self.offline = offline
+        self.connect_fn = connect_fn
+        self.role = getattr(conn, "role", None) or SNOWFLAKE_ROLE
+        self.warehouse = getattr(conn, "warehouse", None) or SNOWFLAKE_WAREHOUSE
+        self._pending = []  # [(méthode, requête, paramètres)] en attente de connexion
+        self._lock = threading.Lock()
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+
+    def count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    @property
+    def deferred(self):
+        """Vrai tant que les écritures de session peuvent attendre la connexion"""
+        return self.conn is None and self.connect_fn is not None
+
+    def defer(self, method, query, params):
+        with self._lock:
+            if self.conn is None:
+                self._pending.append((method, query, params))
+                return True
+        return False
+
+    def live(self):
+        """Connexion réelle, ouverte à la demande (écritures de session différées rejouées)"""
+        with self._lock:
+            if self.conn is None:
+                conn = self.connect_fn()
+                print("✅ Connecté à Snowflake (résultat absent du cache)")
+                cursor = conn.cursor()
+                for method, query, params in self._pending:
+                    if method == "executemany":
+                        cursor.executemany(query, params)
+                    else:
+                        _execute(cursor, query, params)
+                self._pending = []
+                self.conn = conn
+            return self.conn
+
+    def cursor(self):
+        return CachedCursor(self)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+class CachedCursor:
+    """Curseur DB-API servi depuis le cache, ou tee vers le cache en lisant le vrai curseur"""
+
+    def __init__(self, owner):
+        self.owner = owner
+        self.description = None
+        self.rowcount = -1
+        self.sfqid = None
+        self._cursor = None
+        self._rows = None
+        self._pos = 0
+        self._key = None
+        self._buffer = None
+        self._flight = None  # clé dont ce curseur est le lecteur (single-flight)
+
+    def execute(self, query, params=None):
+        return self._run(query, params, submit=False)
+
+    def execute_async(self, query, params=None):
+        """Lecture absente du cache : soumise sans attente (sfqid à sonder) ; sinon sfqid à None, résultat prêt"""
+        self._run(query, params, submit=True)
+        return {"queryId": self.sfqid}
+
+    def get_results_from_sfqid(self, sfqid):
+        self._cursor.get_results_from_sfqid(sfqid)
+        self._sync()
+        self._buffer = []
+        return self
+
+    def _run(self, query, params, submit):
+        owner = self.owner
+        self._land()
+        self._cursor = self._rows = self._key = self._buffer = self.sfqid = None
+        self._pos = 0
+
+        if not _is_read_query(query):
+            # PUT lit un fichier local éphémère : pas de report possible
+            if owner.offline or (owner.deferred and not query.lstrip().upper().startswith("PUT")
+                                 and owner.defer("execute", query, params)):
+                self.description, self._rows, self.rowcount = None, [], 0
+                return self
+            self._cursor = owner.live().cursor()
+            _execute(self._cursor, query, params)
+            self._sync()
+            if submit:
+                self.sfqid = None
+            return self
+
+        key = owner.cache.key(query, params, owner.role, owner.warehouse)
+        shared = False
+        while owner.offline or FRESH not in query:
+            cached = owner.cache.load(key, max_age=0 if owner.offline else None)
+            if cached is not None:
+                owner.count("shared" if shared else "hits")
+                self.description, self._rows = cached
+                self.rowcount = len(self._rows)
+                return self
+            if owner.offline:
+                raise OfflineCacheMiss(f"Requête absente du cache : {normalize_sql(query)[:120]}")
+            flight = owner.cache.join(key)
+            if flight is None:
+                self._flight = key
+                break
+            # Même lecture en vol (autre incident d'un batch) : on attend son résultat au lieu de la relancer
+            if not flight.wait(RESULT_CACHE_FLIGHT_TIMEOUT):
+                break
+            shared = True
+
+        owner.count("misses")
+        try:
+            self._cursor = owner.live().cursor()
+            self._key = key
+            if submit and hasattr(self._cursor, "execute_async"):
+                if params is None:
+                    self._cursor.execute_async(query)
+                else:
+                    self._cursor.execute_async(query, params)
+                self.description, self.sfqid = None, self._cursor.sfqid
+                return self
+            _execute(self._cursor, query, params)
+        except Exception:
+            self._land()
+            raise
+        self._sync()
+        self._buffer = []
+        if submit:
+            self.sfqid = None
+        return self
+
+    def executemany(self, query, seq_of_params):
+        owner = self.owner
+        if owner.offline or (owner.deferred and owner.defer("executemany", query, list(seq_of_params))):
+            return self
+        self._cursor = owner.live().cursor()
+        self._cursor.executemany(query, seq_of_params)
+        self._sync()
+        return self
+
+    def _sync(self):
+        self.description = self._cursor.description
+        self.rowcount = self._cursor.rowcount
+        self.sfqid = getattr(self._cursor, "sfqid", None)
 
-    customer_list = ",".join([f"'{c}'" for c in CUSTOMER_IDS])
-    external_list = ",".join([f"'{c}'" for c in EXTERNAL_CODES])
+    def _record(self, rows, exhausted):
+        """Accumule les lignes lues pour les mettre en cache à la fin du résultat"""
+        if self._buffer is None:
+            return rows
+        self._buffer.extend(rows)
+        if len(self._buffer) > RESULT_CACHE_MAX_ROWS:
+            self._buffer = None
+            self._land()
+        elif exhausted:
+            self.owner.cache.store(self._key, self.description, self._buffer)
+            self._buffer = None
+            self._land()
+        return rows
+
+    def _land(self):
+        if self._flight is not None:
+            self.owner.cache.land(self._flight)
+            self._flight = None
+
+    def fetchmany(self, size=1):
+        if self._rows is not None:
+            rows = self._rows[self._pos:self._pos + size]
+            self._pos += len(rows)
+            return rows
+        if self._cursor is None:
+            return []
+        rows = self._cursor.fetchmany(size)
+        return self._record(rows, exhausted=len(rows) < size)
+
+    def fetchall(self):
+        if self._rows is not None:
+            rows = self._rows[self._pos:]
+            self._pos = len(self._rows)
+            return rows
+        if self._cursor is None:
+            return []
+        return self._record(self._cursor.fetchall(), exhausted=True)
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def fetch_arrow_batches(self):
+        if self._rows is None:
+            self._buffer = None  # Lecture Arrow directe : pas de mise en cache
+            self._land()
+            yield from self._cursor.fetch_arrow_batches()
+            return
+        pa, _ = _require_arrow()
+        names = [d[0] for d in self.description]
+        columns = zip(*self._rows[self._pos:]) if self._rows[self._pos:] else [[] for _ in names]
+        self._pos = len(self._rows)
+        yield from pa.Table.from_arrays([pa.array(list(c)) for c in columns], names=names).to_batches()
+
+    def close(self):
+        self._land()
+        if self._cursor is not None:
+            self._cursor.close()
+
+    def __del__(self):
+        # Curseur abandonné avant la fin du résultat (limit atteinte...) : libère les lectures en attente
+        self._land()
+
+class QueryProfiler:
+    """Mesures par requête d'un run : temps d'exécution / de fetch, lignes, query_id Snowflake
+
+    Chaque requête est rattachée à la pile des fonctions du script qui l'ont lancée,
+    ce qui donne un rapport JSON et un fichier « folded stacks » pour flamegraph.pl
+    ou speedscope.
+    """
+
+    # Méthodes d'enveloppe exclues de la pile d'appel
+    _WRAPPERS = {"execute", "executemany", "fetchone", "fetchmany", "fetchall", "__iter__", "_fetch", "<lambda>"}
+
+    def __init__(self):
+        self.records = []
+        self.started_at = datetime.now()
+        self._lock = threading.Lock()
+
+    def start(self, query):
+        stack = []
+        frame = sys._getframe(2)
+        while frame is not None:
+            code = frame.f_code
+            if code.co_filename == __file__ and code.co_name not in self._WRAPPERS:
+                stack.append(code.co_name)
+            frame = frame.f_back
+        record = {
+            "query": normalize_sql(query)[:300],
+            "stack": stack[::-1],
+            "query_id": None,
+            "execute_s": 0.0,
+            "fetch_s": 0.0,
+            "rows": 0,
+            "error": None,
+        }
+        with self._lock:
+            self.records.append(record)
+        return record
+
+    def enrich_from_history(self, conn):
+        """Ajoute octets / partitions scannés et temps de compilation depuis QUERY_HISTORY"""
+        by_id = {r["query_id"]: r for r in self.records if r["query_id"]}
+        if not by_id:
+            return 0
+        id_table = upload_id_set(conn, "PROFILED_QUERIES", by_id)
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT QUERY_ID, BYTES_SCANNED, PARTITIONS_SCANNED, PARTITIONS_TOTAL,
+                   COMPILATION_TIME, EXECUTION_TIME, QUEUED_OVERLOAD_TIME
+            FROM TABLE(INFORMATION_SCHEMA.QUERY_HISTORY_BY_USER(RESULT_LIMIT => 10000))
+            WHERE QUERY_ID IN (SELECT ID FROM {id_table})
+        """)
+        found = 0
+        for query_id, bytes_scanned, partitions, partitions_total, compile_ms, exec_ms, queued_ms in cursor.fetchall():
+            by_id[query_id].update({
+                "bytes_scanned": bytes_scanned,
+                "partitions_scanned": partitions,
+                "partitions_total": partitions_total,
+                "compilation_ms": compile_ms,
+                "execution_ms": exec_ms,
+                "queued_ms": queued_ms,
+            })
+            found += 1
+        return found
+
+    def folded_stacks(self):
+        """Une ligne par requête : pile;requête durée_ms (format flamegraph)"""
+        lines = []
+        for r in self.records:
+            label = re.sub(r"[;\s]+", " ", r["query"])[:80]
+            total_ms = round((r["execute_s"] + r["fetch_s"]) * 1000)
+            lines.append(f"{';'.join(r['stack'] + [label])} {max(total_ms, 1)}")
+        return lines
+
+    def write_report(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        summary = {
+            "started_at": self.started_at.isoformat(),
+            "queries": len(self.records),
+            "execute_s": round(sum(r["execute_s"] for r in self.records), 3),
+            "fetch_s": round(sum(r["fetch_s"] for r in self.records), 3),
+            "rows": sum(r["rows"] for r in self.records),
+            "records": self.records,
+        }
+        with open(path, "w") as f:
+            json.dump(summary, f, indent=2, default=str)
+        folded = os.path.splitext(path)[0] + ".folded"
+        with open(folded, "w") as f:
+            f.write("\n".join(self.folded_stacks()) + "\n")
+        return path, folded
+
+    def print_summary(self, top=10):
+        print("\n" + "="*60)
+        print(f"⏱️  Profil : {len(self.records)} requêtes")
+        print("="*60)
+        ranked = sorted(self.records, key=lambda r: r["execute_s"] + r["fetch_s"], reverse=True)
+        for r in ranked[:top]:
+            where = r["stack"][-1] if r["stack"] else "?"
+            scanned = f", {r['bytes_scanned'] / 1e6:.1f} Mo scannés" if r.get("bytes_scanned") is not None else ""
+            print(f"  {r['execute_s']:7.2f}s exec + {r['fetch_s']:6.2f}s fetch | {r['rows']:>8} lignes"
+                  f"{scanned} | {where} | {r['query'][:60]}")
+
+class ProfiledConnection:
+    """Enveloppe une connexion et mesure chaque requête dans un QueryProfiler"""
+
+    def __init__(self, conn, profiler):
+        self.conn = conn
+        self.profiler = profiler
+
+    def cursor(self):
+        return ProfiledCursor(self.conn.cursor(), self.profiler)
+
+    def close(self):
+        self.conn.close()
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+class ProfiledCursor:
+    """Curseur mesuré : temps d'execute, temps et lignes de fetch, query_id"""
+
+    def __init__(self, cursor, profiler):
+        self._cursor = cursor
+        self._profiler = profiler
+        self._record = None
+        self._submitted = None
+
+    def execute(self, query, params=None):
+        self._record = record = self._profiler.start(query)
+        start = time.perf_counter()
+        try:
+            _execute(self._cursor, query, params)
+        except Exception as e:
+            record["error"] = str(e)
+            raise
+        finally:
+            record["execute_s"] += time.perf_counter() - start
+            record["query_id"] = getattr(self._cursor, "sfqid", None)
+        return self
+
+    def execute_async(self, query, params=None):
+        """Soumission mesurée ; l'attente du résultat est ajoutée à execute_s par get_results_from_sfqid"""
+        self._record = record = self._profiler.start(query)
+        start = time.perf_counter()
+        try:
+            if params is None:
+                return self._cursor.execute_async(query)
+            return self._cursor.execute_async(query, params)
+        except Exception as e:
+            record["error"] = str(e)
+            raise
+        finally:
+            self._submitted = time.perf_counter()
+            record["execute_s"] += self._submitted - start
+            record["query_id"] = getattr(self._cursor, "sfqid", None)
+
+    def get_results_from_sfqid(self, sfqid):
+        self._cursor.get_results_from_sfqid(sfqid)
+        if self._record is not None:
+            self._record["execute_s"] += time.perf_counter() - self._submitted
+        return self
+
+    def executemany(self, query, seq_of_params):
+        self._record = record = self._profiler.start(query)
+        start = time.perf_counter()
+        try:
+            self._cursor.executemany(query, seq_of_params)
+        finally:
+            record["execute_s"] += time.perf_counter() - start
+        return self
+
+    def _fetch(self, fetch, *args):
+        start = time.perf_counter()
+        rows = fetch(*args)
+        if self._record is not None:
+            self._record["fetch_s"] += time.perf_counter() - start
+            self._record["rows"] += len(rows) if isinstance(rows, list) else int(rows is not None)
+        return rows
+
+    def fetchone(self):
+        return self._fetch(self._cursor.fetchone)
+
+    def fetchmany(self, size=1):
+        return self._fetch(self._cursor.fetchmany, size)
+
+    def fetchall(self):
+        return self._fetch(self._cursor.fetchall)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def fetch_arrow_batches(self):
+        for batch in self._cursor.fetch_arrow_batches():
+            if self._record is not None:
+                self._record["rows"] += batch.num_rows
+            yield batch
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+def _format_bytes(n):
+    return f"{n / 1e9:.1f} Go" if n >= 1e9 else f"{n / 1e6:.1f} Mo"
+
+_UNTYPED_RANGE = re.compile(r"([\w.]+) BETWEEN '(\d{4}-\d{2}-\d{2})' AND '(\d{4}-\d{2}-\d{2})'(?!::)", re.IGNORECASE)
+_LEADING_WILDCARD = re.compile(r"([\w.]+) (I?LIKE) '%", re.IGNORECASE)
+
+def suggest_rewrites(query):
+    """Réécritures favorables au pruning, repérées dans le texte SQL"""
+    sql = normalize_sql(query)
+    suggestions = []
+    for column, start, end in _UNTYPED_RANGE.findall(sql):
+        after = date.fromisoformat(end) + timedelta(days=1)
+        suggestions.append(
+            f"{column} BETWEEN '{start}' AND '{end}' : bornes typées et fin exclusive, "
+            f"{column} >= '{start}'::TIMESTAMP_NTZ AND {column} < '{after}'::TIMESTAMP_NTZ "
+            f"(BETWEEN sur une date s'arrête à {end} 00:00:00) ; ou --time-slice"
+        )
+    wildcards = Counter((column, op.upper()) for column, op in _LEADING_WILDCARD.findall(sql))
+    for (column, op), count in sorted(wildcards.items()):
+        advice = "égalité / IN (SELECT ID FROM table de filtre) sur une valeur normalisée"
+        if op == "ILIKE":
+            advice += ", ILIKE en dernier recours"
+        suggestions.append(f"{count} × {column} {op} '%...' : aucun pruning possible, préférer {advice}")
+    for table, column in CLUSTERING_KEYS.items():
+        if re.search(rf"\bFROM [\w.]*\b{table}\b", sql) and not re.search(
+            rf"\b{column}\s*(>=|<=|>|<|=|BETWEEN\b|IN\b)", sql
+        ):
+            suggestions.append(f"aucun filtre sur {table}.{column} (clé de clustering) : borner la période")
+    return suggestions
+
+class QueryGuard:
+    """Pré-vol des requêtes : EXPLAIN estime partitions et octets scannés avant exécution
+
+    Au-delà du budget (`max_bytes`, `max_partitions`), mode 'warn' : avertissement,
+    mode 'block' : QueryBudgetExceeded ; avec des réécritures favorables au pruning.
+    Une estimation par texte de requête + paramètres.
+    """
+
+    def __init__(self, mode="warn", max_bytes=QUERY_GUARD_MAX_BYTES, max_partitions=None):
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.max_partitions = max_partitions
+        self.estimates = {}
+        self.over_budget = []
+        self._lock = threading.Lock()
+
+    def estimate(self, cursor, query, params=None):
+        """GlobalStats de EXPLAIN USING JSON : partitionsTotal, partitionsAssigned, bytesAssigned"""
+        key = (normalize_sql(query), repr(params))
+        with self._lock:
+            if key in self.estimates:
+                return self.estimates[key]
+        _execute(cursor, f"EXPLAIN USING JSON {query}", params)
+        content = cursor.fetchone()[0]
+        stats = (json.loads(content) if isinstance(content, str) else content)["GlobalStats"]
+        with self._lock:
+            self.estimates[key] = stats
+        return stats
+
+    def check(self, cursor, query, params=None):
+        """Estime une lecture et applique le budget ; retourne l'estimation (None si non évaluée)"""
+        if self.mode == "off" or not re.match(r"\s*(SELECT|WITH)\b", normalize_sql(query), re.IGNORECASE):
+            return None
+        try:
+            stats = self.estimate(cursor, query, params)
+        except Exception:
+            return None  # EXPLAIN refusé : la requête elle-même remontera l'erreur
+        scanned, assigned = stats["bytesAssigned"], stats["partitionsAssigned"]
+        if scanned <= self.max_bytes and (self.max_partitions is None or assigned <= self.max_partitions):
+            return stats
+
+        message = (f"scan estimé à {_format_bytes(scanned)}, {assigned}/{stats['partitionsTotal']} partitions "
+                   f"(budget {_format_bytes(self.max_bytes)}) : {normalize_sql(query)[:100]}")
+        suggestions = suggest_rewrites(query)
+        with self._lock:
+            self.over_budget.append((message, suggestions))
+        if self.mode == "block":
+            raise QueryBudgetExceeded("\n  💡 ".join([message] + suggestions))
+        print(f"  ⚠️  {message}")
+        for suggestion in suggestions:
+            print(f"    💡 {suggestion}")
+        return stats
+
+class GuardedConnection:
+    """Enveloppe une connexion : chaque lecture passe d'abord par le QueryGuard"""
+
+    def __init__(self, conn, guard):
+        self.conn = conn
+        self.guard = guard
+
+    def cursor(self):
+        return GuardedCursor(self.conn.cursor(), self.guard)
+
+    def close(self):
+        self.conn.close()
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+class GuardedCursor:
+    """Curseur dont execute / execute_async sont précédés d'un EXPLAIN sur la même session"""
+
+    def __init__(self, cursor, guard):
+        self._cursor = cursor
+        self._guard = guard
+
+    def execute(self, query, params=None):
+        self._guard.check(self._cursor, query, params)
+        _execute(self._cursor, query, params)
+        return self
+
+    def execute_async(self, query, params=None):
+        self._guard.check(self._cursor, query, params)
+        if params is None:
+            return self._cursor.execute_async(query)
+        return self._cursor.execute_async(query, params)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+# Tables de filtre déjà chargées, par connexion : {conn: {noms}}
+_id_filters = weakref.WeakKeyDictionary()
+
+def upload_id_set(conn, name, ids):
+    """Charge un ensemble d'IDs dans une table temporaire de session et retourne son nom
+
+    La table ID_FILTER_<NAME>_<EMPREINTE> (colonne ID) est à utiliser en jointure / IN (SELECT ID ...)
+    à la place des IN-lists et des chaînes de LIKE. Un même ensemble n'est chargé
+    qu'une fois par session ; les gros ensembles passent par un fichier CSV stagé.
+    """
+    ids = sorted({str(i) for i in ids})
+    fingerprint = hashlib.sha1("\n".join(ids).encode()).hexdigest()
+    # L'empreinte dans le nom rend le texte SQL propre à l'ensemble d'IDs (clé du cache de résultats)
+    table = f"ID_FILTER_{name.upper()}_{fingerprint[:12].upper()}"
+
+    loaded = _id_filters.setdefault(conn, set())
+    if table in loaded:
+        return table
+
+    cursor = conn.cursor()
+    cursor.execute(f"CREATE OR REPLACE TEMPORARY TABLE {table} (ID VARCHAR)")
+
+    if len(ids) <= ID_FILTER_STAGE_THRESHOLD:
+        for i in range(0, len(ids), ID_FILTER_INSERT_BATCH):
+            batch = ids[i:i + ID_FILTER_INSERT_BATCH]
+            cursor.executemany(f"INSERT INTO {table} (ID) VALUES (%s)", [(v,) for v in batch])
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, f"{table.lower()}.csv")
+            with open(path, "w", newline="") as f:
+                csv.writer(f).writerows([v] for v in ids)
+            cursor.execute(f"PUT 'file://{path}' @%{table} AUTO_COMPRESS = TRUE")
+            cursor.execute(f"COPY INTO {table} FROM @%{table} FILE_FORMAT = (TYPE = CSV) PURGE = TRUE")
+
+    loaded.add(table)
+    return table
+
+def _sql_literal(value):
+    """Littéral SQL typé pour une valeur de clé keyset"""
+    if isinstance(value, datetime):
+        return f"'{value.isoformat(sep=' ')}'::TIMESTAMP_NTZ"
+    if isinstance(value, date):
+        return f"'{value.isoformat()}'::DATE"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+def iter_rows(cursor, batch_size=FETCH_BATCH_SIZE):
+    """Itère sur les lignes d'un curseur par lots fetchmany (mémoire bornée)"""
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+class RowStream:
+    """Flux de lignes d'une requête : itérable une fois, `description` connue dès l'exécution"""
+
+    def __init__(self, description, rows):
+        self.description = description
+        self._rows = rows
+
+    @property
+    def columns(self):
+        return [desc[0] for desc in self.description]
+
+    def __iter__(self):
+        return self._rows
+
+def stream_query(conn, query, order_by=None, limit=None, key=None, batch_size=FETCH_BATCH_SIZE):
+    """Exécute un SELECT et retourne un RowStream lu par lots
+
+    `query` ne contient ni ORDER BY ni LIMIT. Si `limit` est None et qu'une clé
+    `key` = (colonne, index dans la ligne) est donnée, la requête doit contenir
+    le marqueur KEYSET dans son WHERE : elle est rejouée page par page par ordre
+    décroissant de la clé (pagination keyset, sans OFFSET), lignes à clé NULL
+    en premier. La clé doit être peu dupliquée : une valeur à cheval sur deux
+    pages est relue en entier.
+    """
+    cursor = conn.cursor()
+    if limit is not None or key is None:
+        sql = query.replace(KEYSET, "TRUE")
+        if order_by is not None:
+            sql += f"\nORDER BY {order_by}"
+        if limit is not None:
+            sql += f"\nLIMIT {limit}"
+        cursor.execute(sql)
+        return RowStream(cursor.description, iter_rows(cursor, batch_size))
+
+    column, index = key
+    # Clé NULL en tête comme ORDER BY ... DESC dans Snowflake (NULLS FIRST), lue hors pagination
+    cursor.execute(query.replace(KEYSET, f"{column} IS NULL"))
+    return RowStream(cursor.description, _iter_keyset(conn, cursor, query, column, index, batch_size))
+
+def _keyset_page(query, column, predicate, page_size):
+    return f"{query.replace(KEYSET, predicate)}\nORDER BY {column} DESC\nLIMIT {page_size}"
+
+def _iter_keyset(conn, nulls, query, column, index, page_size):
+    """Lignes à clé NULL puis pages keyset ; les lignes à égalité sur la borne d'une page sont relues à part"""
+    yield from iter_rows(nulls, page_size)
+    cursor = conn.cursor()
+    cursor.execute(_keyset_page(query, column, f"{column} IS NOT NULL", page_size))
+    while True:
+        count = 0
+        tied = []  # Lignes consécutives partageant la dernière valeur de clé vue
+        for row in iter_rows(cursor, page_size):
+            count += 1
+            if tied and row[index] != tied[0][index]:
+                yield from tied
+                tied = []
+            tied.append(row)
+
+        if count < page_size:
+            yield from tied
+            return
+        if not tied:
+            return
+
+        # Page pleine : la borne peut être coupée par le LIMIT, on relit toutes ses lignes
+        boundary = _sql_literal(tied[0][index])
+        cursor = conn.cursor()
+        cursor.execute(query.replace(KEYSET, f"{column} = {boundary}"))
+        yield from iter_rows(cursor, page_size)
+
+        cursor = conn.cursor()
+        cursor.execute(_keyset_page(query, column, f"{column} < {boundary}", page_size))
+
+def time_slices(date_start, date_end, step="day"):
+    """Découpe [date_start, date_end] en tranches (début, fin, fin incluse), de la plus récente à la plus ancienne"""
+    start = datetime.fromisoformat(str(date_start))
+    end = datetime.fromisoformat(str(date_end))
+    delta = TIME_SLICE_STEPS[step]
+    slices = []
+    lo = start
+    while lo < end:
+        hi = min(lo + delta, end)
+        slices.append((lo, hi, hi == end))
+        lo = hi
+    return slices[::-1]
+
+class _Desc:
+    """Clé de tas inversée (heapq est un tas min, on fusionne par ordre décroissant)"""
+    __slots__ = ("key",)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return self.key > other.key
+
+def scan_time_slices(conn, query, column, date_start, date_end, step="day", limit=None,
+                     max_workers=LOG_SCAN_MAX_WORKERS, batch_size=FETCH_BATCH_SIZE):
+    """Scan parallèle par tranches de temps, fusionné par ordre décroissant de `column`
+
+    `query` contient le marqueur TIME_SLICE dans son WHERE ; chaque tranche devient
+    un prédicat typé (>= / < sur TIMESTAMP_NTZ) propice au pruning des partitions.
+    Les tranches tournent dans un pool borné (les plus récentes d'abord) et sont
+    fusionnées par un tas k-way ; une tranche n'est lue que lorsque ses lignes
+    peuvent passer en tête. Arrêt anticipé dès que `limit` lignes sont produites.
+    """
+    slices = time_slices(date_start, date_end, step)
+    base = query.replace(KEYSET, "TRUE")
+
+    def run(lo, hi, inclusive):
+        upper = "<=" if inclusive else "<"
+        predicate = (f"{column} >= {_sql_literal(lo)} AND {column} {upper} {_sql_literal(hi)}")
+        sql = f"{base.replace(TIME_SLICE, predicate)}\nORDER BY {column} DESC"
+        if limit is not None:
+            sql += f"\nLIMIT {limit}"
+        cursor = conn.cursor()
+        cursor.execute(sql)
+        return cursor
+
+    pool = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(slices) or 1)))
+    pending = [(hi, pool.submit(run, lo, hi, inclusive)) for lo, hi, inclusive in slices]
+    if not pending:
+        pool.shutdown()
+        return RowStream([], iter(()))
+    opened = []  # Curseurs des tranches déjà passées dans la fusion
+
+    def close_done(future):
+        if future.exception() is None:
+            _close_quietly(future.result())
+
+    def close_all():
+        """Annule les tranches pas encore lancées, ferme les curseurs ouverts (et ceux encore en route)"""
+        for _, future in pending:
+            if not future.cancel():
+                future.add_done_callback(close_done)
+        for cursor in opened:
+            _close_quietly(cursor)
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    try:
+        first = pending[0][1].result()
+        description = first.description
+        key_index = [d[0] for d in description].index(column.split(".")[-1])
+    except BaseException:
+        close_all()
+        raise
+
+    def merged():
+        heap = []
+        seq = 0
+        produced = 0
+
+        def push(rows):
+            nonlocal seq
+            row = next(rows, None)
+            if row is not None:
+                heapq.heappush(heap, (_Desc(row[key_index]), seq, row, rows))
+                seq += 1
+
+        try:
+            while pending or heap:
+                # Active les tranches dont les lignes peuvent dépasser la tête du tas
+                while pending and (not heap or pending[0][0] > heap[0][0].key):
+                    _, future = pending[0]
+                    cursor = future.result()
+                    pending.pop(0)
+                    opened.append(cursor)
+                    push(iter_rows(cursor, batch_size))
+                if not heap:
+                    continue
+                _, _, row, rows = heapq.heappop(heap)
+                yield row
+                produced += 1
+                if limit is not None and produced >= limit:
+                    return
+                push(rows)
+        finally:
+            close_all()
+
+    return RowStream(description, merged())
+
+def _require_arrow():
+    """Import paresseux de pyarrow (mode colonnaire optionnel)"""
+    try:
+        import pyarrow
+        import pyarrow.compute
+    except ImportError:
+        raise RuntimeError(
+            "Mode colonnaire indisponible : pip install 'snowflake-connector-python[pandas]'"
+        )
+    return pyarrow, pyarrow.compute
+
+def iter_arrow_batches(conn, query):
+    """Exécute une requête et itère sur les lots Arrow du connecteur (pas de tuples Python)"""
+    _require_arrow()
+    cursor = conn.cursor()
+    cursor.execute(query)
+    yield from cursor.fetch_arrow_batches()
+
+# Colonnes lues sur RECOVERY_CO pour la recherche par numéro de compte
+RECOVERY_COLUMNS = [
+    "DATE_PERIOD",
+    "AGENCY_NAME",
+    "CO_OWNER_FULL_NAME",
+    "CO_OWNER_ACCOUNT_NUMBER",
+    "LEVEL",
+    "RECOVERY_STATUS",
+    "AUTOMATIC_REMINDER",
+    "AMOUNT",
+    "CALCULATED_AMOUNT",
+    "RECOVERY_FILE_ID",
+    "LAST_REMINDER_DATE",
+]
+
+def _cents_to_euros(value):
+    # float() : NUMBER(p, s>0) arrive en Decimal, non divisible par un float (et comme le chemin Arrow)
+    return None if value is None else float(value) / 100
+
+def classify_recovery_rows(rows):
+    """Version ligne à ligne : ONGOING_REMINDER uniquement, niveau bloqué et montants en euros
+
+    Produit (row, bloqué, montant €, calculé €) pour des lignes au format RECOVERY_COLUMNS.
+    """
+    for row in rows:
+        if row[5] == 'ONGOING_REMINDER':
+            yield row, row[4] == 1.0, _cents_to_euros(row[7]), _cents_to_euros(row[8])
+
+def classify_recovery_batch(batch):
+    """Version vectorisée de classify_recovery_rows sur un lot Arrow
+
+    Retourne une table Arrow filtrée (ONGOING_REMINDER) avec les colonnes
+    BLOCKED, AMOUNT_EUR et CALCULATED_EUR ajoutées.
+    """
+    pa, pc = _require_arrow()
+    table = pa.Table.from_batches([batch]) if isinstance(batch, pa.RecordBatch) else batch
+    table = table.filter(pc.equal(table["RECOVERY_STATUS"], "ONGOING_REMINDER"))
+    return (
+        table
+        .append_column("BLOCKED", pc.equal(table["LEVEL"], 1.0))
+        .append_column("AMOUNT_EUR", pc.divide(pc.cast(table["AMOUNT"], pa.float64()), 100.0))
+        .append_column("CALCULATED_EUR", pc.divide(pc.cast(table["CALCULATED_AMOUNT"], pa.float64()), 100.0))
+    )
+
+def classify_recovery_arrow(batches):
+    """Applique classify_recovery_batch lot par lot, mêmes tuples que classify_recovery_rows"""
+    for batch in batches:
+        table = classify_recovery_batch(batch)
+        rows = zip(*(table[name].to_pylist() for name in RECOVERY_COLUMNS))
+        yield from zip(
+            rows,
+            table["BLOCKED"].to_pylist(),
+            table["AMOUNT_EUR"].to_pylist(),
+            table["CALCULATED_EUR"].to_pylist(),
+        )
+
+def _as_datetime(value):
+    """TIMESTAMP / DATE : texte ISO (cache, exports) → datetime, valeurs déjà typées inchangées"""
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+def _parse_variant(value):
+    """VARIANT renvoyé en texte JSON par le connecteur → objet Python"""
+    return _json_loads()(value) if isinstance(value, (str, bytes)) else value
+
+# Convertisseurs de colonnes des records, par nom : {nom: fonction(valeur)}
+RECORD_CONVERTERS = {
+    "cents": _cents_to_euros,
+    "datetime": _as_datetime,
+    "variant": _parse_variant,
+    "events": lambda value: parse_events(value),
+}
+
+# Classes de records déjà construites : {(nom, colonnes, convertisseurs): classe}
+_record_types = {}
+
+def record_type(columns, converters=None, name="Record"):
+    """Classe de record (namedtuple) d'un schéma de résultat, construite une fois puis réutilisée
+
+    columns : noms de colonnes ou cursor.description ; converters : {colonne: nom dans
+    RECORD_CONVERTERS ou fonction}, appliqués par Record.from_row. Une colonne de
+    converters absente du résultat lève ValueError, un attribut inconnu AttributeError.
+    Les noms invalides en Python (_ID, COUNT(*), mots-clés, doublons) deviennent _<position> ;
+    Record.columns garde les noms du résultat.
+    """
+    names = tuple(c if isinstance(c, str) else c[0] for c in columns)
+    converters = tuple(sorted(
+        (column, RECORD_CONVERTERS[conv] if isinstance(conv, str) else conv)
+        for column, conv in (converters or {}).items()
+    ))
+    key = (name, names, converters)
+    cls = _record_types.get(key)
+    if cls is not None:
+        return cls
+
+    missing = [column for column, _ in converters if column not in names]
+    if missing:
+        raise ValueError(f"Colonnes absentes du résultat {name} : {', '.join(missing)} (colonnes : {', '.join(names)})")
+    cls = namedtuple(name, names, rename=True)
+    cls.columns = names
+    if converters:
+        indexed = [(names.index(column), conv) for column, conv in converters]
+        make = cls._make
+
+        def from_row(row):
+            values = list(row)
+            for i, conv in indexed:
+                values[i] = conv(values[i])
+            return make(values)
+
+        cls.from_row = staticmethod(from_row)
+    else:
+        cls.from_row = cls._make
+    _record_types[key] = cls
+    return cls
+
+def records(rows, converters=None, name="Record"):
+    """Lignes d'un RowStream (ou curseur) en records typés, sans dictionnaire par ligne"""
+    from_row = record_type(rows.description, converters, name).from_row
+    return map(from_row, rows)
+
+def _json_dumps():
+    """Sérialiseur JSON → bytes le plus rapide disponible (orjson si installé)"""
+    try:
+        import orjson
+        return lambda obj: orjson.dumps(obj, default=str)
+    except ImportError:
+        return lambda obj: json.dumps(obj, default=str, ensure_ascii=False).encode()
+
+def _plain_value(value):
+    """Valeur exportable telle quelle (dates en ISO)"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+class RowSink:
+    """Sortie de lignes : open(colonnes), write_rows(lot), close()"""
+
+    def open(self, columns):
+        self.columns = columns
+
+    def write_rows(self, rows):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class ConsoleSink(RowSink):
+    """Affichage console via un formateur ligne → texte, écrit par lots (un write par lot)"""
+
+    def __init__(self, formatter=None, stream=None):
+        self.formatter = formatter or (lambda row: " | ".join(str(v) for v in row))
+        self.stream = stream
+
+    def write_rows(self, rows):
+        out = self.stream or sys.stdout
+        out.write("".join(self.formatter(row) + "\n" for row in rows))
+
+    def close(self):
+        (self.stream or sys.stdout).flush()
+
+class JsonlSink(RowSink):
+    """Une ligne JSON par ligne de résultat, sans troncature"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def open(self, columns):
+        super().open(columns)
+        self._dumps = _json_dumps()
+        self._file = open(self.path, "wb", buffering=1 << 20)
+
+    def write_rows(self, rows):
+        dumps, columns = self._dumps, self.columns
+        self._file.write(b"\n".join(dumps(dict(zip(columns, row))) for row in rows) + b"\n")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+class CsvSink(RowSink):
+    """CSV avec en-tête, valeurs complètes (VARIANT en texte JSON)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def open(self, columns):
+        super().open(columns)
+        self._file = open(self.path, "w", newline="", buffering=1 << 20)
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(columns)
+
+    def write_rows(self, rows):
+        self._writer.writerows(rows)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+class ParquetSink(RowSink):
+    """Parquet (pyarrow) : un row group par lot, schéma fixé par le premier lot"""
+
+    def __init__(self, path):
+        self.path = path
+        self._writer = None
+
+    def write_rows(self, rows):
+        pa, _ = _require_arrow()
+        import pyarrow.parquet as pq
+
+        data = {
+            name: [_plain_value(v) for v in values]
+            for name, values in zip(self.columns, zip(*rows))
+        }
+        if self._writer is None:
+            table = pa.Table.from_pydict(data)
+            # Colonne entièrement nulle dans le premier lot : typée texte
+            schema = pa.schema([
+                f.with_type(pa.string()) if pa.types.is_null(f.type) else f for f in table.schema
+            ])
+            self._writer = pq.ParquetWriter(self.path, schema)
+        self._writer.write_table(pa.Table.from_pydict(data, schema=self._writer.schema))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+SINKS = {".jsonl": JsonlSink, ".ndjson": JsonlSink, ".csv": CsvSink, ".parquet": ParquetSink}
+
+def open_sink(output, formatter=None):
+    """Sortie d'après sa cible : None → console (formateur), sinon l'extension du fichier"""
+    if output is None:
+        return ConsoleSink(formatter)
+    ext = os.path.splitext(output)[1].lower()
+    if ext not in SINKS:
+        raise ValueError(f"Format de sortie inconnu '{ext}' (attendu : {', '.join(SINKS)})")
+    return SINKS[ext](output)
+
+def export_rows(rows, sink, batch_size=SINK_BATCH_SIZE):
+    """Vide un RowStream dans une sortie par lots ; retourne le nombre de lignes"""
+    sink.open(rows.columns)
+    count = 0
+    iterator = iter(rows)
+    try:
+        while True:
+            batch = list(itertools.islice(iterator, batch_size))
+            if not batch:
+                return count
+            sink.write_rows(batch)
+            count += len(batch)
+    finally:
+        sink.close()
+
+def _format_log(row):
+    return (f"[{row[0]}] {row[1]} | {row[2]} | {row[3][:200]}...\n"
+            f"  Attrs: {str(row[4])[:300]}...\n" + "-" * 80)
+
+def _format_reminder_error(row):
+    return f"[{row[0]}] {row[2]} | {row[3]}\n  {str(row[4])[:500]}\n" + "-" * 80
+
+def search_logs(conn, date_start=INCIDENT_DATE_START, date_end=INCIDENT_DATE_END, customer_ids=None, account_numbers=None,
+                limit=500, time_slice=None, max_workers=LOG_SCAN_MAX_WORKERS, output=None):
+    """Recherche les logs liés aux relances contentieux
+
+    limit=None : tous les logs, en flux.
+    time_slice='hour' / 'day' : scan parallèle par tranches, fusionné par TIMESTAMP décroissant.
+    output : fichier .jsonl / .csv / .parquet au lieu de l'affichage console tronqué.
+    """
+    ids = list(CUSTOMER_IDS if customer_ids is None else customer_ids)
+    ids += EXTERNAL_CODES if account_numbers is None else account_numbers
+    id_table = upload_id_set(conn, "LOG_IDS", ids)
+
+    time_filter = f"l.TIMESTAMP BETWEEN '{date_start}' AND '{date_end}'" if time_slice is None else TIME_SLICE
 
     # Requête pour les logs service-litigation
+    # Même sémantique que les LIKE '%id%' : sous-chaîne n'importe où dans ATTRIBUTES
+    # (valeur, clé, texte libre, JSON invalide), semi-jointure sur la table d'IDs
     query = f"""
     SELECT
-        TIMESTAMP,
-        SERVICE,
-        LOG_LEVEL,
-        MESSAGE,
-        ATTRIBUTES
-    FROM LOGS_ML  -- Adapter le nom de la table
-    WHERE TIMESTAMP BETWEEN '{date_start}' AND '{date_end}'
-      AND SERVICE LIKE '%litigation%'
+        l.TIMESTAMP,
+        l.SERVICE,
+        l.LOG_LEVEL,
+        l.MESSAGE,
+        l.ATTRIBUTES
+    FROM LOGS_ML l  -- Adapter le nom de la table
+    WHERE {time_filter}
+      AND l.SERVICE LIKE '%litigation%'
       AND (
-        MESSAGE LIKE '%reminder%'
-        OR MESSAGE LIKE '%recovery%'
-        OR MESSAGE LIKE '%dunning%'
+        l.MESSAGE LIKE '%reminder%'
+        OR l.MESSAGE LIKE '%recovery%'
+        OR l.MESSAGE LIKE '%dunning%'
       )
-      AND (
-        ATTRIBUTES LIKE '%{CUSTOMER_IDS[0]}%'
-        OR ATTRIBUTES LIKE '%{CUSTOMER_IDS[1]}%'
-        OR ATTRIBUTES LIKE '%{CUSTOMER_IDS[2]}%'
-        OR ATTRIBUTES LIKE '%{CUSTOMER_IDS[3]}%'
-        OR ATTRIBUTES LIKE '%{CUSTOMER_IDS[4]}%'
-        OR ATTRIBUTES LIKE '%{CUSTOMER_IDS[5]}%'
-        OR ATTRIBUTES LIKE '%{CUSTOMER_IDS[6]}%'
-        OR ATTRIBUTES LIKE '%{CUSTOMER_IDS[7]}%'
-        OR ATTRIBUTES LIKE '%101785816%'
-        OR ATTRIBUTES LIKE '%103041737%'
-        OR ATTRIBUTES LIKE '%103046879%'
-        OR ATTRIBUTES LIKE '%103034606%'
-        OR ATTRIBUTES LIKE '%101291139%'
-        OR ATTRIBUTES LIKE '%103144223%'
-        OR ATTRIBUTES LIKE '%102732743%'
-        OR ATTRIBUTES LIKE '%102740597%'
-      )
-    ORDER BY TIMESTAMP DESC
-    LIMIT 500
+      AND EXISTS (SELECT 1 FROM {id_table} ids WHERE CONTAINS(TO_VARCHAR(l.ATTRIBUTES), ids.ID))
+      AND {KEYSET}
     """
 
     print("Exécution de la requête logs litigation...")
-    cursor = conn.cursor()
-    cursor.execute(query)
-    results = cursor.fetchall()
+    if time_slice is None:
+        rows = stream_query(conn, query, "l.TIMESTAMP DESC", limit=limit, key=("l.TIMESTAMP", 0))
+    else:
+        rows = scan_time_slices(conn, query, "l.TIMESTAMP", date_start, date_end, time_slice,
+                                limit=limit, max_workers=max_workers)
 
-    print(f"\n=== {len(results)} logs trouvés ===\n")
-    for row in results:
-        print(f"[{row[0]}] {row[1]} | {row[2]} | {row[3][:200]}...")
-        print(f"  Attrs: {str(row[4])[:300]}...")
-        print("-" * 80)
+    count = export_rows(rows, open_sink(output, _format_log))
 
-    return results
+    print(f"\n=== {count} logs trouvés ===\n")
+    return count
 
-def search_reminder_errors(conn, date_start="2025-11-04", date_end="2025-11-05"):
-    """Recherche spécifique des erreurs de reminder"""
+def search_reminder_errors(conn, date_start=INCIDENT_DATE_START, date_end=INCIDENT_DATE_END, limit=200, time_slice=None,
+                           max_workers=LOG_SCAN_MAX_WORKERS, output=None):
+    """Recherche spécifique des erreurs de reminder
+
+    limit=None : tout, en flux. time_slice='hour' / 'day' : scan parallèle par tranches.
+    output : fichier .jsonl / .csv / .parquet au lieu de l'affichage console tronqué.
+    """
+    time_filter = f"TIMESTAMP BETWEEN '{date_start}' AND '{date_end}'" if time_slice is None else TIME_SLICE
 
     query = f"""
     SELECT
@@ -111,7 +1780,7 @@ def search_reminder_errors(conn, date_start="2025-11-04", date_end="2025-11-05")
         MESSAGE,
         ATTRIBUTES
     FROM LOGS_ML  -- Adapter le nom de la table
-    WHERE TIMESTAMP BETWEEN '{date_start}' AND '{date_end}'
+    WHERE {time_filter}
       AND SERVICE LIKE '%litigation%'
       AND LOG_LEVEL IN ('ERROR', 'WARN')
       AND (
@@ -122,24 +1791,554 @@ def search_reminder_errors(conn, date_start="2025-11-04", date_end="2025-11-05")
         OR MESSAGE LIKE '%CALCULATED_AMOUNT%'
         OR MESSAGE LIKE '%FORECASTED_DEBT%'
       )
-    ORDER BY TIMESTAMP DESC
-    LIMIT 200
+      AND {KEYSET}
     """
 
     print("\nRecherche des erreurs/warnings de reminder...")
-    cursor = conn.cursor()
-    cursor.execute(query)
-    results = cursor.fetchall()
+    if time_slice is None:
+        rows = stream_query(conn, query, "TIMESTAMP DESC", limit=limit, key=("TIMESTAMP", 0))
+    else:
+        rows = scan_time_slices(conn, query, "TIMESTAMP", date_start, date_end, time_slice,
+                                limit=limit, max_workers=max_workers)
 
-    print(f"\n=== {len(results)} erreurs/warnings trouvés ===\n")
-    for row in results:
-        print(f"[{row[0]}] {row[2]} | {row[3]}")
-        print(f"  {str(row[4])[:500]}")
-        print("-" * 80)
+    count = export_rows(rows, open_sink(output, _format_reminder_error))
 
-    return results
+    print(f"\n=== {count} erreurs/warnings trouvés ===\n")
+    return count
 
-def list_available_tables(conn):
+def _trie_regex(words):
+    """Alternative regex factorisée en trie : coût par position borné par la longueur des motifs, pas leur nombre"""
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = None
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+class PatternMatcher:
+    """Recherche simultanée de plusieurs motifs littéraux en une passe sur le texte
+
+    Automate Aho-Corasick de pyahocorasick s'il est installé, sinon une seule
+    expression régulière en trie et en lookahead (correspondances chevauchantes) ;
+    les motifs préfixes d'un motif trouvé à la même position sont ajoutés d'office.
+    whole_words=True : motifs = mots entiers (identifiants), recherche par table de
+    hachage sur les mots du texte.
+    """
+
+    def __init__(self, patterns, ignore_case=False, whole_words=False):
+        self.patterns = list(dict.fromkeys(patterns))
+        self.ignore_case = ignore_case
+        fold = str.casefold if ignore_case else (lambda text: text)
+        self._fold = fold
+        self._canonical = {fold(p): p for p in self.patterns}
+        if whole_words:
+            words = re.compile(r"\w+")
+            canonical = self._canonical
+            self.match = lambda text: {canonical[w] for w in words.findall(fold(text)) if w in canonical}
+            return
+        try:
+            import ahocorasick
+        except ImportError:
+            ahocorasick = None
+
+        if ahocorasick is not None:
+            automaton = ahocorasick.Automaton()
+            for key, pattern in self._canonical.items():
+                automaton.add_word(key, pattern)
+            automaton.make_automaton()
+            self.match = lambda text: {p for _, p in automaton.iter(fold(text))}
+            return
+
+        keys = self._canonical
+        self._prefixes = {
+            key: [keys[key[:n]] for n in range(1, len(key)) if key[:n] in keys] for key in keys
+        }
+        flags = re.IGNORECASE if ignore_case else 0
+        self._regex = re.compile("(?=(" + _trie_regex(keys) + "))", flags)
+
+    def match(self, text):
+        """Ensemble des motifs présents dans `text`"""
+        found = set()
+        for m in self._regex.finditer(text):
+            key = self._fold(m.group(1))
+            found.add(self._canonical[key])
+            found.update(self._prefixes[key])
+        return found
+
+class LogStore:
+    """Copie locale (SQLite) de fenêtres de logs, pour lancer autant de recherches que voulu sans warehouse"""
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(CACHE_DIR, "logs.sqlite")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._db = sqlite3.connect(self.path, timeout=LOG_STORE_LOCK_TIMEOUT)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS windows (
+                window TEXT PRIMARY KEY,
+                date_start TEXT NOT NULL,
+                date_end TEXT NOT NULL,
+                service_like TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                row_count INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS logs (
+                window TEXT NOT NULL,
+                timestamp TEXT,
+                service TEXT,
+                log_level TEXT,
+                message TEXT,
+                attributes TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_logs_window_ts ON logs (window, timestamp);
+        """)
+
+    @staticmethod
+    def window_key(date_start, date_end, service_like):
+        return f"{date_start}|{date_end}|{service_like}"
+
+    def has_window(self, window):
+        return self._db.execute("SELECT 1 FROM windows WHERE window = ?", (window,)).fetchone() is not None
+
+    def pull(self, conn, date_start, date_end, service_like="%litigation%", time_slice=None, refresh=False):
+        """Télécharge une fois la fenêtre de logs (filtre temps + service uniquement) ; retourne sa clé"""
+        window = self.window_key(date_start, date_end, service_like)
+        if self.has_window(window) and not refresh:
+            return window
+
+        count = 0
+        with self._db:
+            # Verrou d'écriture pris avant la requête : un pull concurrent de la même fenêtre
+            # l'attend puis la réutilise, sans rien envoyer au warehouse
+            self._db.execute("BEGIN IMMEDIATE")
+            if self.has_window(window) and not refresh:
+                return window
+
+            time_filter = f"TIMESTAMP BETWEEN '{date_start}' AND '{date_end}'" if time_slice is None else TIME_SLICE
+            query = f"""
+            SELECT TIMESTAMP, SERVICE, LOG_LEVEL, MESSAGE, ATTRIBUTES
+            FROM LOGS_ML  -- Adapter le nom de la table
+            WHERE {time_filter}
+              AND SERVICE LIKE {_sql_literal(service_like)}
+              AND {KEYSET}
+            """
+            if time_slice is None:
+                rows = stream_query(conn, query, key=("TIMESTAMP", 0))
+            else:
+                rows = scan_time_slices(conn, query, "TIMESTAMP", date_start, date_end, time_slice)
+
+            self._db.execute("DELETE FROM logs WHERE window = ?", (window,))
+            while True:
+                batch = list(itertools.islice(iter(rows), FETCH_BATCH_SIZE))
+                if not batch:
+                    break
+                self._db.executemany(
+                    "INSERT INTO logs VALUES (?, ?, ?, ?, ?, ?)",
+                    [(window, _iso(ts), service, level, message,
+                      None if attrs is None else attrs if isinstance(attrs, str) else json.dumps(attrs, default=str))
+                     for ts, service, level, message, attrs in batch],
+                )
+                count += len(batch)
+            self._db.execute(
+                "INSERT OR REPLACE INTO windows VALUES (?, ?, ?, ?, ?, ?)",
+                (window, str(date_start), str(date_end), service_like, time.time(), count),
+            )
+        return window
+
+    def logs(self, window):
+        """Logs d'une fenêtre (timestamp, service, log_level, message, attributes), du plus récent au plus ancien"""
+        return self._db.execute(
+            "SELECT timestamp, service, log_level, message, attributes FROM logs"
+            " WHERE window = ? ORDER BY timestamp DESC",
+            (window,),
+        )
+
+    def tag(self, window, matcher, fields=(3,)):
+        """Étiquette chaque log avec les motifs trouvés dans `fields` (indices de colonnes)
+
+        Retourne (Counter par motif, [(log, motifs)] des logs étiquetés).
+        """
+        counts = Counter()
+        tagged = []
+        seen = {}  # Les messages se répètent beaucoup : un seul passage de l'automate par texte distinct
+        for row in self.logs(window):
+            found = set()
+            for index in fields:
+                text = row[index]
+                if text:
+                    if text not in seen:
+                        seen[text] = frozenset(matcher.match(text))
+                    found |= seen[text]
+            if found:
+                counts.update(found)
+                tagged.append((row, found))
+        return counts, tagged
+
+    def close(self):
+        self._db.close()
+
+def grep_logs(conn, patterns=None, date_start=INCIDENT_DATE_START, date_end=INCIDENT_DATE_END, store=None,
+              refresh=False, ignore_case=False, attributes=False, examples=3):
+    """« Pull once, grep many » : fenêtre de logs téléchargée une fois, motifs cherchés localement
+
+    Chaque log est étiqueté avec tous les codes trouvés ; les comptes sont agrégés par code.
+    attributes=True : cherche aussi dans ATTRIBUTES (IDs clients, numéros de compte...).
+    """
+    store = store or LogStore()
+    matcher = PatternMatcher(LOG_REASON_CODES if patterns is None else patterns, ignore_case=ignore_case)
+
+    window = LogStore.window_key(date_start, date_end, "%litigation%")
+    if refresh or not store.has_window(window):
+        print(f"⬇️  Téléchargement des logs {date_start} → {date_end}...")
+        store.pull(conn, date_start, date_end, refresh=refresh)
+
+    start = time.perf_counter()
+    counts, tagged = store.tag(window, matcher, fields=(3, 4) if attributes else (3,))
+    elapsed = time.perf_counter() - start
+
+    print(f"\n=== {len(tagged)} logs étiquetés ({len(matcher.patterns)} motifs, {elapsed * 1000:.0f} ms) ===")
+    for pattern in matcher.patterns:
+        print(f"  {pattern:<28} {counts[pattern]:>8}")
+        shown = 0
+        for row, found in tagged:
+            if shown >= examples:
+                break
+            if pattern in found:
+                print(f"      [{row[0]}] {row[2]} | {row[3][:150]}")
+                shown += 1
+    return counts
+
+class Identity:
+    """Un copropriétaire : numéro de compte, customer IDs MongoDB et recovery files rattachés"""
+    __slots__ = ("account_number", "customer_ids", "recovery_file_ids", "name", "agency")
+
+    def __init__(self):
+        self.account_number = None
+        self.customer_ids = set()
+        self.recovery_file_ids = set()
+        self.name = None
+        self.agency = None
+
+    def keys(self):
+        keys = self.customer_ids | self.recovery_file_ids
+        if self.account_number:
+            keys.add(self.account_number)
+        return keys
+
+class IdentityMap:
+    """Correspondance indexée customer ID ↔ numéro de compte ↔ recovery file ID
+
+    Chaque identifiant pointe vers son Identity (dictionnaire unique) ; ajouter
+    un lien entre deux identités existantes les fusionne.
+    """
+
+    def __init__(self):
+        self._index = {}
+
+    def add(self, customer_id=None, account_number=None, recovery_file_id=None, name=None, agency=None):
+        keys = [k for k in (customer_id, account_number, recovery_file_id) if k]
+        found = []
+        for key in keys:
+            identity = self._index.get(key)
+            if identity is not None and identity not in found:
+                found.append(identity)
+        identity = found[0] if found else Identity()
+        for other in found[1:]:
+            identity.customer_ids |= other.customer_ids
+            identity.recovery_file_ids |= other.recovery_file_ids
+            identity.account_number = identity.account_number or other.account_number
+            identity.name = identity.name or other.name
+            identity.agency = identity.agency or other.agency
+            for key in other.keys():
+                self._index[key] = identity
+
+        if customer_id:
+            identity.customer_ids.add(customer_id)
+        if account_number:
+            identity.account_number = account_number
+        if recovery_file_id:
+            identity.recovery_file_ids.add(recovery_file_id)
+        identity.name = name or identity.name
+        identity.agency = agency or identity.agency
+        for key in keys:
+            self._index[key] = identity
+        return identity
+
+    def resolve(self, key):
+        return self._index.get(key)
+
+    def keys(self):
+        return list(self._index)
+
+    def identities(self):
+        return list({id(i): i for i in self._index.values()}.values())
+
+    def customer_ids(self):
+        return [k for k, i in self._index.items() if k in i.customer_ids]
+
+    def account_numbers(self):
+        return [k for k, i in self._index.items() if k == i.account_number]
+
+    def recovery_file_ids(self):
+        return [k for k, i in self._index.items() if k in i.recovery_file_ids]
+
+    def __len__(self):
+        return len(self.identities())
+
+    @classmethod
+    def from_constants(cls, customer_ids=None, account_numbers=None, recovery_ids=None):
+        """Identités de l'incident : CUSTOMER_IDS et EXTERNAL_CODES sont alignés, RECOVERY_IDS à rattacher"""
+        identities = cls()
+        customer_ids = CUSTOMER_IDS if customer_ids is None else customer_ids
+        account_numbers = EXTERNAL_CODES if account_numbers is None else account_numbers
+        for customer_id, account_number in itertools.zip_longest(customer_ids, account_numbers):
+            identities.add(customer_id=customer_id, account_number=account_number)
+        for recovery_file_id in RECOVERY_IDS if recovery_ids is None else recovery_ids:
+            identities.add(recovery_file_id=recovery_file_id)
+        return identities
+
+    def link(self, conn):
+        """Complète les liens depuis le warehouse et retourne la dernière photo RECOVERY_CO par recovery file
+
+        RECOVERYFILES relie customer ID ↔ recovery file, RECOVERY_CO recovery file ↔ numéro de compte.
+        Deux requêtes filtrées par tables d'IDs, quel que soit le nombre d'identités.
+        """
+        files = upload_id_set(conn, "IDENTITY_FILES", self.recovery_file_ids() or ["-"])
+        customers = upload_id_set(conn, "IDENTITY_CUSTOMERS", self.customer_ids() or ["-"])
+        cursor = conn.cursor()
+        # CUSTOMER : {"$oid": ...} ou l'ID en chaîne, comme dans explore_plato_recoveryfiles
+        cursor.execute(f"""
+            SELECT _ID, COALESCE(CUSTOMER:$oid::string, AS_VARCHAR(CUSTOMER))
+            FROM DATALAKE_ML_PROD.PLATO.RECOVERYFILES
+            WHERE _ID IN (SELECT ID FROM {files})
+               OR CUSTOMER:$oid::string IN (SELECT ID FROM {customers})
+               OR CUSTOMER IN (SELECT ID FROM {customers})
+        """)
+        for recovery_file_id, customer_id in iter_rows(cursor):
+            self.add(customer_id=customer_id, recovery_file_id=recovery_file_id)
+
+        files = upload_id_set(conn, "IDENTITY_FILES", self.recovery_file_ids() or ["-"])
+        accounts = upload_id_set(conn, "IDENTITY_ACCOUNTS", self.account_numbers() or ["-"])
+        rows = stream_query(conn, f"""
+            SELECT RECOVERY_FILE_ID, CO_OWNER_ACCOUNT_NUMBER, CO_OWNER_FULL_NAME, AGENCY_NAME, DATE_PERIOD,
+                   LEVEL, RECOVERY_STATUS, AMOUNT, CALCULATED_AMOUNT, AUTOMATIC_REMINDER, LAST_REMINDER_DATE
+            FROM DATAMART_ML_PROD.ACCOUNTING.RECOVERY_CO
+            WHERE RECOVERY_FILE_ID IN (SELECT ID FROM {files})
+               OR CO_OWNER_ACCOUNT_NUMBER IN (SELECT ID FROM {accounts})
+            QUALIFY ROW_NUMBER() OVER (PARTITION BY RECOVERY_FILE_ID ORDER BY DATE_PERIOD DESC) = 1
+        """)
+        latest = {}
+        for row in rows:
+            self.add(recovery_file_id=row[0], account_number=row[1], name=row[2], agency=row[3])
+            latest[row[0]] = row
+        return latest
+
+# Colonnes d'un enregistrement de diagnostic (une ligne par copropriétaire et recovery file)
+DIAGNOSIS_COLUMNS = [
+    "CO_OWNER_FULL_NAME", "AGENCY_NAME", "CO_OWNER_ACCOUNT_NUMBER", "CUSTOMER_IDS", "RECOVERY_FILE_ID",
+    "DATE_PERIOD", "LEVEL", "RECOVERY_STATUS", "AMOUNT_EUR", "CALCULATED_EUR", "AUTOMATIC_REMINDER",
+    "LAST_REMINDER_DATE", "BLOCKED", "LOG_COUNT", "REASON_CODES", "LAST_LOG",
+]
+
+def diagnose_co_owners(conn, identities=None, date_start=INCIDENT_DATE_START, date_end=INCIDENT_DATE_END, store=None,
+                       output=None):
+    """Diagnostic par copropriétaire : dernière photo RECOVERY_CO + logs d'erreur correspondants
+
+    Jointure par hachage en local : la photo RECOVERY_CO est indexée par recovery
+    file, les logs de la fenêtre (LogStore, téléchargée une fois) sont sondés en une
+    passe par un automate sur tous les identifiants connus (ATTRIBUTES) puis
+    rattachés à leur identité. output : fichier .jsonl / .csv / .parquet.
+    """
+    identities = identities or IdentityMap.from_constants()
+    latest = identities.link(conn)
+
+    store = store or LogStore()
+    window = store.pull(conn, date_start, date_end)
+    id_matcher = PatternMatcher(identities.keys(), whole_words=True)
+    reason_matcher = PatternMatcher(LOG_REASON_CODES)
+
+    logs_by_identity = {}
+    for row in store.logs(window):
+        attributes = row[4]
+        if not attributes:
+            continue
+        for identity in {id(i): i for i in map(identities.resolve, id_matcher.match(attributes))}.values():
+            logs_by_identity.setdefault(id(identity), []).append(row)
+
+    def records():
+        for identity in sorted(identities.identities(), key=lambda i: (i.agency or "", i.name or "")):
+            logs = logs_by_identity.get(id(identity), [])
+            codes = Counter()
+            for row in logs:
+                codes.update(reason_matcher.match(row[3] or ""))
+            file_ids = sorted(identity.recovery_file_ids) or [None]
+            for file_id in file_ids:
+                snap = latest.get(file_id)
+                level = status = period = amount = calculated = auto = last_reminder = None
+                if snap is not None:
+                    _, _, _, _, period, level, status, amount, calculated, auto, last_reminder = snap
+                yield (
+                    identity.name,
+                    identity.agency,
+                    identity.account_number,
+                    ",".join(sorted(identity.customer_ids)),
+                    file_id,
+                    period,
+                    level,
+                    status,
+                    _cents_to_euros(amount),
+                    _cents_to_euros(calculated),
+                    auto,
+                    last_reminder,
+                    status == "ONGOING_REMINDER" and level == 1.0,
+                    len(logs),
+                    ",".join(f"{code}:{n}" for code, n in codes.most_common()),
+                    logs[0][3] if logs else None,
+                )
+
+    rows = RowStream([(name,) for name in DIAGNOSIS_COLUMNS], records())
+    if output is not None:
+        count = export_rows(rows, open_sink(output))
+        print(f"\n  📄 {count} diagnostics écrits dans {output}")
+        return count
+
+    print("\n" + "="*60)
+    print(f"🩺 Diagnostic de {len(identities)} copropriétaires")
+    print("="*60)
+    count = 0
+    for (name, agency, account, customers, file_id, period, level, status, amount, calculated, _,
+         _, blocked, log_count, codes, last_log) in rows:
+        count += 1
+        print(f"\n  {name} ({account}) - {agency} {'⚠️ BLOQUE' if blocked else '✅ OK'}")
+        print(f"      Recovery ID: {file_id} | Customer: {customers}")
+        print(f"      Level: {level} | Status: {status} | Période: {period}")
+        print(f"      Amount: {amount}€, Calculated: {calculated}€")
+        print(f"      Logs: {log_count} | Codes: {codes or '-'}")
+        if last_log:
+            print(f"      Dernier log: {last_log[:150]}")
+    return count
+
+PROFILE_COLUMNS = ["COLUMN", "TYPE", "NULL_RATIO", "DISTINCT", "UNIQUE_RATIO", "MIN", "MAX", "TOP_K", "HINT"]
+
+_SEMI_STRUCTURED_TYPES = {"VARIANT", "OBJECT", "ARRAY"}
+# ObjectId MongoDB, brut ou en VARIANT {"$oid": ...}
+_OBJECT_ID = re.compile(r'[0-9a-f]{24}|\{\s*"\$oid"\s*:\s*"[0-9a-f]{24}"\s*\}')
+
+def _profile_query(source, columns, percent, top):
+    """Une seule passe : COUNT / APPROX_COUNT_DISTINCT / MIN / MAX / APPROX_TOP_K par colonne"""
+    if percent < 100:
+        source += f" SAMPLE SYSTEM ({percent:.6f}) SEED (42)"
+    exprs = ["COUNT(*)"]
+    for name, type_ in columns:
+        column = f'"{name}"'
+        if type_.split("(")[0] in _SEMI_STRUCTURED_TYPES:
+            column += "::STRING"
+            bounds = "NULL, NULL"
+        else:
+            bounds = f"MIN({column}), MAX({column})"
+        exprs.append(f"COUNT({column}), APPROX_COUNT_DISTINCT({column}), {bounds}, APPROX_TOP_K({column}, {top})")
+    return f"SELECT {', '.join(exprs)} FROM {source}"
+
+def _profile_value(value):
+    """Valeur sérialisable en JSON pour le catalogue (dates en ISO, décimaux en texte)"""
+    value = _plain_value(value)
+    return value if value is None or isinstance(value, (str, int, float, bool)) else str(value)
+
+def _column_hint(column):
+    """Indice sur le rôle d'une colonne : ObjectId MongoDB, unique, constante, vide"""
+    non_null, distinct = column["non_null"], column["distinct"]
+    if not non_null:
+        return "vide"
+    hints = []
+    values = [column["min"], column["max"]] + [value for value, _ in column["top"]]
+    if all(isinstance(v, str) and _OBJECT_ID.fullmatch(v) for v in values if v is not None):
+        hints.append("ObjectId")
+    if distinct >= 0.95 * non_null:
+        hints.append("unique")
+    elif distinct == 1:
+        hints.append("constante")
+    return " ".join(hints)
+
+def profile_table(conn, database, schema, table, catalog=None, sample_rows=PROFILE_SAMPLE_ROWS, top=PROFILE_TOP_K,
+                  refresh=False, output=None):
+    """Profil des colonnes d'une table sur échantillon : taux de NULL, cardinalité, min/max, top-k
+
+    SAMPLE SYSTEM (par micro-partitions) dimensionné pour ~`sample_rows` lignes et agrégats
+    approximatifs en une seule requête : quelques secondes même sur des milliards de lignes.
+    Le profil est gardé dans le catalogue local (PROFILE_TTL) ; `refresh` le recalcule.
+    """
+    key = (database, schema, table)
+    profile = None if refresh or catalog is None else catalog.get("profile", *key)
+    cached = profile is not None
+    if profile is None:
+        columns = describe_table(conn, database, schema, table, catalog=catalog)
+        source = f"{database}.{schema}.{table}"
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT COUNT(*) FROM {source}")  # Servi par les métadonnées de micro-partitions
+        row_count = cursor.fetchone()[0]
+        percent = 100.0 if row_count <= sample_rows else max(100.0 * sample_rows / row_count, 0.000001)
+        cursor.execute(_profile_query(source, columns, percent, top))
+        values = cursor.fetchone()
+
+        profile = {"row_count": row_count, "sampled": values[0], "percent": percent, "columns": []}
+        for i, (name, type_) in enumerate(columns):
+            non_null, distinct, low, high, top_k = values[1 + 5 * i:6 + 5 * i]
+            top_k = json.loads(top_k) if isinstance(top_k, str) else top_k or []
+            profile["columns"].append({
+                "name": name,
+                "type": type_,
+                "non_null": non_null,
+                "distinct": distinct,
+                "min": _profile_value(low),
+                "max": _profile_value(high),
+                "top": [[_profile_value(value), count] for value, count in top_k],
+            })
+        if catalog is not None:
+            catalog.put("profile", *key, value=profile, ttl=PROFILE_TTL)
+
+    sampled = profile["sampled"]
+    report = [
+        (
+            c["name"],
+            c["type"],
+            1 - c["non_null"] / sampled if sampled else None,
+            c["distinct"],
+            c["distinct"] / c["non_null"] if c["non_null"] else None,
+            c["min"],
+            c["max"],
+            json.dumps(c["top"], ensure_ascii=False),
+            _column_hint(c),
+        )
+        for c in profile["columns"]
+    ]
+
+    print(f"\n📊 Profil de {database}.{schema}.{table} : {profile['row_count']:,} lignes, "
+          f"échantillon de {sampled:,} ({profile['percent']:.4g} %)" + (" [cache]" if cached else ""))
+    if output is not None:
+        count = export_rows(RowStream([(c,) for c in PROFILE_COLUMNS], iter(report)), open_sink(output))
+        print(f"  📄 {count} colonnes écrites dans {output}")
+        return profile
+
+    for (name, type_, null_ratio, distinct, unique_ratio, low, high, _, hint), c in zip(report, profile["columns"]):
+        nulls = "-" if null_ratio is None else f"{null_ratio:.0%}"
+        unique = "-" if unique_ratio is None else f"{unique_ratio:.0%}"
+        print(f"\n  - {name}: {type_}  {'🔑 ' + hint if 'ObjectId' in hint else hint}")
+        print(f"      NULL: {nulls}, distinct: ~{distinct:,} (unicité {unique})")
+        if low is not None:
+            print(f"      Min/Max: {str(low)[:40]} → {str(high)[:40]}")
+        if c["top"]:
+            print("      Top: " + ", ".join(f"{str(v)[:30]} ({n:,})" for v, n in c["top"]))
+    return profile
+
+def list_available_tables(conn, catalog=None):
     """Liste les tables disponibles pour trouver la bonne"""
     cursor = conn.cursor()
 
@@ -151,203 +2350,317 @@ def list_available_tables(conn):
 
     # Lister les schémas
     print("\n📁 Schémas dans DATALAKE_ML_PROD:")
-    cursor.execute("SHOW SCHEMAS IN DATABASE DATALAKE_ML_PROD")
-    for row in cursor.fetchall():
-        print(f"  - {row[1]}")
+    for schema in show_schemas(conn, "DATALAKE_ML_PROD", catalog=catalog):
+        print(f"  - {schema}")
 
     # Chercher toutes les tables
     print("\n📋 Tables dans DATALAKE_ML_PROD:")
-    cursor.execute("SHOW TABLES IN DATABASE DATALAKE_ML_PROD")
-    tables = cursor.fetchall()
-    for row in tables[:30]:  # Limiter à 30
-        print(f"  - {row[1]}.{row[2]}")
+    tables = database_tables(conn, "DATALAKE_ML_PROD", catalog=catalog)
+    for schema, table in tables[:30]:  # Limiter à 30
+        print(f"  - {schema}.{table}")
 
-def explore_datadog_archive(conn):
+def explore_datadog_archive(conn, catalog=None):
     """Explorer le schéma DATADOG_ARCHIVE pour les logs"""
-    cursor = conn.cursor()
-
     print("\n📋 Tables dans DATADOG_ARCHIVE:")
-    cursor.execute("SHOW TABLES IN SCHEMA DATALAKE_ML_PROD.DATADOG_ARCHIVE")
-    tables = cursor.fetchall()
-    for row in tables[:20]:
-        print(f"  - {row[1]}")
+    tables = show_tables(conn, "DATALAKE_ML_PROD", "DATADOG_ARCHIVE", catalog=catalog)
+    for table in tables[:20]:
+        print(f"  - {table}")
 
     # Si on trouve une table de logs, on peut requêter
     if tables:
-        table_name = tables[0][1]
+        table_name = tables[0]
         print(f"\n📄 Structure de {table_name}:")
-        cursor.execute(f"DESCRIBE TABLE DATALAKE_ML_PROD.DATADOG_ARCHIVE.{table_name}")
-        for row in cursor.fetchall():
-            print(f"  - {row[0]}: {row[1]}")
+        for col in describe_table(conn, "DATALAKE_ML_PROD", "DATADOG_ARCHIVE", table_name, catalog=catalog):
+            print(f"  - {col[0]}: {col[1]}")
 
-def explore_plato_recoveryfiles(conn):
+def explore_plato_recoveryfiles(conn, catalog=None, customer_ids=None):
     """Explorer les recovery files dans PLATO"""
     cursor = conn.cursor()
 
-    print("\n📋 Toutes les tables dans PLATO:")
-    cursor.execute("SHOW TABLES IN SCHEMA DATALAKE_ML_PROD.PLATO")
-    tables = cursor.fetchall()
-    for row in tables:
-        print(f"  - {row[1]}")
+    print("\n📋 Toutes les tables dans PLATO:")
+    for table in show_tables(conn, "DATALAKE_ML_PROD", "PLATO", catalog=catalog):
+        print(f"  - {table}")
+
+    print("\n📋 Tables dans PLATO contenant 'recovery':")
+    for table in show_tables(conn, "DATALAKE_ML_PROD", "PLATO", catalog=catalog, like="%RECOVERY%"):
+        print(f"  - {table}")
+
+    # Chercher les recovery files des customers concernés
+    print("\n🔍 Recherche des recovery files pour les customers concernés:")
+    try:
+        id_table = upload_id_set(conn, "CUSTOMERS", CUSTOMER_IDS if customer_ids is None else customer_ids)
+        cursor.execute(f"""
+            SELECT _ID, CUSTOMER, LEVEL, KIND, AMOUNT, AUTOMATICREMINDER, UPDATEDAT
+            FROM DATALAKE_ML_PROD.PLATO.RECOVERYFILES
+            WHERE CUSTOMER:$oid IN (SELECT ID FROM {id_table})
+               OR CUSTOMER IN (SELECT ID FROM {id_table})
+            LIMIT 20
+        """)
+        results = cursor.fetchall()
+        print(f"\n  Trouvé {len(results)} recovery files:")
+        for row in results:
+            print(f"    ID: {row[0]}, Customer: {row[1]}, Level: {row[2]}, Kind: {row[3]}, Amount: {row[4]}, Auto: {row[5]}, Updated: {row[6]}")
+    except Exception as e:
+        print(f"  Erreur: {e}")
+
+    # Structure de la table
+    print("\n📄 Structure de RECOVERYFILES:")
+    try:
+        for col in describe_table(conn, "DATALAKE_ML_PROD", "PLATO", "RECOVERYFILES", catalog=catalog)[:15]:
+            print(f"  - {col[0]}: {col[1]}")
+    except Exception as e:
+        print(f"  Erreur: {e}")
+
+def _fetch_query(conn, query):
+    """Exécute une requête sur un curseur dédié (un curseur par thread)"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+def run_concurrent(conn, queries, max_workers=CRAWLER_MAX_WORKERS):
+    """Exécute des requêtes en parallèle via un pool borné
+
+    Retourne une liste de (rows, erreur) dans l'ordre des requêtes.
+    """
+    def task(query):
+        try:
+            return _fetch_query(conn, query), None
+        except Exception as e:
+            return None, e
+
+    if max_workers <= 1 or len(queries) <= 1:
+        return [task(q) for q in queries]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(queries))) as pool:
+        return list(pool.map(task, queries))
+
+async def wait_for_query(conn, sfqid, interval=ASYNC_POLL_INTERVAL, max_interval=ASYNC_POLL_MAX_INTERVAL):
+    """Attend la fin d'une requête soumise par execute_async en sondant son statut (attente exponentielle)"""
+    import asyncio
+
+    while True:
+        status = await asyncio.to_thread(conn.get_query_status, sfqid)
+        if not conn.is_still_running(status):
+            break
+        await asyncio.sleep(interval)
+        interval = min(interval * 2, max_interval)
+    if conn.is_an_error(status):
+        conn.get_query_status_throw_if_error(sfqid)
+    return status
+
+async def execute_query_async(conn, query, params=None):
+    """Soumet une requête sans bloquer la boucle : execute_async puis sondage, curseur prêt à lire
+
+    Sans execute_async (proxy de profilage, pilote de test...) : execute() dans un thread.
+    """
+    import asyncio
+
+    cursor = conn.cursor()
+    if not hasattr(cursor, "execute_async"):
+        await asyncio.to_thread(_execute, cursor, query, params)
+        return cursor
+    if params is None:
+        await asyncio.to_thread(cursor.execute_async, query)
+    else:
+        await asyncio.to_thread(cursor.execute_async, query, params)
+    if cursor.sfqid is not None:
+        await wait_for_query(conn, cursor.sfqid)
+        await asyncio.to_thread(cursor.get_results_from_sfqid, cursor.sfqid)
+    return cursor
+
+async def run_concurrent_async(conn, queries):
+    """Équivalent asyncio de run_concurrent : toutes les requêtes soumises d'un coup, sondées ensemble
+
+    Retourne une liste de (rows, erreur) dans l'ordre des requêtes.
+    """
+    import asyncio
+
+    async def task(query):
+        try:
+            cursor = await execute_query_async(conn, query)
+            return await asyncio.to_thread(cursor.fetchall), None
+        except Exception as e:
+            return None, e
+
+    return list(await asyncio.gather(*(task(q) for q in queries)))
+
+class StageOutput:
+    """sys.stdout aiguillé par thread : chaque étape parallèle écrit dans son propre tampon"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffers = {}
+
+    def write(self, text):
+        return self.buffers.get(threading.get_ident(), self.stream).write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+async def run_stages(conn, stages):
+    """Exécute des étapes indépendantes en parallèle, sortie de chacune affichée d'un bloc à sa fin
+
+    stages : {nom: fonction(conn)} ; fonctions synchrones dans un thread (leurs requêtes
+    se chevauchent), coroutines directement dans la boucle. Retourne {nom: résultat ou exception}.
+    """
+    import asyncio
+
+    output = StageOutput(sys.stdout)
+    durations = {}
+
+    async def run(name, fn):
+        started = time.perf_counter()
+        buffer = io.StringIO()
+
+        def in_thread():
+            output.buffers[threading.get_ident()] = buffer
+            try:
+                return fn(conn)
+            finally:
+                del output.buffers[threading.get_ident()]
+
+        try:
+            result = await fn(conn) if asyncio.iscoroutinefunction(fn) else await asyncio.to_thread(in_thread)
+        except Exception as e:
+            result = e
+        durations[name] = time.perf_counter() - started
+        output.stream.write(buffer.getvalue())
+        status = f"❌ {result}" if isinstance(result, Exception) else "✅"
+        print(f"\n⏱️  Étape {name} : {durations[name]:.2f}s {status}")
+        return name, result
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        results = dict(await asyncio.gather(*(run(name, fn) for name, fn in stages.items())))
+    print(f"\n⏱️  {len(stages)} étapes en {time.perf_counter() - started:.2f}s"
+          f" (somme des étapes : {sum(durations.values()):.2f}s)")
+    return results
+
+def crawl_catalog(conn, databases, max_workers=CRAWLER_MAX_WORKERS):
+    """Crawl concurrent : SHOW SCHEMAS par database, puis SHOW TABLES par schéma
 
-    print("\n📋 Tables dans PLATO contenant 'recovery':")
-    cursor.execute("SHOW TABLES LIKE '%RECOVERY%' IN SCHEMA DATALAKE_ML_PROD.PLATO")
-    tables = cursor.fetchall()
-    for row in tables:
-        print(f"  - {row[1]}")
+    Les SHOW TABLES d'une database partent dès que ses schémas sont connus.
+    Retourne (catalog, errors) :
+      - catalog : {db: {schema: [tables triées]}} dans l'ordre des databases puis des schémas
+      - errors : {"db" ou "db.schema": exception}
+    """
+    found = {db: {} for db in databases}
+    errors = {}
 
-    # Chercher les recovery files des customers concernés
-    customer_ids = [
-        "64850e8066904ac4384dcd8f",
-        "657651005bb543430d0d4429",
-        "65765100324f70b903f53fec",
-        "65765100e79f4edf79861557",
-        "64850e80f9931de1a96b0096",
-        "65c0bd39f6d159fc2a37a1d7",
-        "6576510019d931c365894ef7",
-        "65765100ff47ee72e6cf5e4b",
-    ]
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        pending = {
+            pool.submit(_fetch_query, conn, f"SHOW SCHEMAS IN DATABASE {db}"): (db, None)
+            for db in databases
+        }
+        while pending:
+            future = next(as_completed(pending))
+            db, schema = pending.pop(future)
+            key = db if schema is None else f"{db}.{schema}"
+            try:
+                rows = future.result()
+            except Exception as e:
+                errors[key] = e
+                continue
 
-    print("\n🔍 Recherche des recovery files pour les customers concernés:")
-    try:
-        customer_list = ",".join([f"'{c}'" for c in customer_ids])
-        cursor.execute(f"""
-            SELECT _ID, CUSTOMER, LEVEL, KIND, AMOUNT, AUTOMATICREMINDER, UPDATEDAT
-            FROM DATALAKE_ML_PROD.PLATO.RECOVERYFILES
-            WHERE CUSTOMER:$oid IN ({customer_list})
-               OR CUSTOMER IN ({customer_list})
-            LIMIT 20
-        """)
-        results = cursor.fetchall()
-        print(f"\n  Trouvé {len(results)} recovery files:")
-        for row in results:
-            print(f"    ID: {row[0]}, Customer: {row[1]}, Level: {row[2]}, Kind: {row[3]}, Amount: {row[4]}, Auto: {row[5]}, Updated: {row[6]}")
-    except Exception as e:
-        print(f"  Erreur: {e}")
+            if schema is None:
+                for row in rows:
+                    schema_name = row[1]
+                    if schema_name == "INFORMATION_SCHEMA":
+                        continue
+                    found[db][schema_name] = []
+                    query = f"SHOW TABLES IN SCHEMA {db}.{schema_name}"
+                    pending[pool.submit(_fetch_query, conn, query)] = (db, schema_name)
+            else:
+                found[db][schema] = sorted(row[1] for row in rows)
 
-    # Structure de la table
-    print("\n📄 Structure de RECOVERYFILES:")
-    try:
-        cursor.execute("DESCRIBE TABLE DATALAKE_ML_PROD.PLATO.RECOVERYFILES")
-        for row in cursor.fetchall()[:15]:
-            print(f"  - {row[0]}: {row[1]}")
-    except Exception as e:
-        print(f"  Erreur: {e}")
+    catalog = {db: {s: found[db][s] for s in sorted(found[db])} for db in databases}
+    return catalog, errors
 
-def explore_all_databases(conn):
+def explore_all_databases(conn, databases=None, max_workers=CRAWLER_MAX_WORKERS):
     """Explorer toutes les databases pour trouver les données"""
-    cursor = conn.cursor()
+    if databases is None:
+        databases = CATALOG_DATABASES
 
-    databases = ["DATALAKE_ML_PROD", "DATAMART_ML_PROD", "DATAPREP_ML_PROD", "EXPORT_ML_PROD", "WORKSPACE_ML_PROD"]
+    catalog, errors = crawl_catalog(conn, databases, max_workers=max_workers)
 
-    for db in databases:
+    for db, schemas in catalog.items():
         print(f"\n{'='*60}")
         print(f"📊 DATABASE: {db}")
         print(f"{'='*60}")
 
-        try:
-            cursor.execute(f"SHOW SCHEMAS IN DATABASE {db}")
-            schemas = cursor.fetchall()
-            for schema in schemas:
-                schema_name = schema[1]
-                if schema_name == "INFORMATION_SCHEMA":
-                    continue
+        if db in errors:
+            print(f"  Erreur: {errors[db]}")
+            continue
 
-                print(f"\n  📁 Schema: {schema_name}")
-                try:
-                    cursor.execute(f"SHOW TABLES IN SCHEMA {db}.{schema_name}")
-                    tables = cursor.fetchall()
-                    for table in tables[:10]:
-                        print(f"    - {table[1]}")
-                    if len(tables) > 10:
-                        print(f"    ... et {len(tables) - 10} autres tables")
-                except Exception as e:
-                    print(f"    Erreur: {e}")
-        except Exception as e:
-            print(f"  Erreur: {e}")
+        for schema_name, tables in schemas.items():
+            print(f"\n  📁 Schema: {schema_name}")
+            if f"{db}.{schema_name}" in errors:
+                print(f"    Erreur: {errors[f'{db}.{schema_name}']}")
+                continue
+            for table in tables[:10]:
+                print(f"    - {table}")
+            if len(tables) > 10:
+                print(f"    ... et {len(tables) - 10} autres tables")
 
-def search_recovery_tables(conn):
-    """Chercher les tables liées aux recovery files"""
-    cursor = conn.cursor()
+    return catalog
 
+def search_recovery_tables(conn, max_workers=CRAWLER_MAX_WORKERS):
+    """Chercher les tables liées aux recovery files"""
     print("\n" + "="*60)
     print("🔍 Recherche de tables 'recovery' ou 'litigation'")
     print("="*60)
 
     databases = ["DATALAKE_ML_PROD", "DATAMART_ML_PROD", "DATAPREP_ML_PROD"]
+    keywords = ["RECOVERY", "LITIGATION", "REMINDER", "LOG"]
 
-    for db in databases:
-        try:
-            cursor.execute(f"SHOW TABLES LIKE '%RECOVERY%' IN DATABASE {db}")
-            tables = cursor.fetchall()
-            if tables:
-                print(f"\n  {db} - Tables RECOVERY:")
-                for t in tables:
-                    print(f"    - {t[1]}.{t[2]}")
-
-            cursor.execute(f"SHOW TABLES LIKE '%LITIGATION%' IN DATABASE {db}")
-            tables = cursor.fetchall()
-            if tables:
-                print(f"\n  {db} - Tables LITIGATION:")
-                for t in tables:
-                    print(f"    - {t[1]}.{t[2]}")
-
-            cursor.execute(f"SHOW TABLES LIKE '%REMINDER%' IN DATABASE {db}")
-            tables = cursor.fetchall()
-            if tables:
-                print(f"\n  {db} - Tables REMINDER:")
-                for t in tables:
-                    print(f"    - {t[1]}.{t[2]}")
-
-            cursor.execute(f"SHOW TABLES LIKE '%LOG%' IN DATABASE {db}")
-            tables = cursor.fetchall()
-            if tables:
-                print(f"\n  {db} - Tables LOG:")
-                for t in tables:
-                    print(f"    - {t[1]}.{t[2]}")
-        except Exception as e:
-            print(f"  {db} - Erreur: {e}")
+    searches = [(db, kw) for db in databases for kw in keywords]
+    queries = [f"SHOW TABLES LIKE '%{kw}%' IN DATABASE {db}" for db, kw in searches]
+    results = run_concurrent(conn, queries, max_workers=max_workers)
 
-def explore_recovery_co(conn):
-    """Explorer la table RECOVERY_CO"""
-    cursor = conn.cursor()
+    failed = set()
+    for (db, kw), (tables, error) in zip(searches, results):
+        if error is not None:
+            if db not in failed:
+                print(f"  {db} - Erreur: {error}")
+                failed.add(db)
+            continue
+        if tables:
+            print(f"\n  {db} - Tables {kw}:")
+            for t in sorted(tables, key=lambda t: (t[3], t[1])):
+                print(f"    - {t[3]}.{t[1]}")
 
+def explore_recovery_co(conn, catalog=None):
+    """Explorer la table RECOVERY_CO"""
     print("\n" + "="*60)
     print("📋 Structure de DATAMART_ML_PROD.RECOVERY_CO")
     print("="*60)
 
     try:
-        cursor.execute("DESCRIBE TABLE DATAMART_ML_PROD.RECOVERY_CO.DATAMART_ML_PROD")
-        for row in cursor.fetchall():
-            print(f"  - {row[0]}: {row[1]}")
+        for col in describe_table(conn, "DATAMART_ML_PROD", "RECOVERY_CO", "DATAMART_ML_PROD", catalog=catalog):
+            print(f"  - {col[0]}: {col[1]}")
     except Exception as e:
         print(f"  Erreur describe: {e}")
 
     # Chercher le bon nom de table
     print("\n📋 Tables dans DATAMART_ML_PROD.RECOVERY_CO:")
     try:
-        cursor.execute("SHOW TABLES IN SCHEMA DATAMART_ML_PROD.RECOVERY_CO")
-        tables = cursor.fetchall()
-        for t in tables:
-            print(f"  - {t[1]}")
+        for table in show_tables(conn, "DATAMART_ML_PROD", "RECOVERY_CO", catalog=catalog):
+            print(f"  - {table}")
             # Décrire la première table
-            if t[1]:
-                cursor.execute(f"DESCRIBE TABLE DATAMART_ML_PROD.RECOVERY_CO.{t[1]}")
-                print(f"\n  Structure de {t[1]}:")
-                for col in cursor.fetchall():
+            if table:
+                print(f"\n  Structure de {table}:")
+                for col in describe_table(conn, "DATAMART_ML_PROD", "RECOVERY_CO", table, catalog=catalog):
                     print(f"    - {col[0]}: {col[1]}")
     except Exception as e:
         print(f"  Erreur: {e}")
 
-def query_recovery_data(conn):
+def query_recovery_data(conn, catalog=None):
     """Requêter les données des copropriétaires concernés"""
-    cursor = conn.cursor()
-
-    # IDs externes des copropriétaires
-    external_codes = [
-        "101785816", "103041737", "103046879", "103034606",
-        "101291139", "103144223", "102732743", "102740597"
-    ]
 
     print("\n" + "="*60)
     print("🔍 Recherche des recovery files pour les copropriétaires")
@@ -355,46 +2668,210 @@ def query_recovery_data(conn):
 
     # D'abord lister les tables disponibles
     try:
-        cursor.execute("SHOW TABLES IN SCHEMA DATAMART_ML_PROD.RECOVERY_CO")
-        tables = cursor.fetchall()
+        tables = show_tables(conn, "DATAMART_ML_PROD", "RECOVERY_CO", catalog=catalog)
         if tables:
-            table_name = tables[0][1]
+            table_name = tables[0]
             print(f"\n  Utilisation de la table: {table_name}")
 
             # Exemple de données
-            cursor.execute(f"SELECT * FROM DATAMART_ML_PROD.RECOVERY_CO.{table_name} LIMIT 5")
-            cols = [desc[0] for desc in cursor.description]
-            print(f"\n  Colonnes: {cols}")
+            rows = stream_query(conn, f"SELECT * FROM DATAMART_ML_PROD.RECOVERY_CO.{table_name}", limit=5)
+            print(f"\n  Colonnes: {rows.columns}")
 
-            rows = cursor.fetchall()
             for row in rows:
                 print(f"\n  Row: {row}")
 
     except Exception as e:
         print(f"  Erreur: {e}")
 
-def find_and_query_recovery(conn):
-    """Trouver et interroger les tables recovery"""
-    cursor = conn.cursor()
+def _snapshot_kind(value):
+    """Type à restaurer à la lecture d'une valeur stockée en texte dans la copie locale"""
+    if isinstance(value, datetime):
+        return "datetime"
+    if isinstance(value, date):
+        return "date"
+    if isinstance(value, Decimal):
+        return "decimal"
+    if isinstance(value, (dict, list)):
+        return "json"
+    return None
 
-    # IDs MongoDB des customers concernés
-    customer_ids = [
-        "64850e8066904ac4384dcd8f",  # TOULOUSE 101785816
-        "657651005bb543430d0d4429",  # MARSEILLE 103041737
-        "65765100324f70b903f53fec",  # MARSEILLE 103046879
-        "65765100e79f4edf79861557",  # MARSEILLE 103034606
-        "64850e80f9931de1a96b0096",  # NICE 101291139
-        "65c0bd39f6d159fc2a37a1d7",  # TERRE OCCITANE 103144223
-        "6576510019d931c365894ef7",  # TERRE OCCITANE 102732743
-        "65765100ff47ee72e6cf5e4b",  # TERRE OCCITANE 102740597
-    ]
+def _snapshot_value(value):
+    """Valeur Snowflake → valeur SQLite (dates en ISO : l'ordre de l'index est celui des dates)"""
+    if isinstance(value, (date, Decimal)):
+        return str(value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    return value
+
+_SNAPSHOT_DECODERS = {
+    "datetime": datetime.fromisoformat,
+    "date": date.fromisoformat,
+    "decimal": Decimal,
+    "json": json.loads,
+}
+
+class RecoverySnapshot:
+    """Copie locale de RECOVERY_CO (SQLite mappé en mémoire) pour les recherches ponctuelles sans warehouse
+
+    Une partition par DATE_PERIOD : refresh() ne retélécharge que les partitions
+    nouvelles, celles dont le nombre de lignes a changé et la plus récente (encore
+    alimentée). Index B-tree sur SNAPSHOT_INDEXES : recherche par valeurs ou par
+    plage en quelques microsecondes, lignes rendues avec leurs types d'origine.
+    """
+
+    def __init__(self, path=None, mmap_size=SNAPSHOT_MMAP_SIZE):
+        self.path = path or os.path.join(CACHE_DIR, "recovery_co.sqlite")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._db = sqlite3.connect(self.path)
+        self._db.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS partitions (
+                date_period TEXT PRIMARY KEY,
+                row_count INTEGER NOT NULL,
+                fetched_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS columns (
+                position INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                kind TEXT
+            );
+        """)
+        self._load_columns()
+
+    def _load_columns(self):
+        rows = self._db.execute("SELECT name, kind FROM columns ORDER BY position").fetchall()
+        self.columns = [name for name, _ in rows]
+        self._kinds = dict(rows)
+
+    def _reset(self, columns):
+        """Schéma distant changé : table recréée, toutes les partitions sont à retélécharger"""
+        with self._db:
+            self._db.execute("DROP TABLE IF EXISTS recovery_co")
+            self._db.execute(f"CREATE TABLE recovery_co ({', '.join(columns)})")
+            for column in SNAPSHOT_INDEXES:
+                if column in columns:
+                    self._db.execute(f"CREATE INDEX idx_{column.lower()} ON recovery_co ({column})")
+            self._db.execute("DELETE FROM partitions")
+            self._db.execute("DELETE FROM columns")
+            self._db.executemany("INSERT INTO columns VALUES (?, ?, NULL)", enumerate(columns))
+        self._load_columns()
+
+    def refresh(self, conn, catalog=None, full=False):
+        """Met à jour la copie (full=True : toutes les partitions) ; retourne {DATE_PERIOD: lignes téléchargées}"""
+        columns = [c[0] for c in describe_table(conn, *SNAPSHOT_TABLE, catalog=catalog)]
+        if columns != self.columns:
+            self._reset(columns)
+
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT DATE_PERIOD, COUNT(*)
+            FROM {".".join(SNAPSHOT_TABLE)}
+            WHERE DATE_PERIOD IS NOT NULL
+            GROUP BY DATE_PERIOD
+        """)
+        remote = {_snapshot_value(period): count for period, count in cursor.fetchall()}
+        local = dict(self._db.execute("SELECT date_period, row_count FROM partitions"))
+        latest = max(remote, default=None)
+
+        with self._db:
+            for period in set(local) - set(remote):
+                self._db.execute("DELETE FROM recovery_co WHERE DATE_PERIOD = ?", (period,))
+                self._db.execute("DELETE FROM partitions WHERE date_period = ?", (period,))
+        stale = sorted(p for p, count in remote.items() if full or p == latest or local.get(p) != count)
+        return {period: self._pull(conn, period) for period in stale}
+
+    def _pull(self, conn, period):
+        """Remplace une partition DATE_PERIOD d'un bloc (une transaction)"""
+        rows = iter(stream_query(conn, f"""
+            SELECT {", ".join(self.columns)}
+            FROM {".".join(SNAPSHOT_TABLE)}
+            WHERE DATE_PERIOD = {_sql_literal(date.fromisoformat(period))}
+        """))
+        insert = f"INSERT INTO recovery_co VALUES ({', '.join('?' * len(self.columns))})"
+        kinds = dict(self._kinds)
+        count = 0
+        with self._db:
+            self._db.execute("DELETE FROM recovery_co WHERE DATE_PERIOD = ?", (period,))
+            while True:
+                batch = list(itertools.islice(rows, FETCH_BATCH_SIZE))
+                if not batch:
+                    break
+                for i, column in enumerate(self.columns):
+                    if kinds[column] is None:
+                        kinds[column] = _snapshot_kind(next((r[i] for r in batch if r[i] is not None), None))
+                self._db.executemany(insert, [tuple(map(_snapshot_value, row)) for row in batch])
+                count += len(batch)
+            self._db.executemany("UPDATE columns SET kind = ? WHERE name = ?",
+                                 [(kind, column) for column, kind in kinds.items() if kind])
+            self._db.execute("INSERT OR REPLACE INTO partitions VALUES (?, ?, ?)", (period, count, time.time()))
+        self._kinds = kinds
+        return count
+
+    def summary(self):
+        """(partitions, lignes, dernier téléchargement en timestamp ou None)"""
+        return self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(row_count), 0), MAX(fetched_at) FROM partitions"
+        ).fetchone()
+
+    def lookup(self, column, values, columns=None, order_by=None):
+        """Lignes dont `column` (indexée) vaut l'une des `values`, en RowStream"""
+        values = json.dumps([_snapshot_value(v) for v in values], default=str)
+        return self._select(column, f"{column} IN (SELECT value FROM json_each(?))", (values,), columns, order_by)
+
+    def between(self, column, low=None, high=None, columns=None, order_by=None):
+        """Lignes avec low <= `column` (indexée) <= high, bornes optionnelles, en RowStream"""
+        where, params = [], []
+        if low is not None:
+            where.append(f"{column} >= ?")
+            params.append(_snapshot_value(low))
+        if high is not None:
+            where.append(f"{column} <= ?")
+            params.append(_snapshot_value(high))
+        return self._select(column, " AND ".join(where) or f"{column} IS NOT NULL", params, columns, order_by)
 
+    def _select(self, column, where, params, columns, order_by):
+        if not self.columns:
+            raise RuntimeError("Copie locale de RECOVERY_CO vide : lancer d'abord la commande snapshot")
+        if column not in SNAPSHOT_INDEXES or column not in self._kinds:
+            raise ValueError(f"Colonne non indexée dans la copie locale : {column} "
+                             f"(indexées : {', '.join(SNAPSHOT_INDEXES)})")
+        columns = list(self.columns if columns is None else columns)
+        unknown = [c for c in columns if c not in self._kinds]
+        if unknown:
+            raise ValueError(f"Colonnes absentes de la copie locale : {', '.join(unknown)}")
+        sql = f"SELECT {', '.join(columns)} FROM recovery_co WHERE {where}"
+        if order_by is not None:
+            sql += f" ORDER BY {order_by}"
+        rows = self._db.execute(sql, params)
+
+        decoders = [(i, _SNAPSHOT_DECODERS[self._kinds[c]]) for i, c in enumerate(columns) if self._kinds[c]]
+        if decoders:
+            def decode(row):
+                values = list(row)
+                for i, decoder in decoders:
+                    if values[i] is not None:
+                        values[i] = decoder(values[i])
+                return tuple(values)
+            rows = map(decode, rows)
+        return RowStream([(c,) for c in columns], iter(rows))
+
+    def close(self):
+        self._db.close()
+
+def find_and_query_recovery(conn, catalog=None, account_numbers=None, limit=30, columnar=False,
+                            agencies=None, co_owners=None, snapshot=None):
+    """Trouver et interroger les tables recovery
+
+    agencies / co_owners : fragments d'agence et de nom des cas LEVEL 1 cherchés (défaut : ceux de l'incident).
+    limit=None : tous les cas LEVEL 1, en flux.
+    columnar=True : lecture en lots Arrow et filtrage / classification vectorisés.
+    snapshot : RecoverySnapshot, recherche par numéro de compte en local (lecture ligne à ligne).
+    """
     print("\n" + "="*60)
     print("📋 Structure complète de RECOVERY_CO")
     print("="*60)
 
-    cursor.execute("DESCRIBE TABLE DATAMART_ML_PROD.ACCOUNTING.RECOVERY_CO")
-    cols = cursor.fetchall()
+    cols = describe_table(conn, "DATAMART_ML_PROD", "ACCOUNTING", "RECOVERY_CO", catalog=catalog)
     for col in cols:
         print(f"  - {col[0]}: {col[1]}")
 
@@ -402,60 +2879,61 @@ def find_and_query_recovery(conn):
     print("🔍 Recherche des copropriétaires concernés")
     print("="*60)
 
-    customer_str = ",".join([f"'{c}'" for c in customer_ids])
-
-    # Noms des copropriétaires (approximatifs)
-    names = ["SANTOS", "DIASCORN", "MORIEUX", "HOARAU"]
-
     # Recherche directe par numéros de compte
-    account_numbers = [
-        "103144223",  # LUDOVIC SANTOS
-        "102732743",  # CORENTIN DIASCORN
-        "102740597",  # MICKAEL MORIEUX
-        "101785816",  # TOULOUSE
-        "103041737",  # MARSEILLE
-        "103046879",  # MARSEILLE
-        "103034606",  # MARSEILLE
-        "101291139",  # NICE
-    ]
-    numbers_str = ",".join([f"'{n}'" for n in account_numbers])
+    accounts = EXTERNAL_CODES if account_numbers is None else account_numbers
+    order_by = "CO_OWNER_ACCOUNT_NUMBER, DATE_PERIOD DESC"
+    if snapshot is None:
+        id_table = upload_id_set(conn, "ACCOUNTS", accounts)
+        print(f"\n  📊 Recherche directe par CO_OWNER_ACCOUNT_NUMBER:")
+        query = f"""
+            SELECT {", ".join(RECOVERY_COLUMNS)}
+            FROM DATAMART_ML_PROD.ACCOUNTING.RECOVERY_CO
+            WHERE CO_OWNER_ACCOUNT_NUMBER IN (SELECT ID FROM {id_table})
+        """
+    else:
+        print(f"\n  📊 Recherche directe par CO_OWNER_ACCOUNT_NUMBER (copie locale):")
 
-    print(f"\n  📊 Recherche directe par CO_OWNER_ACCOUNT_NUMBER:")
-    cursor.execute(f"""
-        SELECT
-            DATE_PERIOD,
-            AGENCY_NAME,
-            CO_OWNER_FULL_NAME,
-            CO_OWNER_ACCOUNT_NUMBER,
-            LEVEL,
-            RECOVERY_STATUS,
-            AUTOMATIC_REMINDER,
-            AMOUNT / 100.0 as AMOUNT_EUR,
-            CALCULATED_AMOUNT / 100.0 as CALCULATED_EUR,
-            RECOVERY_FILE_ID,
-            LAST_REMINDER_DATE
-        FROM DATAMART_ML_PROD.ACCOUNTING.RECOVERY_CO
-        WHERE CO_OWNER_ACCOUNT_NUMBER IN ({numbers_str})
-        ORDER BY CO_OWNER_ACCOUNT_NUMBER, DATE_PERIOD DESC
-    """)
-    results = cursor.fetchall()
-    print(f"  Trouvé {len(results)} lignes")
+    count = 0
+    if columnar and snapshot is None:
+        def batches():
+            nonlocal count
+            for batch in iter_arrow_batches(conn, f"{query}\nORDER BY {order_by}"):
+                count += batch.num_rows
+                yield batch
+        matches = classify_recovery_arrow(batches())
+    else:
+        def rows():
+            nonlocal count
+            if snapshot is None:
+                source = stream_query(conn, query, order_by)
+            else:
+                source = snapshot.lookup("CO_OWNER_ACCOUNT_NUMBER", accounts, RECOVERY_COLUMNS, order_by)
+            for row in source:
+                count += 1
+                yield row
+        matches = classify_recovery_rows(rows())
 
     # Filtrer uniquement les ONGOING_REMINDER
     print("\n  === ONGOING_REMINDER uniquement ===")
-    for row in results:
-        if row[5] == 'ONGOING_REMINDER':
-            level_status = "⚠️ BLOQUE" if row[4] == 1.0 else "✅ OK"
-            print(f"\n  {row[2]} ({row[3]}) - {row[1]}")
-            print(f"      Level: {row[4]} {level_status}")
-            print(f"      Amount: {row[7]}€, Calculated: {row[8]}€")
-            print(f"      Auto Reminder: {row[6]}")
-            print(f"      Recovery ID: {row[9]}")
-            print(f"      Last Reminder: {row[10]}")
+    for row, blocked, amount_eur, calculated_eur in matches:
+        level_status = "⚠️ BLOQUE" if blocked else "✅ OK"
+        print(f"\n  {row[2]} ({row[3]}) - {row[1]}")
+        print(f"      Level: {row[4]} {level_status}")
+        print(f"      Amount: {amount_eur}€, Calculated: {calculated_eur}€")
+        print(f"      Auto Reminder: {row[6]}")
+        print(f"      Recovery ID: {row[9]}")
+        print(f"      Last Reminder: {row[10]}")
+    print(f"\n  Trouvé {count} lignes")
 
     # Chercher les cas en Level 1 dans les agences concernées
-    print("\n  🔍 Cas en LEVEL 1 avec ONGOING_REMINDER dans agences Terre Occitane, Marseille, Nice, Toulouse:")
-    cursor.execute("""
+    agencies = LEVEL1_AGENCIES if agencies is None else agencies
+    co_owners = LEVEL1_CO_OWNERS if co_owners is None else co_owners
+    filters = [f"AGENCY_NAME ILIKE {_sql_literal(f'%{a}%')}" for a in agencies]
+    filters += [f"CO_OWNER_FULL_NAME ILIKE {_sql_literal(f'%{n}%')}" for n in co_owners]
+    predicate = "\n              OR ".join(filters) or "FALSE"
+    print(f"\n  🔍 Cas en LEVEL 1 avec ONGOING_REMINDER (agences : {', '.join(agencies) or '-'} ;"
+          f" copropriétaires : {', '.join(co_owners) or '-'}):")
+    rows = stream_query(conn, f"""
         SELECT
             DATE_PERIOD,
             AGENCY_NAME,
@@ -464,8 +2942,8 @@ def find_and_query_recovery(conn):
             LEVEL,
             RECOVERY_STATUS,
             AUTOMATIC_REMINDER,
-            AMOUNT / 100.0 as AMOUNT_EUR,
-            CALCULATED_AMOUNT / 100.0 as CALCULATED_EUR,
+            AMOUNT,
+            CALCULATED_AMOUNT,
             IS_EXCLUDED,
             EXCLUSION_REASON,
             RECOVERY_FILE_ID,
@@ -473,109 +2951,1236 @@ def find_and_query_recovery(conn):
         FROM DATAMART_ML_PROD.ACCOUNTING.RECOVERY_CO
         WHERE LEVEL = 1
           AND RECOVERY_STATUS = 'ONGOING_REMINDER'
-          AND (
-              AGENCY_NAME ILIKE '%TERRE OCCITANE%'
-              OR AGENCY_NAME ILIKE '%NARBONNE%'
-              OR CO_OWNER_FULL_NAME ILIKE '%SANTOS%'
-              OR CO_OWNER_FULL_NAME ILIKE '%DIASCORN%'
-              OR CO_OWNER_FULL_NAME ILIKE '%MORIEUX%'
-          )
-        ORDER BY AGENCY_NAME, CO_OWNER_FULL_NAME
-        LIMIT 30
-    """)
+          AND ({predicate})
+    """, "AGENCY_NAME, CO_OWNER_FULL_NAME", limit=limit)
 
-    rows = cursor.fetchall()
-    col_names = [desc[0] for desc in cursor.description]
-    print(f"\n  {len(rows)} lignes trouvées:")
+    count = 0
+    for r in records(rows, {"AMOUNT": "cents", "CALCULATED_AMOUNT": "cents"}, name="RecoveryLevel1"):
+        count += 1
+        print(f"\n  === {r.CO_OWNER_FULL_NAME or 'N/A'} ({r.CO_OWNER_ACCOUNT_NUMBER}) ===")
+        print(f"      Agence: {r.AGENCY_NAME}")
+        print(f"      Level: {r.LEVEL}")
+        print(f"      Status: {r.RECOVERY_STATUS}")
+        print(f"      Auto Reminder: {r.AUTOMATIC_REMINDER}")
+        print(f"      Amount: {r.AMOUNT}€")
+        print(f"      Calculated: {r.CALCULATED_AMOUNT}€")
+        print(f"      Is Excluded: {r.IS_EXCLUDED}")
+        print(f"      Exclusion: {r.EXCLUSION_REASON}")
+        print(f"      Last Reminder: {r.LAST_REMINDER_DATE}")
+        print(f"      Recovery ID: {r.RECOVERY_FILE_ID}")
+    print(f"\n  {count} lignes trouvées")
 
-    for row in rows:
-        data = dict(zip(col_names, row))
-        print(f"\n  === {data.get('CO_OWNER_FULL_NAME', 'N/A')} ({data.get('CO_OWNER_ACCOUNT_NUMBER')}) ===")
-        print(f"      Agence: {data.get('AGENCY_NAME')}")
-        print(f"      Level: {data.get('LEVEL')}")
-        print(f"      Status: {data.get('RECOVERY_STATUS')}")
-        print(f"      Auto Reminder: {data.get('AUTOMATIC_REMINDER')}")
-        print(f"      Amount: {data.get('AMOUNT_EUR', data.get('AMOUNT'))}€")
-        print(f"      Calculated: {data.get('CALCULATED_EUR', data.get('CALCULATED_AMOUNT'))}€")
-        print(f"      Is Excluded: {data.get('IS_EXCLUDED')}")
-        print(f"      Exclusion: {data.get('EXCLUSION_REASON')}")
-        print(f"      Last Reminder: {data.get('LAST_REMINDER_DATE')}")
-        print(f"      Recovery ID: {data.get('RECOVERY_FILE_ID')}")
-
-def check_events_history(conn):
-    """Vérifier l'historique des événements pour les dossiers bloqués"""
-    cursor = conn.cursor()
+# Colonnes du rapport de dossiers bloqués (classé)
+STUCK_REPORT_COLUMNS = [
+    "RANK", "AGENCY_NAME", "CO_OWNER_FULL_NAME", "CO_OWNER_ACCOUNT_NUMBER", "RECOVERY_FILE_ID",
+    "STUCK_SINCE", "LAST_PERIOD", "PERIODS_STUCK", "REMINDERS", "LAST_REMINDER_DATE", "AMOUNT_EUR",
+]
+
+def _stuck_files_query(level):
+    """Dernière série continue de périodes au niveau `level` en ONGOING_REMINDER, par dossier
+
+    La somme glissante des « ruptures » (par DATE_PERIOD décroissante) vaut 0 tant
+    que le dossier est resté bloqué depuis la période la plus récente ; REMINDERS
+    compte les relances distinctes pendant cette série.
+    """
+    return f"""
+        SELECT
+            RECOVERY_FILE_ID,
+            MAX(CO_OWNER_ACCOUNT_NUMBER) AS CO_OWNER_ACCOUNT_NUMBER,
+            MAX(CO_OWNER_FULL_NAME) AS CO_OWNER_FULL_NAME,
+            MIN(DATE_PERIOD) AS STUCK_SINCE,
+            MAX(DATE_PERIOD) AS LAST_PERIOD,
+            COUNT(*) AS PERIODS_STUCK,
+            COUNT(DISTINCT LAST_REMINDER_DATE) AS REMINDERS,
+            MAX(LAST_REMINDER_DATE) AS LAST_REMINDER_DATE,
+            MAX(AMOUNT) / 100.0 AS AMOUNT_EUR
+        FROM (
+            SELECT
+                RECOVERY_FILE_ID, CO_OWNER_ACCOUNT_NUMBER, CO_OWNER_FULL_NAME, DATE_PERIOD,
+                LAST_REMINDER_DATE, AMOUNT,
+                SUM(CASE WHEN LEVEL = {level} AND RECOVERY_STATUS = 'ONGOING_REMINDER' THEN 0 ELSE 1 END) OVER (
+                    PARTITION BY RECOVERY_FILE_ID ORDER BY DATE_PERIOD DESC
+                    ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+                ) AS BREAKS
+            FROM DATAMART_ML_PROD.ACCOUNTING.RECOVERY_CO
+            WHERE AGENCY_NAME = %s
+        ) history
+        WHERE BREAKS = 0
+        GROUP BY RECOVERY_FILE_ID
+        HAVING COUNT(*) >= %s AND COUNT(DISTINCT LAST_REMINDER_DATE) >= %s
+    """
+
+def detect_stuck_files(conn, agencies=None, level=1, min_periods=2, min_reminders=2, top=50,
+                       max_workers=STUCK_DETECTOR_MAX_WORKERS, output=None):
+    """Dossiers bloqués au niveau `level` sur tout l'historique RECOVERY_CO, toutes agences
 
-    # Recovery file IDs des cas bloqués
-    recovery_ids = [
-        "68dc86391b778399d9e3ce46",  # JANINE ACCOT (NICE)
-        "68dca1e11b778399d9f9e42a",  # CORENTIN DIASCORN
-        "66ff32ac610e3077e4ec17fe",  # MORIEUX/HOARAU
-        "66ff4bd0610e3077e4edc7ba",  # MAURICE ALAYRAC (MARSEILLE)
-        "68ddfc5cde50e17d0c77da4d",  # LAURENT BONIER (MARSEILLE)
-        "67ee0e285d2af9484b88f22b",  # BRUNO SEGUIN (MARSEILLE)
-        "68de10ac4242e9fd5dd19f01",  # LUDOVIC SANTOS
-        "68dcbf4d1b778399d912fb75",  # LE PARC DES SEPT DENIERS (OK - passé N2)
+    Un dossier est bloqué si ses `min_periods` dernières périodes au moins sont
+    au même niveau en ONGOING_REMINDER alors que LAST_REMINDER_DATE a avancé
+    (`min_reminders` relances distinctes). Une requête par agence, en parallèle ;
+    rapport classé par nombre de périodes bloquées, relances puis montant.
+    """
+    print("\n" + "="*60)
+    print(f"🔍 Dossiers bloqués en N{level} / ONGOING_REMINDER (toutes agences)")
+    print("="*60)
+
+    if agencies is None:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT DISTINCT AGENCY_NAME
+            FROM DATAMART_ML_PROD.ACCOUNTING.RECOVERY_CO
+            WHERE AGENCY_NAME IS NOT NULL
+        """)
+        agencies = sorted(row[0] for row in cursor.fetchall())
+
+    query = _stuck_files_query(int(level))
+
+    def run(agency):
+        cursor = conn.cursor()
+        try:
+            cursor.execute(query, (agency, min_periods, min_reminders))
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    stuck = []
+    errors = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(agencies) or 1))) as pool:
+        futures = {pool.submit(run, agency): agency for agency in agencies}
+        for future in as_completed(futures):
+            agency = futures[future]
+            try:
+                rows = future.result()
+            except Exception as e:
+                errors[agency] = e
+                continue
+            stuck += [(agency,) + tuple(row) for row in rows]
+
+    # (agence, id, compte, nom, depuis, dernière période, périodes, relances, dernière relance, montant)
+    stuck.sort(key=lambda r: (-r[6], -r[7], -(r[9] or 0), r[0], r[3] or ""))
+    report = [
+        (rank, agency, name, account, file_id, since, last, periods, reminders, last_reminder, amount)
+        for rank, (agency, file_id, account, name, since, last, periods, reminders, last_reminder, amount)
+        in enumerate(stuck, 1)
     ]
 
+    for agency, error in sorted(errors.items()):
+        print(f"  {agency} - Erreur: {error}")
+    by_agency = Counter(r[1] for r in report)
+    print(f"\n  {len(report)} dossiers bloqués dans {len(by_agency)}/{len(agencies)} agences")
+    for agency, count in by_agency.most_common():
+        print(f"    - {agency}: {count}")
+
+    if output is not None:
+        count = export_rows(RowStream([(c,) for c in STUCK_REPORT_COLUMNS], iter(report)), open_sink(output))
+        print(f"\n  📄 {count} dossiers écrits dans {output}")
+        return report
+
+    for rank, agency, name, account, file_id, since, last, periods, reminders, last_reminder, amount in report[:top]:
+        print(f"\n  #{rank} {name} ({account}) - {agency}")
+        print(f"      Recovery ID: {file_id}")
+        print(f"      Bloqué depuis {since} ({periods} périodes, jusqu'à {last})")
+        print(f"      Relances: {reminders}, dernière le {last_reminder}")
+        print(f"      Amount: {amount}€")
+    if len(report) > top:
+        print(f"\n  ... et {len(report) - top} autres dossiers")
+    return report
+
+def _json_loads():
+    """Parseur JSON le plus rapide disponible (orjson si installé)"""
+    try:
+        import orjson
+        return orjson.loads
+    except ImportError:
+        return json.loads
+
+def _event_date(value):
+    """Date d'événement en texte ISO (gère le format étendu MongoDB {"$date": ...})"""
+    if isinstance(value, dict):
+        value = value.get("$date")
+    return None if value is None else str(value)
+
+def _event_level(value):
+    try:
+        return None if value is None else float(value)
+    except (TypeError, ValueError):
+        return None
+
+def parse_events(raw, loads=None):
+    """Parse une valeur EVENEMENTS (VARIANT texte ou liste) en [{type, date, level, payload}]"""
+    if not raw:
+        return []
+    events = (loads or _json_loads())(raw) if isinstance(raw, (str, bytes)) else raw
+    if isinstance(events, dict):
+        events = [events]
+    parsed = []
+    for event in events:
+        if not isinstance(event, dict):
+            continue
+        parsed.append({
+            "type": event.get(EVENT_FIELDS["type"]),
+            "date": _event_date(event.get(EVENT_FIELDS["date"])),
+            "level": _event_level(event.get(EVENT_FIELDS["level"])),
+            "payload": event,
+        })
+    return parsed
+
+class EventTimeline:
+    """Chronologie locale (SQLite indexée) des événements EVENEMENTS par RECOVERY_FILE_ID
+
+    Chaque événement porte le niveau avant / après (level_before / level) pour
+    répondre aux questions de transition sans relire les blobs.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(CACHE_DIR, "timeline.sqlite")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._db = sqlite3.connect(self.path)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS events (
+                recovery_file_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                event_type TEXT,
+                event_date TEXT,
+                level REAL,
+                level_before REAL,
+                payload TEXT,
+                PRIMARY KEY (recovery_file_id, seq)
+            );
+            CREATE INDEX IF NOT EXISTS idx_events_type_date ON events (event_type, event_date);
+            CREATE INDEX IF NOT EXISTS idx_events_file_date ON events (recovery_file_id, event_date);
+        """)
+
+    def replace_file_events(self, items):
+        """Remplace la chronologie des dossiers fournis : items = [(recovery_file_id, [événements])]"""
+        count = 0
+        with self._db:
+            for file_id, events in items:
+                self._db.execute("DELETE FROM events WHERE recovery_file_id = ?", (file_id,))
+                ordered = sorted(enumerate(events), key=lambda e: (e[1]["date"] is None, e[1]["date"] or "", e[0]))
+                level = None
+                rows = []
+                for seq, (_, event) in enumerate(ordered):
+                    level_before = level
+                    if event["level"] is not None:
+                        level = event["level"]
+                    payload = event.get("payload")
+                    rows.append((
+                        file_id, seq, event["type"], event["date"], level, level_before,
+                        None if payload is None else json.dumps(payload, default=str),
+                    ))
+                self._db.executemany("INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                count += len(rows)
+        return count
+
+    def events(self, recovery_file_id):
+        return self._db.execute(
+            "SELECT event_date, event_type, level_before, level FROM events"
+            " WHERE recovery_file_id = ? ORDER BY seq",
+            (recovery_file_id,),
+        ).fetchall()
+
+    def event_types(self):
+        """Types d'événements et nombre de dossiers concernés"""
+        return self._db.execute(
+            "SELECT event_type, COUNT(DISTINCT recovery_file_id) FROM events"
+            " GROUP BY event_type ORDER BY 2 DESC"
+        ).fetchall()
+
+    def files_stuck_after(self, event_type, level=1.0):
+        """Dossiers qui n'ont jamais dépassé `level` après un événement `event_type` (lui compris)"""
+        return [row[0] for row in self._db.execute("""
+            SELECT DISTINCT x.recovery_file_id
+            FROM events x
+            WHERE x.event_type = ?
+              AND x.event_date IS NOT NULL  -- sans date, impossible de situer la suite
+              AND NOT EXISTS (
+                  SELECT 1 FROM events y
+                  WHERE y.recovery_file_id = x.recovery_file_id
+                    AND y.event_date >= x.event_date
+                    AND y.level > ?
+              )
+            ORDER BY 1
+        """, (event_type, level))]
+
+    def close(self):
+        self._db.close()
+
+def _group_by_file(rows):
+    """Regroupe des lignes (recovery_file_id, événement ou None si aucun) triées par dossier"""
+    current, events = None, []
+    for file_id, event in rows:
+        if file_id != current and current is not None:
+            yield current, events
+            events = []
+        current = file_id
+        if event is not None:
+            events.append(event)
+    if current is not None:
+        yield current, events
+
+def build_event_timeline(conn, timeline, recovery_ids=None, server_side=True):
+    """Alimente la chronologie locale depuis la dernière photo RECOVERY_CO de chaque dossier
+
+    server_side=True : EVENEMENTS aplati dans le warehouse (LATERAL FLATTEN) ;
+    sinon parsing incrémental côté client (orjson si disponible).
+    recovery_ids=None : tous les dossiers.
+    """
+    where = "TRUE"
+    if recovery_ids is not None:
+        where = f"r.RECOVERY_FILE_ID IN (SELECT ID FROM {upload_id_set(conn, 'RECOVERY_FILES', recovery_ids)})"
+    # Une seule ligne par dossier, même si la dernière photo est dupliquée
+    latest = ("QUALIFY ROW_NUMBER() OVER (PARTITION BY r.RECOVERY_FILE_ID"
+              " ORDER BY r.DATE_PERIOD DESC, r.LAST_REMINDER_DATE DESC, r.CO_OWNER_ACCOUNT_NUMBER) = 1")
+
+    if server_side:
+        field = lambda name: f'e.value:"{EVENT_FIELDS[name]}"'
+        # OUTER : un dossier sans événement renvoie une ligne vide et sa chronologie est remplacée aussi
+        rows = stream_query(conn, f"""
+            SELECT
+                r.RECOVERY_FILE_ID,
+                {field("type")}::string AS EVENT_TYPE,
+                COALESCE({field("date")}:"$date"::string, {field("date")}::string) AS EVENT_DATE,
+                TRY_TO_DOUBLE({field("level")}::string) AS EVENT_LEVEL,
+                e.value AS PAYLOAD
+            FROM (
+                SELECT r.RECOVERY_FILE_ID, r.EVENEMENTS
+                FROM DATAMART_ML_PROD.ACCOUNTING.RECOVERY_CO r
+                WHERE {where}
+                {latest}
+            ) r,
+                LATERAL FLATTEN(input => TRY_PARSE_JSON(TO_VARCHAR(r.EVENEMENTS)), outer => TRUE) e
+        """, "r.RECOVERY_FILE_ID, e.INDEX")
+        loads = _json_loads()
+        events = (
+            (file_id, None if payload is None else {
+                "type": event_type,
+                "date": event_date,
+                "level": level,
+                "payload": loads(payload) if isinstance(payload, str) else payload,
+            })
+            for file_id, event_type, event_date, level, payload in rows
+        )
+        items = _group_by_file(events)
+    else:
+        rows = stream_query(conn, f"""
+            SELECT r.RECOVERY_FILE_ID, r.EVENEMENTS
+            FROM DATAMART_ML_PROD.ACCOUNTING.RECOVERY_CO r
+            WHERE {where}
+            {latest}
+        """, "r.RECOVERY_FILE_ID")
+        loads = _json_loads()
+        items = ((file_id, parse_events(raw, loads)) for file_id, raw in rows)
+
+    return timeline.replace_file_events(items)
+
+def check_events_history(conn, recovery_ids=None, snapshot=None):
+    """Vérifier l'historique des événements pour les dossiers bloqués
+
+    snapshot : RecoverySnapshot, recherche par recovery file ID en local.
+    """
     print("\n" + "="*60)
     print("📋 Historique des événements des recovery files")
     print("="*60)
 
-    ids_str = ",".join([f"'{r}'" for r in recovery_ids])
+    ids = RECOVERY_IDS if recovery_ids is None else recovery_ids
+    columns = [
+        "RECOVERY_FILE_ID",
+        "CO_OWNER_FULL_NAME",
+        "LEVEL",
+        "EVENEMENTS",
+        "FILE_CREATION_DATE",
+        "LAST_REMINDER_DATE",
+        "NEXT_REMINDER_DATE",
+        "REMINDER_ID",
+        "REMINDER_NAME",
+    ]
 
     # Récupérer les événements
-    cursor.execute(f"""
-        SELECT
-            RECOVERY_FILE_ID,
-            CO_OWNER_FULL_NAME,
-            LEVEL,
-            EVENEMENTS,
-            FILE_CREATION_DATE,
-            LAST_REMINDER_DATE,
-            NEXT_REMINDER_DATE,
-            REMINDER_ID,
-            REMINDER_NAME
+    if snapshot is not None:
+        results = snapshot.lookup("RECOVERY_FILE_ID", ids, columns, order_by="CO_OWNER_FULL_NAME")
+    else:
+        id_table = upload_id_set(conn, "RECOVERY_FILES", ids)
+        results = stream_query(conn, f"""
+            SELECT {", ".join(columns)}
+            FROM DATAMART_ML_PROD.ACCOUNTING.RECOVERY_CO
+            WHERE RECOVERY_FILE_ID IN (SELECT ID FROM {id_table})
+        """, "CO_OWNER_FULL_NAME")
+
+    converters = {
+        "EVENEMENTS": "events",
+        "FILE_CREATION_DATE": "datetime",
+        "LAST_REMINDER_DATE": "datetime",
+        "NEXT_REMINDER_DATE": "datetime",
+    }
+    for r in records(results, converters, name="RecoveryEvents"):
+        level_status = "✅ N2" if r.LEVEL == 2.0 else "⚠️ N1 BLOQUÉ"
+        print(f"\n=== {r.CO_OWNER_FULL_NAME} {level_status} ===")
+        print(f"    Recovery ID: {r.RECOVERY_FILE_ID}")
+        print(f"    Level: {r.LEVEL}")
+        print(f"    Created: {r.FILE_CREATION_DATE}")
+        print(f"    Last Reminder: {r.LAST_REMINDER_DATE}")
+        print(f"    Next Reminder: {r.NEXT_REMINDER_DATE}")
+        print(f"    Reminder ID: {r.REMINDER_ID}")
+        print(f"    Reminder Name: {r.REMINDER_NAME}")
+
+        # Événements (EVENEMENTS parsé à la construction du record)
+        if r.EVENEMENTS:
+            events = r.EVENEMENTS
+            print(f"    Événements: {len(events)}")
+            for event in events[-5:]:
+                print(f"      - {event['date']} {event['type']} (level {event['level']})")
+
+# Fraîcheur des sources : dernière donnée chargée et volume de chaque table interrogée
+# (FRESH : jamais servies par le cache de résultats en ligne)
+SOURCE_FRESHNESS_QUERIES = {
+    "RECOVERY_CO": f"SELECT MAX(DATE_PERIOD), COUNT(*) FROM DATAMART_ML_PROD.ACCOUNTING.RECOVERY_CO {FRESH}",
+    "RECOVERYFILES": f"SELECT MAX(UPDATEDAT), COUNT(*) FROM DATALAKE_ML_PROD.PLATO.RECOVERYFILES {FRESH}",
+    "LOGS_ML": f"SELECT MAX(TIMESTAMP), COUNT(*) FROM LOGS_ML {FRESH}",  # Adapter le nom de la table
+}
+
+async def check_source_freshness(conn):
+    """Dernière donnée chargée par source (requêtes soumises ensemble via execute_async)"""
+    results = await run_concurrent_async(conn, list(SOURCE_FRESHNESS_QUERIES.values()))
+    print("\n" + "="*60)
+    print("🕒 Fraîcheur des sources")
+    print("="*60)
+    for name, (rows, error) in zip(SOURCE_FRESHNESS_QUERIES, results):
+        if error is not None:
+            print(f"  - {name}: ❌ {error}")
+            continue
+        latest, count = rows[0]
+        print(f"  - {name}: dernière donnée {latest}, {count:,} lignes")
+    return results
+
+def investigate_overlapped(conn, catalog=None, date_start=INCIDENT_DATE_START, date_end=INCIDENT_DATE_END,
+                           account_numbers=None, recovery_ids=None, time_slice=None):
+    """Investigation complète, étapes indépendantes en parallèle
+
+    Erreurs de reminder, tables recovery, historique des événements et fraîcheur
+    des sources se chevauchent : la durée totale tend vers celle de l'étape la plus lente.
+    """
+    import asyncio
+
+    return asyncio.run(run_stages(conn, {
+        "reminder-errors": lambda c: search_reminder_errors(c, date_start, date_end, time_slice=time_slice),
+        "recovery": lambda c: find_and_query_recovery(c, catalog=catalog, account_numbers=account_numbers),
+        "events": lambda c: check_events_history(c, recovery_ids=recovery_ids),
+        "sources": check_source_freshness,
+    }))
+
+# Checks d'un incident : {nom: fonction(conn, spec, catalog)}
+INCIDENT_CHECKS = {
+    "recovery": lambda conn, spec, catalog: find_and_query_recovery(
+        conn, catalog=catalog, account_numbers=spec.account_numbers, agencies=spec.agencies,
+        co_owners=spec.co_owners,
+    ),
+    "events": lambda conn, spec, catalog: check_events_history(conn, recovery_ids=spec.recovery_ids),
+    "search-logs": lambda conn, spec, catalog: search_logs(
+        conn, spec.date_start, spec.date_end, customer_ids=spec.customer_ids, account_numbers=spec.account_numbers,
+    ),
+    "reminder-errors": lambda conn, spec, catalog: search_reminder_errors(conn, spec.date_start, spec.date_end),
+    "diagnose": lambda conn, spec, catalog: diagnose_co_owners(
+        conn, IdentityMap.from_constants(spec.customer_ids, spec.account_numbers, spec.recovery_ids),
+        spec.date_start, spec.date_end,
+    ),
+}
+
+class IncidentSpec:
+    """Incident à investiguer : identifiants, fenêtre de dates et checks à lancer
+
+    Champs absents = valeurs de PROD-28230 (constantes du module).
+    """
+    __slots__ = ("id", "title", "customer_ids", "account_numbers", "recovery_ids", "date_start", "date_end",
+                 "agencies", "co_owners", "checks")
+
+    def __init__(self, id=INCIDENT_ID, title=INCIDENT_TITLE, customer_ids=None, account_numbers=None,
+                 recovery_ids=None, date_start=INCIDENT_DATE_START, date_end=INCIDENT_DATE_END, agencies=None,
+                 co_owners=None, checks=None):
+        self.id = str(id)
+        self.title = title
+        self.customer_ids = list(CUSTOMER_IDS if customer_ids is None else customer_ids)
+        self.account_numbers = list(EXTERNAL_CODES if account_numbers is None else account_numbers)
+        self.recovery_ids = list(RECOVERY_IDS if recovery_ids is None else recovery_ids)
+        self.date_start = date.fromisoformat(str(date_start)).isoformat()
+        self.date_end = date.fromisoformat(str(date_end)).isoformat()
+        self.agencies = list(LEVEL1_AGENCIES if agencies is None else agencies)
+        self.co_owners = list(LEVEL1_CO_OWNERS if co_owners is None else co_owners)
+        self.checks = list(INCIDENT_DEFAULT_CHECKS if checks is None else checks)
+        unknown = [c for c in self.checks if c not in INCIDENT_CHECKS]
+        if unknown:
+            raise ValueError(f"checks inconnus {unknown} (disponibles : {', '.join(INCIDENT_CHECKS)})")
+
+    @classmethod
+    def from_dict(cls, data):
+        unknown = set(data) - set(cls.__slots__)
+        if unknown:
+            raise ValueError(f"champs inconnus {sorted(unknown)} (attendus : {', '.join(cls.__slots__)})")
+        return cls(**data)
+
+    @classmethod
+    def load(cls, path):
+        """Specs d'un fichier JSON : un objet (un incident) ou une liste d'objets"""
+        with open(path) as f:
+            data = json.load(f)
+        return [cls.from_dict(d) for d in (data if isinstance(data, list) else [data])]
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+def _run_incident(spec, conn, catalog):
+    """Checks d'un incident l'un après l'autre ; un check en échec n'empêche pas les suivants"""
+    checks = []
+    for name in spec.checks:
+        started = time.perf_counter()
+        error = None
+        try:
+            INCIDENT_CHECKS[name](conn, spec, catalog)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            print(f"\n❌ Check {name} : {error}")
+        checks.append({"name": name, "seconds": round(time.perf_counter() - started, 3), "error": error})
+    return checks
+
+def run_incidents(specs, cache=None, connect_fn=None, offline=False, catalog=None,
+                  max_workers=INCIDENT_MAX_WORKERS, report_dir=None):
+    """Investigue plusieurs incidents en parallèle sur un pool de sessions et un cache de résultats partagés
+
+    Chaque incident prend une session du pool à son premier résultat absent du cache
+    et la rend à la fin. Une lecture identique lancée par plusieurs incidents n'est
+    envoyée qu'une fois (single-flight du ResultCache). Rapport par incident dans
+    `report_dir` : <id>.txt (sortie console) et <id>.json (checks, durées, cache).
+    """
+    ids = [spec.id for spec in specs]
+    duplicates = sorted({i for i in ids if ids.count(i) > 1})
+    if duplicates:
+        raise ValueError(f"IDs d'incident en double : {duplicates}")
+    cache = cache or ResultCache()
+    report_dir = report_dir or os.path.join(CACHE_DIR, "reports")
+    os.makedirs(report_dir, exist_ok=True)
+    max_workers = max(1, min(max_workers, len(specs)))
+    pool = None if offline else SessionPool(connect_fn, size=max_workers)
+    output = StageOutput(sys.stdout)
+
+    def investigate(spec):
+        started = time.perf_counter()
+        buffer = io.StringIO()
+        output.buffers[threading.get_ident()] = buffer
+        conn = CachedConnection(None, cache, offline=offline, connect_fn=None if offline else pool.acquire)
+        try:
+            print("=" * 60)
+            print(f"{spec.id} - {spec.title} ({spec.date_start} → {spec.date_end})")
+            print("=" * 60)
+            checks = _run_incident(spec, conn, catalog)
+        finally:
+            del output.buffers[threading.get_ident()]
+            if conn.conn is not None:
+                is_closed = getattr(conn.conn, "is_closed", None)
+                pool.release(conn.conn, discard=bool(is_closed and is_closed()))
+        report = {
+            "incident": spec.to_dict(),
+            "seconds": round(time.perf_counter() - started, 3),
+            "checks": checks,
+            "cache": dict(conn.stats),
+        }
+        name = re.sub(r"[^\w.-]", "_", spec.id)
+        with open(os.path.join(report_dir, f"{name}.txt"), "w") as f:
+            f.write(buffer.getvalue())
+        with open(os.path.join(report_dir, f"{name}.json"), "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        return buffer.getvalue(), report
+
+    reports = {}
+    started = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(output), ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(investigate, spec) for spec in specs]
+            for future in as_completed(futures):
+                text, report = future.result()
+                spec = report["incident"]
+                failed = [c["name"] for c in report["checks"] if c["error"]]
+                stats = report["cache"]
+                output.stream.write(text)
+                print(f"\n⏱️  Incident {spec['id']} : {report['seconds']:.2f}s"
+                      f" {'❌ ' + ', '.join(failed) if failed else '✅'}"
+                      f" (cache : {stats.get('hits', 0)} servies, {stats.get('shared', 0)} partagées,"
+                      f" {stats.get('misses', 0)} envoyées)\n")
+                reports[spec["id"]] = report
+    finally:
+        if pool is not None:
+            pool.close()
+
+    totals = Counter()
+    for report in reports.values():
+        totals.update(report["cache"])
+    print(f"⏱️  {len(reports)} incidents en {time.perf_counter() - started:.2f}s"
+          f" ({pool.created if pool else 0} sessions ouvertes, {totals['misses']} requêtes envoyées,"
+          f" {totals['hits'] + totals['shared']} servies par le cache partagé)")
+    print(f"  📄 Rapports : {report_dir}")
+    return reports
+
+def _encode_mark(value):
+    """Watermark en texte typé (le type conditionne le littéral SQL rejoué)"""
+    if isinstance(value, datetime):
+        return f"datetime:{value.isoformat()}"
+    if isinstance(value, date):
+        return f"date:{value.isoformat()}"
+    return f"str:{value}"
+
+def _decode_mark(text):
+    kind, _, value = text.partition(":")
+    if kind == "datetime":
+        return datetime.fromisoformat(value)
+    if kind == "date":
+        return date.fromisoformat(value)
+    return value
+
+def _iso(value):
+    return None if value is None else str(value)
+
+class MonitorState:
+    """État local de la surveillance incrémentale (SQLite)
+
+    watermarks : dernière valeur vue par requête surveillée ;
+    files : dernier état connu de chaque dossier (photo RECOVERY_CO + niveau live RECOVERYFILES).
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(CACHE_DIR, "monitor.sqlite")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._db = sqlite3.connect(self.path)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS watermarks (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                recovery_file_id TEXT PRIMARY KEY,
+                co_owner_full_name TEXT,
+                agency_name TEXT,
+                level REAL,
+                recovery_status TEXT,
+                date_period TEXT,
+                last_reminder_date TEXT,
+                live_level REAL,
+                live_updated_at TEXT,
+                changed_at REAL
+            );
+        """)
+
+    def watermark(self, key):
+        row = self._db.execute("SELECT value FROM watermarks WHERE key = ?", (key,)).fetchone()
+        return None if row is None else _decode_mark(row[0])
+
+    def delta(self, conn, name, query, column, initial=None, inclusive=False):
+        """Lignes de `query` au-delà du watermark de `column`, par ordre croissant
+
+        `query` contient le marqueur WATERMARK dans son WHERE. Retourne
+        (colonnes, lignes, commit) : commit() enregistre le nouveau watermark,
+        à appeler une fois les lignes intégrées à l'état local.
+        inclusive=True relit la dernière valeur (partition encore alimentée).
+        """
+        key = f"{name}:{hashlib.sha1(normalize_sql(query).encode()).hexdigest()[:12]}"
+        mark = self.watermark(key)
+        if mark is None:
+            mark = initial
+        predicate = "TRUE"
+        if mark is not None:
+            predicate = f"{column} {'>=' if inclusive else '>'} {_sql_literal(mark)}"
+
+        stream = stream_query(conn, query.replace(WATERMARK, predicate), order_by=column)
+        rows = list(stream)
+        columns = stream.columns
+        index = columns.index(column.split(".")[-1])
+        new_mark = max((row[index] for row in rows if row[index] is not None), default=mark)
+
+        def commit():
+            if new_mark is not None:
+                with self._db:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?)",
+                        (key, _encode_mark(new_mark), time.time()),
+                    )
+
+        return columns, rows, commit
+
+    def merge_snapshots(self, rows):
+        """Intègre des photos RECOVERY_CO (DATE_PERIOD, ID, nom, agence, level, statut, dernière relance)
+
+        Retourne les transitions par rapport à l'état d'avant le passage
+        [(recovery_file_id, nom, ancien level, nouveau level, ancien statut, nouveau statut)] ;
+        le premier chargement d'un dossier n'en produit pas.
+        """
+        before = {}
+        now = time.time()
+        with self._db:
+            for period, file_id, name, agency, level, status, last_reminder in rows:
+                period = _iso(period)
+                previous = self._db.execute(
+                    "SELECT level, recovery_status, date_period FROM files WHERE recovery_file_id = ?", (file_id,)
+                ).fetchone()
+                if previous is not None and previous[2] is not None and previous[2] > period:
+                    continue
+                if file_id not in before:
+                    before[file_id] = None if previous is None or previous[2] is None else previous[:2]
+                changed = before[file_id] is not None and before[file_id] != (level, status)
+                self._db.execute("""
+                    INSERT INTO files (recovery_file_id, co_owner_full_name, agency_name, level,
+                                       recovery_status, date_period, last_reminder_date, changed_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (recovery_file_id) DO UPDATE SET
+                        co_owner_full_name = excluded.co_owner_full_name,
+                        agency_name = excluded.agency_name,
+                        level = excluded.level,
+                        recovery_status = excluded.recovery_status,
+                        date_period = excluded.date_period,
+                        last_reminder_date = excluded.last_reminder_date,
+                        changed_at = CASE WHEN ? THEN excluded.changed_at ELSE files.changed_at END
+                """, (file_id, name, agency, level, status, period, _iso(last_reminder), now, changed))
+
+        transitions = []
+        for file_id, previous in before.items():
+            if previous is None:
+                continue
+            name, level, status = self._db.execute(
+                "SELECT co_owner_full_name, level, recovery_status FROM files WHERE recovery_file_id = ?", (file_id,)
+            ).fetchone()
+            if previous != (level, status):
+                transitions.append((file_id, name, previous[0], level, previous[1], status))
+        return transitions
+
+    def merge_live_levels(self, rows):
+        """Intègre les niveaux live RECOVERYFILES (UPDATEDAT, _ID, LEVEL) ; retourne [(ID, ancien, nouveau)]"""
+        transitions = []
+        with self._db:
+            for updated_at, file_id, level in rows:
+                previous = self._db.execute(
+                    "SELECT live_level FROM files WHERE recovery_file_id = ?", (file_id,)
+                ).fetchone()
+                if previous is not None and previous[0] is not None and previous[0] != level:
+                    transitions.append((file_id, previous[0], level))
+                self._db.execute("""
+                    INSERT INTO files (recovery_file_id, live_level, live_updated_at) VALUES (?, ?, ?)
+                    ON CONFLICT (recovery_file_id) DO UPDATE SET
+                        live_level = excluded.live_level, live_updated_at = excluded.live_updated_at
+                """, (file_id, level, _iso(updated_at)))
+        return transitions
+
+    def stuck_files(self, level=1.0):
+        """Dossiers ONGOING_REMINDER encore au niveau `level` (niveau live s'il est plus récent que la photo)"""
+        return self._db.execute("""
+            SELECT recovery_file_id, co_owner_full_name, agency_name, current_level,
+                   date_period, last_reminder_date
+            FROM (
+                SELECT *, CASE WHEN live_updated_at >= date_period THEN live_level ELSE level END AS current_level
+                FROM files
+            )
+            WHERE recovery_status = 'ONGOING_REMINDER' AND current_level = ?
+            ORDER BY co_owner_full_name
+        """, (level,)).fetchall()
+
+    def close(self):
+        self._db.close()
+
+def monitor_stuck_files(conn, state, recovery_ids=None):
+    """Passe de surveillance incrémentale des dossiers bloqués en N1
+
+    Ne lit que le delta depuis le dernier passage : photos RECOVERY_CO (DATE_PERIOD,
+    dernière période relue), niveaux live RECOVERYFILES (UPDATEDAT) et erreurs
+    de relance LOGS_ML (TIMESTAMP, premier passage limité à MONITOR_LOG_LOOKBACK).
+    """
+    print(f"\n🔁 Surveillance incrémentale ({datetime.now():%Y-%m-%d %H:%M:%S})")
+    id_table = upload_id_set(conn, "RECOVERY_FILES", RECOVERY_IDS if recovery_ids is None else recovery_ids)
+
+    _, snapshots, commit_snapshots = state.delta(conn, "recovery_co", f"""
+        SELECT DATE_PERIOD, RECOVERY_FILE_ID, CO_OWNER_FULL_NAME, AGENCY_NAME, LEVEL,
+               RECOVERY_STATUS, LAST_REMINDER_DATE
         FROM DATAMART_ML_PROD.ACCOUNTING.RECOVERY_CO
-        WHERE RECOVERY_FILE_ID IN ({ids_str})
-        ORDER BY CO_OWNER_FULL_NAME
-    """)
-
-    results = cursor.fetchall()
-    col_names = [desc[0] for desc in cursor.description]
-
-    for row in results:
-        data = dict(zip(col_names, row))
-        level_status = "✅ N2" if data['LEVEL'] == 2.0 else "⚠️ N1 BLOQUÉ"
-        print(f"\n=== {data['CO_OWNER_FULL_NAME']} {level_status} ===")
-        print(f"    Recovery ID: {data['RECOVERY_FILE_ID']}")
-        print(f"    Level: {data['LEVEL']}")
-        print(f"    Created: {data['FILE_CREATION_DATE']}")
-        print(f"    Last Reminder: {data['LAST_REMINDER_DATE']}")
-        print(f"    Next Reminder: {data['NEXT_REMINDER_DATE']}")
-        print(f"    Reminder ID: {data['REMINDER_ID']}")
-        print(f"    Reminder Name: {data['REMINDER_NAME']}")
-
-        # Parser les événements
-        if data['EVENEMENTS']:
-            events = data['EVENEMENTS']
-            print(f"    Événements: {type(events)} - {str(events)[:500]}...")
-
-def main():
+        WHERE RECOVERY_FILE_ID IN (SELECT ID FROM {id_table})
+          AND {WATERMARK}
+    """, "DATE_PERIOD", inclusive=True)
+    transitions = state.merge_snapshots(snapshots)
+    commit_snapshots()
+
+    _, live, commit_live = state.delta(conn, "recoveryfiles", f"""
+        SELECT UPDATEDAT, _ID, LEVEL
+        FROM DATALAKE_ML_PROD.PLATO.RECOVERYFILES
+        WHERE _ID IN (SELECT ID FROM {id_table})
+          AND {WATERMARK}
+    """, "UPDATEDAT")
+    live_transitions = state.merge_live_levels(live)
+    commit_live()
+
+    _, errors, commit_logs = state.delta(conn, "reminder_errors", f"""
+        SELECT TIMESTAMP, LOG_LEVEL, MESSAGE
+        FROM LOGS_ML
+        WHERE SERVICE LIKE '%litigation%'
+          AND LOG_LEVEL IN ('ERROR', 'WARN')
+          AND (
+            MESSAGE LIKE '%NOTHING_SENT%'
+            OR MESSAGE LIKE '%cannotSendReminderReason%'
+            OR MESSAGE LIKE '%LEVEL_MISMATCHED%'
+          )
+          AND {WATERMARK}
+    """, "TIMESTAMP", initial=datetime.now() - MONITOR_LOG_LOOKBACK)
+    commit_logs()
+
+    print(f"  Δ {len(snapshots)} photos RECOVERY_CO, {len(live)} mises à jour RECOVERYFILES, "
+          f"{len(errors)} erreurs de relance")
+    for file_id, name, old_level, new_level, old_status, new_status in transitions:
+        print(f"  🔀 {name} ({file_id}) : N{old_level} {old_status} → N{new_level} {new_status}")
+    for file_id, old_level, new_level in live_transitions:
+        print(f"  🔀 {file_id} (live) : N{old_level} → N{new_level}")
+    for timestamp, log_level, message in errors[-5:]:
+        print(f"  [{timestamp}] {log_level} | {message[:200]}")
+
+    stuck = state.stuck_files()
+    print(f"  ⚠️  {len(stuck)} dossiers toujours en N1 / ONGOING_REMINDER")
+    for file_id, name, _, _, period, last_reminder in stuck:
+        print(f"    - {name} ({file_id}) période {period}, dernière relance {last_reminder}")
+
+    return {
+        "snapshots": len(snapshots),
+        "live_updates": len(live),
+        "errors": len(errors),
+        "transitions": transitions + live_transitions,
+        "stuck": len(stuck),
+    }
+
+def watch_stuck_files(sessions, state, interval=MONITOR_INTERVAL, recovery_ids=None, iterations=None):
+    """Relance monitor_stuck_files toutes les `interval` secondes (Ctrl+C pour arrêter)
+
+    `sessions` est un SessionPool : entre deux passages la session y est gardée chaude
+    (keep-alive) et remplacée si elle est tombée.
+    """
+    count = 0
+    try:
+        while iterations is None or count < iterations:
+            with sessions.connection() as conn:
+                monitor_stuck_files(conn, state, recovery_ids=recovery_ids)
+            count += 1
+            if iterations is None or count < iterations:
+                time.sleep(interval)
+    except KeyboardInterrupt:
+        print("\n⏹️  Surveillance arrêtée")
+    return count
+
+def _id_list(value):
+    """Argument d'IDs : liste séparée par des virgules, ou @fichier (un ID par ligne)"""
+    if value.startswith("@"):
+        with open(value[1:]) as f:
+            return [line.strip() for line in f if line.strip()]
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+def _date_arg(value):
+    """Argument de date AAAA-MM-JJ (validé, transmis tel quel aux requêtes)"""
+    try:
+        date.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"date invalide (AAAA-MM-JJ attendu) : {value}")
+    return value
+
+def _size_arg(value):
+    """Argument de taille en octets : 500M, 10G, 1T ou nombre brut"""
+    units = {"K": 10**3, "M": 10**6, "G": 10**9, "T": 10**12}
+    try:
+        if value[-1:].upper() in units:
+            return int(float(value[:-1]) * units[value[-1].upper()])
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"taille invalide (ex. 500M, 10G) : {value}")
+
+def _spec_arg(value):
+    """Argument de spec d'incident : fichier JSON (objet ou liste d'objets IncidentSpec)"""
+    try:
+        return IncidentSpec.load(value)
+    except (OSError, ValueError, TypeError) as e:
+        raise argparse.ArgumentTypeError(f"spec d'incident invalide {value} : {e}")
+
+def _catalog_target_arg(value):
+    """Argument DATABASE[.SCHEMA[.TABLE]] d'invalidation du catalogue"""
+    parts = value.upper().split(".")
+    if len(parts) > 3 or not all(parts):
+        raise argparse.ArgumentTypeError(f"attendu DATABASE[.SCHEMA[.TABLE]] : {value}")
+    return parts
+
+def _table_arg(value):
+    """Argument de table entièrement qualifiée DATABASE.SCHEMA.TABLE"""
+    parts = value.upper().split(".")
+    if len(parts) != 3 or not all(parts):
+        raise argparse.ArgumentTypeError(f"table attendue sous la forme DATABASE.SCHEMA.TABLE : {value}")
+    return parts
+
+@contextlib.contextmanager
+def _snapshot_option(args):
+    """RecoverySnapshot de l'option --snapshot (None sans l'option), fermée en sortie"""
+    if not args.snapshot:
+        yield None
+        return
+    snapshot = RecoverySnapshot()
+    try:
+        yield snapshot
+    finally:
+        snapshot.close()
+
+def _investigate(conn, catalog, args):
+    with _snapshot_option(args) as snapshot:
+        # Trouver et interroger les tables recovery
+        find_and_query_recovery(conn, catalog=catalog, account_numbers=args.accounts, limit=args.limit,
+                                columnar=args.columnar, snapshot=snapshot)
+
+        # Vérifier l'historique des événements
+        check_events_history(conn, recovery_ids=args.recovery_ids, snapshot=snapshot)
+
+def _recovery(conn, catalog, args):
+    with _snapshot_option(args) as snapshot:
+        find_and_query_recovery(conn, catalog=catalog, account_numbers=args.accounts, limit=args.limit,
+                                columnar=args.columnar, snapshot=snapshot)
+
+def _events(conn, catalog, args):
+    with _snapshot_option(args) as snapshot:
+        check_events_history(conn, recovery_ids=args.recovery_ids, snapshot=snapshot)
+
+def _snapshot(conn, catalog, args):
+    snapshot = RecoverySnapshot()
+    try:
+        if not args.offline:
+            print(f"⬇️  Mise à jour de la copie locale de RECOVERY_CO ({snapshot.path})...")
+            started = time.perf_counter()
+            pulled = snapshot.refresh(conn, catalog=catalog, full=args.full)
+            for period, count in pulled.items():
+                print(f"  - {period} : {count:,} lignes")
+            print(f"  {len(pulled)} partitions téléchargées en {time.perf_counter() - started:.1f}s")
+        partitions, rows, fetched_at = snapshot.summary()
+        print(f"📦 Copie locale : {partitions} partitions, {rows:,} lignes"
+              + (f" (mise à jour {datetime.fromtimestamp(fetched_at):%Y-%m-%d %H:%M})" if fetched_at else ""))
+
+        lookups = [
+            ("CO_OWNER_ACCOUNT_NUMBER", args.accounts),
+            ("RECOVERY_FILE_ID", args.recovery_ids),
+            ("AGENCY_NAME", args.agencies),
+        ]
+        started = time.perf_counter()
+        for column, values in lookups:
+            if values:
+                found = snapshot.lookup(column, values, order_by=f"{column}, DATE_PERIOD DESC")
+                break
+        else:
+            if not args.between:
+                return
+            column, low, high = args.between
+            found = snapshot.between(column, low or None, high or None, order_by=f"{column}, DATE_PERIOD DESC")
+        found = RowStream(found.description, iter(list(found)))
+        elapsed = time.perf_counter() - started
+        count = export_rows(found, open_sink(args.output))
+        print(f"\n🔎 {count} lignes en {elapsed * 1000:.2f} ms (copie locale, sans warehouse)")
+    finally:
+        snapshot.close()
+
+def _batch(conn, catalog, args):
+    specs = [spec for specs in args.specs for spec in specs] or [IncidentSpec()]
+    # Pool et cache partagés : connexion et ResultCache de la CachedConnection construite par main
+    run_incidents(specs, conn.cache, connect_fn=conn.connect_fn, offline=conn.offline, catalog=catalog,
+                  max_workers=args.workers, report_dir=args.report_dir)
+
+def _timeline(conn, catalog, args):
+    timeline = EventTimeline()
+    try:
+        if not args.no_build:
+            recovery_ids = None if args.all_files else args.recovery_ids
+            if recovery_ids is None and not args.all_files:
+                recovery_ids = RECOVERY_IDS
+            count = build_event_timeline(conn, timeline, recovery_ids, server_side=not args.client_side)
+            print(f"📅 {count} événements chargés dans la chronologie locale ({timeline.path})")
+
+        if args.stuck_after is None:
+            print("\n=== Types d'événements (dossiers concernés) ===")
+            for event_type, files in timeline.event_types():
+                print(f"  {str(event_type):<30} {files:>8}")
+            return
+
+        stuck = timeline.files_stuck_after(args.stuck_after, args.level)
+        print(f"\n=== {len(stuck)} dossiers jamais passés au-delà du niveau {args.level:g}"
+              f" après {args.stuck_after} ===")
+        for file_id in stuck:
+            print(f"\n  {file_id}")
+            for event_date, event_type, level_before, level in timeline.events(file_id)[-args.events:]:
+                print(f"      {event_date} {event_type} (level {level_before} → {level})")
+    finally:
+        timeline.close()
+
+def _catalog(conn, catalog, args):
+    if args.invalidate is not None:
+        for parts in args.invalidate or [[]]:
+            count = catalog.invalidate(*parts)
+            print(f"🗑️  {'.'.join(parts) or 'Catalogue complet'} : {count} entrées supprimées")
+        return
+    print("🔄 Rechargement du catalogue (INFORMATION_SCHEMA)...")
+    refresh_catalog(conn, catalog, args.refresh or CATALOG_DATABASES)
+
+def _monitor(conn, catalog, args):
+    state = MonitorState()
+    try:
+        if args.every:
+            sessions = SessionPool(args.connect_fn, size=1)
+            sessions.adopt(conn)
+            try:
+                watch_stuck_files(sessions, state, interval=args.every, recovery_ids=args.recovery_ids)
+            finally:
+                sessions.close()
+        else:
+            monitor_stuck_files(conn, state, recovery_ids=args.recovery_ids)
+    finally:
+        state.close()
+
+def build_parser():
+    """Parseur de la ligne de commande : options globales + une sous-commande par fonction d'investigation"""
+    parser = argparse.ArgumentParser(description="PROD-28230 - Investigation Snowflake")
+    parser.add_argument("--offline", action="store_true",
+                        help="rejoue les résultats du cache local sans se connecter à Snowflake")
+    parser.add_argument("--no-cache", action="store_true", help="désactive le cache de résultats")
+    parser.add_argument("--profile", nargs="?", const="", metavar="RAPPORT.json",
+                        help="mesure chaque requête et écrit un rapport JSON + folded stacks")
+    parser.add_argument("--query-history", action="store_true",
+                        help="avec --profile : complète avec octets/partitions scannés (QUERY_HISTORY)")
+    parser.add_argument("--guard", choices=["warn", "block", "off"], default=QUERY_GUARD_MODE,
+                        help="EXPLAIN avant chaque lecture hors cache : avertit ou bloque au-delà du budget "
+                             "(défaut : %(default)s)")
+    parser.add_argument("--max-scan", type=_size_arg, default=QUERY_GUARD_MAX_BYTES, metavar="TAILLE",
+                        help="budget de scan par requête, ex. 500M, 10G (défaut : 10G)")
+    commands = parser.add_subparsers(dest="command", metavar="<commande>")
+
+    def command(name, run, help, dates=False, output=False, time_slice=False, result_cache=True):
+        sub = commands.add_parser(name, help=help, description=help)
+        sub.set_defaults(run=run, result_cache=result_cache)
+        if dates:
+            sub.add_argument("--from", dest="date_start", type=_date_arg, default=INCIDENT_DATE_START,
+                             metavar="AAAA-MM-JJ", help="début de la fenêtre (défaut : %(default)s)")
+            sub.add_argument("--to", dest="date_end", type=_date_arg, default=INCIDENT_DATE_END,
+                             metavar="AAAA-MM-JJ", help="fin de la fenêtre (défaut : %(default)s)")
+        if time_slice:
+            sub.add_argument("--time-slice", choices=list(TIME_SLICE_STEPS),
+                             help="scan découpé par tranches de temps en parallèle")
+        if output:
+            sub.add_argument("--output", "-o", metavar="FICHIER",
+                             help="écrit le résultat en " + " / ".join(sorted(set(SINKS))))
+        return sub
+
+    def ids(sub, *kinds):
+        helps = {
+            "customers": ("customer_ids", "customer IDs MongoDB"),
+            "accounts": ("accounts", "numéros de compte copropriétaire (CO_OWNER_ACCOUNT_NUMBER)"),
+            "recovery-ids": ("recovery_ids", "recovery file IDs"),
+        }
+        for kind in kinds:
+            dest, label = helps[kind]
+            sub.add_argument(f"--{kind}", dest=dest, type=_id_list, metavar="ID,...|@FICHIER",
+                             help=f"{label} (défaut : ceux de l'incident)")
+
+    snapshot_help = "recherches ponctuelles dans la copie locale de RECOVERY_CO (commande snapshot)"
+
+    sub = command("investigate", _investigate,
+                  "tables recovery puis historique des événements (commande par défaut)")
+    ids(sub, "accounts", "recovery-ids")
+    sub.add_argument("--limit", type=int, default=30)
+    sub.add_argument("--columnar", action="store_true", help="classification par lots Arrow")
+    sub.add_argument("--snapshot", action="store_true", help=snapshot_help)
+    # Sans sous-commande : investigate avec ses valeurs par défaut (pas de re-parse, --profile reste optionnel)
+    parser.set_defaults(**vars(sub.parse_args([])))
+
+    sub = command("all", lambda conn, catalog, a: investigate_overlapped(
+        conn, catalog, a.date_start, a.date_end, account_numbers=a.accounts, recovery_ids=a.recovery_ids,
+        time_slice=a.time_slice,
+    ), "étapes indépendantes en parallèle : erreurs de reminder, recovery, événements, fraîcheur des sources",
+        dates=True, time_slice=True)
+    ids(sub, "accounts", "recovery-ids")
+
+    sub = command("search-logs", lambda conn, catalog, a: search_logs(
+        conn, a.date_start, a.date_end, customer_ids=a.customer_ids, account_numbers=a.accounts,
+        limit=a.limit, time_slice=a.time_slice, output=a.output,
+    ), "logs liés aux relances contentieux", dates=True, output=True, time_slice=True)
+    ids(sub, "customers", "accounts")
+    sub.add_argument("--limit", type=int, default=500)
+
+    sub = command("reminder-errors", lambda conn, catalog, a: search_reminder_errors(
+        conn, a.date_start, a.date_end, limit=a.limit, time_slice=a.time_slice, output=a.output,
+    ), "erreurs de reminder (NOTHING_SENT, LEVEL_MISMATCHED...)", dates=True, output=True, time_slice=True)
+    sub.add_argument("--limit", type=int, default=200)
+
+    sub = command("grep-logs", lambda conn, catalog, a: grep_logs(
+        conn, a.patterns or None, a.date_start, a.date_end, refresh=a.refresh, ignore_case=a.ignore_case,
+        attributes=a.attributes, examples=a.examples,
+    ), "motifs cherchés localement dans une fenêtre de logs téléchargée une fois", dates=True)
+    sub.add_argument("patterns", nargs="*", metavar="MOTIF", help="défaut : codes de raison connus")
+    sub.add_argument("--refresh", action="store_true", help="retélécharge la fenêtre")
+    sub.add_argument("-i", "--ignore-case", action="store_true")
+    sub.add_argument("--attributes", action="store_true", help="cherche aussi dans ATTRIBUTES")
+    sub.add_argument("--examples", type=int, default=3)
+
+    sub = command("diagnose", lambda conn, catalog, a: diagnose_co_owners(
+        conn, IdentityMap.from_constants(a.customer_ids, a.accounts, a.recovery_ids), a.date_start, a.date_end,
+        output=a.output,
+    ), "diagnostic par copropriétaire : photo RECOVERY_CO + logs d'erreur", dates=True, output=True)
+    ids(sub, "customers", "accounts", "recovery-ids")
+
+    sub = command("stuck", lambda conn, catalog, a: detect_stuck_files(
+        conn, a.agencies, level=a.level, min_periods=a.min_periods, min_reminders=a.min_reminders, top=a.top,
+        output=a.output,
+    ), "dossiers bloqués sur tout l'historique RECOVERY_CO, toutes agences", output=True)
+    sub.add_argument("--agency", dest="agencies", action="append", metavar="AGENCE",
+                     help="limite aux agences indiquées (répétable)")
+    sub.add_argument("--level", type=int, default=1)
+    sub.add_argument("--min-periods", type=int, default=2)
+    sub.add_argument("--min-reminders", type=int, default=2)
+    sub.add_argument("--top", type=int, default=50)
+
+    sub = command("recovery", _recovery, "trouver et interroger les tables recovery")
+    ids(sub, "accounts")
+    sub.add_argument("--limit", type=int, default=30)
+    sub.add_argument("--columnar", action="store_true", help="classification par lots Arrow")
+    sub.add_argument("--snapshot", action="store_true", help=snapshot_help)
+
+    sub = command("events", _events, "historique des événements des recovery files")
+    ids(sub, "recovery-ids")
+    sub.add_argument("--snapshot", action="store_true", help=snapshot_help)
+
+    sub = command("snapshot", _snapshot, "copie locale de RECOVERY_CO (partitions DATE_PERIOD nouvelles ou "
+                  "modifiées) et recherches sans warehouse ; avec --offline : recherches seules",
+                  output=True, result_cache=False)
+    sub.add_argument("--full", action="store_true", help="retélécharge toutes les partitions")
+    lookup = sub.add_mutually_exclusive_group()
+    lookup.add_argument("--accounts", type=_id_list, metavar="ID,...|@FICHIER",
+                        help="recherche par numéros de compte copropriétaire")
+    lookup.add_argument("--recovery-ids", type=_id_list, metavar="ID,...|@FICHIER",
+                        help="recherche par recovery file IDs")
+    lookup.add_argument("--agency", dest="agencies", action="append", metavar="AGENCE",
+                        help="recherche par agence (répétable)")
+    lookup.add_argument("--between", nargs=3, metavar=("COLONNE", "MIN", "MAX"),
+                        help=f"recherche par plage (borne vide = ouverte) sur {', '.join(SNAPSHOT_INDEXES)}")
+
+    sub = command("timeline", _timeline, "chronologie locale des événements (EVENEMENTS aplati) : types "
+                  "d'événements, ou dossiers restés bloqués après un événement")
+    ids(sub, "recovery-ids")
+    sub.add_argument("--all-files", action="store_true", help="chronologie de tous les dossiers RECOVERY_CO")
+    sub.add_argument("--no-build", action="store_true", help="interroge la chronologie existante sans la recharger")
+    sub.add_argument("--client-side", action="store_true", help="parse EVENEMENTS côté client au lieu de FLATTEN")
+    sub.add_argument("--stuck-after", metavar="TYPE",
+                     help="dossiers qui n'ont jamais dépassé --level après un événement de ce type")
+    sub.add_argument("--level", type=float, default=1.0)
+    sub.add_argument("--events", type=int, default=5, help="derniers événements affichés par dossier")
+
+    sub = command("monitor", _monitor, "surveillance incrémentale des dossiers bloqués (delta depuis le "
+                  "dernier passage)", result_cache=False)
+    ids(sub, "recovery-ids")
+    sub.add_argument("--every", type=int, metavar="SECONDES", help="relance la surveillance à intervalle régulier")
+
+    sub = command("profile", lambda conn, catalog, a: profile_table(
+        conn, *a.table, catalog=catalog, sample_rows=a.sample_rows, top=a.top, refresh=a.refresh, output=a.output,
+    ), "profil des colonnes sur échantillon (NULL, cardinalité, min/max, top-k)", output=True)
+    sub.add_argument("table", type=_table_arg, metavar="DATABASE.SCHEMA.TABLE")
+    sub.add_argument("--sample-rows", type=int, default=PROFILE_SAMPLE_ROWS,
+                     help="taille visée de l'échantillon (défaut : %(default)s)")
+    sub.add_argument("--top", type=int, default=PROFILE_TOP_K, help="valeurs les plus fréquentes par colonne")
+    sub.add_argument("--refresh", action="store_true", help="recalcule le profil en cache")
+
+    sub = command("batch", _batch, "plusieurs incidents en parallèle (specs JSON) : pool de sessions et cache "
+                  "de résultats partagés, un rapport par incident")
+    sub.add_argument("specs", nargs="*", type=_spec_arg, metavar="SPEC.json",
+                     help=f"incident(s) : id, title, customer_ids, account_numbers, recovery_ids, date_start, "
+                          f"date_end, agencies, co_owners, checks ({', '.join(INCIDENT_CHECKS)}) ; défaut : "
+                          f"{INCIDENT_ID}")
+    sub.add_argument("--workers", type=int, default=INCIDENT_MAX_WORKERS,
+                     help="incidents en parallèle = sessions Snowflake max (défaut : %(default)s)")
+    sub.add_argument("--report-dir", metavar="DOSSIER", help="défaut : <cache>/reports")
+
+    sub = command("catalog", _catalog, "cache catalogue local : rechargement en bloc (INFORMATION_SCHEMA) "
+                  "ou invalidation")
+    action = sub.add_mutually_exclusive_group(required=True)
+    action.add_argument("--refresh", nargs="*", metavar="DATABASE",
+                        help=f"recharge les databases (défaut : {', '.join(CATALOG_DATABASES)})")
+    action.add_argument("--invalidate", nargs="*", type=_catalog_target_arg, metavar="DATABASE[.SCHEMA[.TABLE]]",
+                        help="supprime les entrées indiquées (sans argument : tout le catalogue)")
+
+    command("tables", lambda conn, catalog, a: list_available_tables(conn, catalog=catalog),
+            "databases, schémas et tables disponibles")
+    command("explore-datadog", lambda conn, catalog, a: explore_datadog_archive(conn, catalog=catalog),
+            "tables et structure de DATADOG_ARCHIVE")
+    sub = command("explore-plato", lambda conn, catalog, a: explore_plato_recoveryfiles(
+        conn, catalog=catalog, customer_ids=a.customer_ids,
+    ), "recovery files dans PLATO")
+    ids(sub, "customers")
+    command("explore-recovery-co", lambda conn, catalog, a: explore_recovery_co(conn, catalog=catalog),
+            "structure de DATAMART_ML_PROD.RECOVERY_CO")
+    command("query-recovery", lambda conn, catalog, a: query_recovery_data(conn, catalog=catalog),
+            "données RECOVERY_CO des copropriétaires concernés")
+    sub = command("explore-databases", lambda conn, catalog, a: explore_all_databases(conn, a.databases),
+                  "crawl des databases à la recherche des données")
+    sub.add_argument("--database", dest="databases", action="append", metavar="DATABASE",
+                     help="limite aux databases indiquées (répétable)")
+    command("search-recovery-tables", lambda conn, catalog, a: search_recovery_tables(conn),
+            "tables liées aux recovery files dans toutes les databases")
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    argv = sys.argv[1:] if argv is None else list(argv)
+    args = parser.parse_args(argv)
+    if args.command == "monitor" and args.offline:
+        parser.error("monitor lit le delta dans Snowflake : incompatible avec --offline")
+    if args.command == "batch" and args.no_cache:
+        parser.error("batch partage le cache de résultats entre incidents : incompatible avec --no-cache")
+
     print("=" * 60)
     print("PROD-28230 - Investigation Snowflake")
     print("Mises en demeure non envoyées - 04/11/2025")
     print("=" * 60)
 
-    conn = connect()
-    print("✅ Connecté à Snowflake\n")
+    guard = None if args.offline or args.guard == "off" else QueryGuard(args.guard, args.max_scan)
 
-    # Trouver et interroger les tables recovery
-    find_and_query_recovery(conn)
+    def open_connection():
+        conn = connect()
+        # Sous le cache : seules les requêtes réellement envoyées à Snowflake sont estimées
+        return conn if guard is None else GuardedConnection(conn, guard)
+
+    if args.offline:
+        conn = CachedConnection(None, ResultCache(), offline=True)
+        print("📦 Mode offline : résultats rejoués depuis le cache\n")
+    elif args.no_cache or not args.result_cache:
+        # Les requêtes delta changent à chaque passage : pas de cache de résultats en surveillance
+        conn = open_connection()
+        print("✅ Connecté à Snowflake\n")
+    else:
+        # Connexion (et import du connecteur) seulement au premier résultat absent du cache
+        conn = CachedConnection(None, ResultCache(), connect_fn=open_connection)
+    raw_conn = conn
+    profiler = None
+    if args.profile is not None:
+        profiler = QueryProfiler()
+        conn = ProfiledConnection(conn, profiler)
+    # Sessions supplémentaires (monitor --every) : même garde et même profilage que `conn`
+    args.connect_fn = open_connection if profiler is None else (
+        lambda: ProfiledConnection(open_connection(), profiler)
+    )
+    catalog = CatalogCache()
+
+    try:
+        args.run(conn, catalog, args)
+    except QueryBudgetExceeded as e:
+        print(f"\n🛑 Requête bloquée (--guard block, --max-scan {_format_bytes(args.max_scan)}) : {e}")
+    if guard is not None and guard.over_budget:
+        print(f"\n🛡️  {len(guard.over_budget)}/{len(guard.estimates)} requêtes estimées au-delà du budget")
 
-    # Vérifier l'historique des événements
-    check_events_history(conn)
+    if profiler is not None:
+        if args.query_history and not args.offline:
+            profiler.enrich_from_history(raw_conn)
+        profiler.print_summary()
+        path = args.profile or os.path.join(
+            CACHE_DIR, "profiles", f"run-{profiler.started_at:%Y%m%d-%H%M%S}.json"
+        )
+        for written in profiler.write_report(path):
+            print(f"  📄 {written}")
 
+    catalog.close()
     conn.close()
     print("\n✅ Terminé")
 
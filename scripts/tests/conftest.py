@@ -0,0 +1,38 @@
+"""Fixtures communes : faux warehouse SQLite (snowflake_fake), une copie par test qui le modifie"""
+
+import os
+import shutil
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import snowflake_fake as fake  # noqa: E402
+
+WAREHOUSE_ROWS = 2_400
+
+
+@pytest.fixture(scope="session")
+def seeded_warehouse(tmp_path_factory):
+    """Base seedée une fois pour la session (lecture seule)"""
+    return fake.seed_warehouse(str(tmp_path_factory.mktemp("warehouse") / "warehouse.sqlite"), WAREHOUSE_ROWS)
+
+
+@pytest.fixture
+def warehouse(seeded_warehouse, tmp_path):
+    """Copie privée du faux warehouse : (chemin, connexion SQLite directe pour le préparer / vérifier)"""
+    path = str(tmp_path / "warehouse.sqlite")
+    shutil.copy(seeded_warehouse, path)
+    db = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES)
+    yield path, db
+    db.close()
+
+
+@pytest.fixture
+def conn(warehouse):
+    """Faux connecteur sans latence sur la copie du warehouse"""
+    conn = fake.connect(data=warehouse[0], latency=0)
+    yield conn
+    conn.close()
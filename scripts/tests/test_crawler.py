@@ -0,0 +1,49 @@
+"""crawl_catalog : même catalogue quel que soit le parallélisme, erreurs par database"""
+
+import time
+
+import snowflake_fake as fake
+import snowflake_prod28230 as prod
+
+
+def test_catalog_matches_the_warehouse():
+    conn = fake.connect(latency=0)
+
+    catalog, errors = prod.crawl_catalog(conn, list(fake.DEFAULT_CATALOG), max_workers=4)
+
+    assert errors == {}
+    assert catalog == {
+        db: {schema: sorted(tables) for schema, tables in sorted(schemas.items())}
+        for db, schemas in fake.DEFAULT_CATALOG.items()
+    }
+
+
+def test_concurrency_does_not_change_the_result():
+    generated = fake.generate_catalog(databases=3, schemas=4, tables=5)
+    serial = prod.crawl_catalog(fake.connect(catalog=generated, latency=0), list(generated), max_workers=1)
+    parallel = prod.crawl_catalog(fake.connect(catalog=generated, latency=0), list(generated), max_workers=8)
+
+    assert serial == parallel
+
+
+def test_unknown_database_is_reported_without_stopping_the_crawl():
+    conn = fake.connect(latency=0)
+    databases = list(fake.DEFAULT_CATALOG) + ["INCONNUE"]
+
+    catalog, errors = prod.crawl_catalog(conn, databases, max_workers=4)
+
+    assert list(errors) == ["INCONNUE"]
+    assert isinstance(errors["INCONNUE"], fake.ProgrammingError)
+    assert catalog["INCONNUE"] == {}
+    assert all(catalog[db] for db in fake.DEFAULT_CATALOG)
+
+
+def test_parallel_crawl_overlaps_round_trips():
+    generated = fake.generate_catalog(databases=2, schemas=4, tables=3)
+
+    started = time.perf_counter()
+    prod.crawl_catalog(fake.connect(catalog=generated, latency=0.05), list(generated), max_workers=8)
+    elapsed = time.perf_counter() - started
+
+    # 2 SHOW SCHEMAS + 8 SHOW TABLES : 0,5 s en série, ~0,1 s en parallèle
+    assert elapsed < 0.35
@@ -0,0 +1,101 @@
+"""ResultCache : aller-retour disque, âge maximum, éviction LRU et rejeu --offline"""
+
+import os
+import time
+
+import pytest
+
+import snowflake_prod28230 as prod
+
+DESCRIPTION = [("ID", 2, None, None, None, None, True), ("NAME", 2, None, None, None, None, True)]
+ROWS = [(1, "un"), (2, "deux"), (3, None)]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return prod.ResultCache(str(tmp_path / "results"))
+
+
+def _entries(cache):
+    return sorted(name for name in os.listdir(cache.path) if not name.startswith("."))
+
+
+def test_store_then_load_round_trip(cache):
+    key = cache.key("SELECT ID, NAME FROM T")
+    cache.store(key, DESCRIPTION, ROWS)
+
+    description, rows = cache.load(key)
+
+    assert [tuple(d) for d in description] == DESCRIPTION
+    assert [tuple(row) for row in rows] == ROWS
+
+
+def test_key_ignores_comments_and_whitespace(cache):
+    assert cache.key("SELECT 1 -- essai\n  FROM T;") == cache.key("SELECT 1 FROM T")
+    assert cache.key("SELECT 1 FROM T", params=(1,)) != cache.key("SELECT 1 FROM T")
+
+
+def test_expired_entry_is_not_served(cache):
+    key = cache.key("SELECT ID, NAME FROM T")
+    cache.store(key, DESCRIPTION, ROWS)
+    for path in cache._files(key):
+        if os.path.exists(path):
+            os.utime(path, (time.time(), time.time() - 3600))
+
+    assert cache.load(key, max_age=60) is None
+    assert cache.load(key, max_age=0) is not None  # --offline : pas d'âge maximum
+
+
+def test_store_replaces_the_other_format(cache):
+    key = cache.key("SELECT ID, NAME FROM T")
+    arrow_path, pickle_path = cache._files(key)
+    with open(pickle_path, "wb") as f:
+        f.write(b"ancienne entree")
+    with open(arrow_path, "wb") as f:
+        f.write(b"ancienne entree")
+
+    cache.store(key, DESCRIPTION, ROWS)
+
+    assert len(_entries(cache)) == 1
+    assert [tuple(row) for row in cache.load(key)[1]] == ROWS
+
+
+def test_eviction_drops_least_recently_used(tmp_path):
+    cache = prod.ResultCache(str(tmp_path / "results"))
+    keys = [cache.key(f"SELECT {i}") for i in range(3)]
+    for key in keys:
+        cache.store(key, DESCRIPTION, ROWS * 50)
+    sizes = {name: os.path.getsize(os.path.join(cache.path, name)) for name in _entries(cache)}
+    # Dernier accès : 0 le plus ancien, puis 2, puis 1
+    for age, key in ((300, keys[0]), (100, keys[2]), (200, keys[1])):
+        for path in cache._files(key):
+            if os.path.exists(path):
+                os.utime(path, (time.time() - age, time.time()))
+
+    cache.max_bytes = sum(sizes.values()) - 1
+    cache.evict()
+
+    assert cache.load(keys[0]) is None
+    assert cache.load(keys[1]) is not None
+    assert cache.load(keys[2]) is not None
+
+
+def test_offline_replays_online_results(conn, cache):
+    online = prod.CachedConnection(conn, cache)
+    cursor = online.cursor()
+    cursor.execute("SELECT AGENCY_NAME, COUNT(*) FROM RECOVERY_CO GROUP BY AGENCY_NAME ORDER BY 1")
+    expected = cursor.fetchall()
+    sent = len(conn.queries)
+
+    replay = prod.CachedConnection(None, cache, offline=True).cursor()
+    replay.execute("SELECT AGENCY_NAME, COUNT(*)\n  FROM RECOVERY_CO GROUP BY AGENCY_NAME ORDER BY 1")
+
+    assert [tuple(row) for row in replay.fetchall()] == [tuple(row) for row in expected]
+    assert len(conn.queries) == sent
+
+
+def test_offline_miss_raises(cache):
+    offline = prod.CachedConnection(None, cache, offline=True)
+
+    with pytest.raises(prod.OfflineCacheMiss):
+        offline.cursor().execute("SELECT * FROM RECOVERY_CO")
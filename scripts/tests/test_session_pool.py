@@ -0,0 +1,115 @@
+"""SessionPool : réutilisation des sessions, borne `size` (keep-alive compris), éviction des inactives"""
+
+import threading
+import time
+
+import pytest
+
+import snowflake_prod28230 as prod
+
+
+class StubSession:
+    """Session factice : compte les sessions ouvertes en même temps, SELECT 1 lent"""
+
+    lock = threading.Lock()
+    live = 0
+    peak = 0
+
+    def __init__(self, ping=0.0):
+        self.ping = ping
+        self.closed = False
+        with StubSession.lock:
+            StubSession.live += 1
+            StubSession.peak = max(StubSession.peak, StubSession.live)
+
+    def cursor(self):
+        return self
+
+    def execute(self, query):
+        time.sleep(self.ping)
+        return self
+
+    def is_closed(self):
+        return self.closed
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            with StubSession.lock:
+                StubSession.live -= 1
+
+
+@pytest.fixture(autouse=True)
+def reset_counters():
+    StubSession.live = StubSession.peak = 0
+
+
+def test_sessions_are_reused():
+    pool = prod.SessionPool(StubSession, size=2, keep_alive=None)
+    for _ in range(5):
+        with pool.connection():
+            pass
+
+    assert pool.created == 1
+    pool.close()
+    assert StubSession.live == 0
+
+
+def test_size_is_never_exceeded_during_keep_alive():
+    # Pings lents et sessions souvent libres : acquire() tombe pendant la maintenance
+    pool = prod.SessionPool(lambda: StubSession(ping=0.05), size=3, idle_timeout=60, keep_alive=0.005)
+    pool.prewarm()
+    stop = time.monotonic() + 1.0
+
+    def worker():
+        while time.monotonic() < stop:
+            with pool.connection():
+                time.sleep(0.002)
+            time.sleep(0.01)
+
+    threads = [threading.Thread(target=worker) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    pool.close()
+
+    assert StubSession.peak <= 3
+    assert pool.created <= 3
+    assert StubSession.live == 0
+
+
+def test_acquire_times_out_when_every_session_is_busy():
+    pool = prod.SessionPool(StubSession, size=1, keep_alive=None)
+    conn = pool.acquire()
+
+    with pytest.raises(TimeoutError):
+        pool.acquire(timeout=0.05)
+    pool.release(conn)
+    pool.close()
+
+
+def test_idle_sessions_are_closed_after_timeout():
+    pool = prod.SessionPool(StubSession, size=2, idle_timeout=0.05, keep_alive=0.02)
+    with pool.connection() as conn:
+        pass
+    deadline = time.monotonic() + 2
+    while not conn.closed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    pool.close()
+
+    assert conn.closed
+
+
+def test_dropped_session_is_replaced():
+    pool = prod.SessionPool(StubSession, size=1, keep_alive=None)
+    with pytest.raises(RuntimeError):
+        with pool.connection() as conn:
+            conn.close()
+            raise RuntimeError("session perdue")
+    with pool.connection() as replacement:
+        pass
+    pool.close()
+
+    assert replacement is not conn
+    assert pool.created == 2
@@ -0,0 +1,75 @@
+"""RecoverySnapshot : refresh par partition DATE_PERIOD et recherches sur la copie locale"""
+
+import pytest
+
+import snowflake_prod28230 as prod
+
+LATEST = "2025-12-01"
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    snapshot = prod.RecoverySnapshot(str(tmp_path / "recovery_co.sqlite"))
+    yield snapshot
+    snapshot.close()
+
+
+def _periods(db):
+    return {str(period): count for period, count in db.execute(
+        "SELECT DATE_PERIOD, COUNT(*) FROM RECOVERY_CO GROUP BY DATE_PERIOD")}
+
+
+def test_first_refresh_pulls_every_partition(conn, warehouse, snapshot):
+    _, db = warehouse
+
+    pulled = snapshot.refresh(conn)
+
+    assert pulled == _periods(db)
+    partitions, rows, fetched_at = snapshot.summary()
+    assert (partitions, rows) == (len(pulled), sum(pulled.values()))
+    assert fetched_at is not None
+
+
+def test_second_refresh_only_pulls_the_latest_partition(conn, snapshot):
+    snapshot.refresh(conn)
+
+    assert list(snapshot.refresh(conn)) == [LATEST]
+    assert len(snapshot.refresh(conn, full=True)) == 12
+
+
+def test_changed_partition_is_pulled_again(conn, warehouse, snapshot):
+    _, db = warehouse
+    snapshot.refresh(conn)
+    db.execute("DELETE FROM RECOVERY_CO WHERE DATE_PERIOD = '2025-03-01' AND rowid % 10 = 0")
+    db.commit()
+
+    pulled = snapshot.refresh(conn)
+
+    assert sorted(pulled) == ["2025-03-01", LATEST]
+    assert pulled["2025-03-01"] == _periods(db)["2025-03-01"]
+    assert snapshot.summary()[1] == sum(_periods(db).values())
+
+
+def test_partition_dropped_remotely_is_dropped_locally(conn, warehouse, snapshot):
+    _, db = warehouse
+    snapshot.refresh(conn)
+    db.execute("DELETE FROM RECOVERY_CO WHERE DATE_PERIOD = '2025-01-01'")
+    db.commit()
+
+    assert list(snapshot.refresh(conn)) == [LATEST]
+
+    assert snapshot.summary()[:2] == (11, sum(_periods(db).values()))
+    assert list(snapshot.lookup("DATE_PERIOD", ["2025-01-01"])) == []
+
+
+def test_lookup_returns_the_warehouse_rows_with_their_types(conn, warehouse, snapshot):
+    _, db = warehouse
+    snapshot.refresh(conn)
+    columns = ["CO_OWNER_ACCOUNT_NUMBER", "DATE_PERIOD", "AMOUNT", "LAST_REMINDER_DATE"]
+    account = db.execute("SELECT CO_OWNER_ACCOUNT_NUMBER FROM RECOVERY_CO LIMIT 1").fetchone()[0]
+
+    rows = snapshot.lookup("CO_OWNER_ACCOUNT_NUMBER", [account], columns=columns, order_by="DATE_PERIOD")
+
+    expected = db.execute(f"SELECT {', '.join(columns)} FROM RECOVERY_CO "
+                          "WHERE CO_OWNER_ACCOUNT_NUMBER = ? ORDER BY DATE_PERIOD", (account,)).fetchall()
+    assert [tuple(row) for row in rows] == expected
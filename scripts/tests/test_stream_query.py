@@ -0,0 +1,53 @@
+"""stream_query : pagination keyset (égalités sur la borne d'une page, clés NULL) et chemin LIMIT"""
+
+import snowflake_prod28230 as prod
+
+QUERY = f"SELECT TIMESTAMP, MESSAGE, ATTRIBUTES FROM LOGS_ML WHERE {prod.KEYSET}"
+
+
+def _all_logs(db):
+    return db.execute("SELECT TIMESTAMP, MESSAGE, ATTRIBUTES FROM LOGS_ML").fetchall()
+
+
+def test_keyset_returns_every_row_once_in_key_order(conn, warehouse):
+    _, db = warehouse
+    rows = list(prod.stream_query(conn, QUERY, key=("TIMESTAMP", 0), batch_size=97))
+
+    assert sorted(rows) == sorted(_all_logs(db))
+    keys = [row[0] for row in rows]
+    assert keys == sorted(keys, reverse=True)
+
+
+def test_keyset_rereads_ties_cut_by_a_page(conn, warehouse):
+    _, db = warehouse
+    # Quatre horodatages seulement : chaque page s'arrête au milieu d'une valeur
+    db.execute("UPDATE LOGS_ML SET TIMESTAMP = '2025-11-0' || (1 + rowid % 4) || ' 12:00:00'")
+    db.commit()
+
+    rows = list(prod.stream_query(conn, QUERY, key=("TIMESTAMP", 0), batch_size=50))
+
+    assert sorted(rows) == sorted(_all_logs(db))
+    keys = [row[0] for row in rows]
+    assert keys == sorted(keys, reverse=True)
+
+
+def test_keyset_keeps_null_keys_first(conn, warehouse):
+    _, db = warehouse
+    db.execute("UPDATE LOGS_ML SET TIMESTAMP = NULL WHERE rowid % 100 = 0")
+    db.commit()
+    nulls = db.execute("SELECT COUNT(*) FROM LOGS_ML WHERE TIMESTAMP IS NULL").fetchone()[0]
+
+    rows = list(prod.stream_query(conn, QUERY, key=("TIMESTAMP", 0), batch_size=97))
+
+    assert len(rows) == len(_all_logs(db))
+    assert [row[0] for row in rows[:nulls]] == [None] * nulls
+    assert None not in [row[0] for row in rows[nulls:]]
+
+
+def test_limit_uses_a_single_ordered_query(conn, warehouse):
+    _, db = warehouse
+    rows = list(prod.stream_query(conn, QUERY, "TIMESTAMP DESC", limit=25, key=("TIMESTAMP", 0)))
+
+    expected = db.execute("SELECT TIMESTAMP FROM LOGS_ML ORDER BY TIMESTAMP DESC LIMIT 25").fetchall()
+    assert [row[0] for row in rows] == [row[0] for row in expected]
+    assert len(conn.queries) == 1
@@ -0,0 +1,78 @@
+"""scan_time_slices : fusion k-way des tranches par ordre décroissant, arrêt à `limit`"""
+
+import time
+
+import pytest
+
+import snowflake_fake as fake
+import snowflake_prod28230 as prod
+
+QUERY = f"SELECT TIMESTAMP, SERVICE, MESSAGE FROM LOGS_ML WHERE {prod.TIME_SLICE}"
+START, END = "2025-11-03", "2025-11-06"
+
+
+def _expected(db, limit=None):
+    sql = f"SELECT TIMESTAMP, SERVICE, MESSAGE FROM LOGS_ML WHERE TIMESTAMP BETWEEN '{START}' AND '{END}'"
+    sql += " ORDER BY TIMESTAMP DESC"
+    if limit is not None:
+        sql += f" LIMIT {limit}"
+    return db.execute(sql).fetchall()
+
+
+def test_time_slices_cover_the_window_newest_first():
+    slices = prod.time_slices(START, END, "day")
+
+    assert [(lo.day, hi.day, inclusive) for lo, hi, inclusive in slices] == [
+        (5, 6, True), (4, 5, False), (3, 4, False),
+    ]
+
+
+@pytest.mark.parametrize("step", ["day", "hour"])
+def test_merge_is_ordered_and_complete(conn, warehouse, step):
+    _, db = warehouse
+    rows = list(prod.scan_time_slices(conn, QUERY, "TIMESTAMP", START, END, step, max_workers=4, batch_size=64))
+
+    expected = _expected(db)
+    assert sorted(rows) == sorted(expected)
+    assert [row[0] for row in rows] == [row[0] for row in expected]
+
+
+def test_limit_returns_the_newest_rows(conn, warehouse):
+    _, db = warehouse
+    rows = list(prod.scan_time_slices(conn, QUERY, "TIMESTAMP", START, END, "hour", limit=40, batch_size=16))
+
+    assert [row[0] for row in rows] == [row[0] for row in _expected(db, 40)]
+
+
+def test_empty_window_yields_nothing(conn):
+    rows = prod.scan_time_slices(conn, QUERY, "TIMESTAMP", START, START, "day")
+
+    assert list(rows) == []
+
+
+def test_failing_slice_closes_the_other_cursors(warehouse, monkeypatch):
+    opened, closed = [], []
+    execute, close = fake.FakeCursor.execute, fake.FakeCursor.close
+
+    def failing_execute(cursor, query, params=None):
+        if "2025-11-04 00:00:00" in query and "< '2025-11-05" in query:
+            raise fake.ProgrammingError("tranche en échec")
+        result = execute(cursor, query, params)
+        opened.append(cursor)
+        return result
+
+    def tracked_close(cursor):
+        closed.append(cursor)
+        close(cursor)
+
+    monkeypatch.setattr(fake.FakeCursor, "execute", failing_execute)
+    monkeypatch.setattr(fake.FakeCursor, "close", tracked_close)
+    conn = fake.connect(data=warehouse[0], latency=0)
+
+    with pytest.raises(fake.ProgrammingError):
+        list(prod.scan_time_slices(conn, QUERY, "TIMESTAMP", START, END, "day", max_workers=1))
+    # Les tranches encore en route sont fermées à leur fin
+    deadline = time.monotonic() + 5
+    while len(closed) < len(opened) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert opened and set(closed) == set(opened)